@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+replace_vars 性能基准：生成合成交付物目录，对检查、渲染、stream_replace 及 replace_k8s_images 计时，
+并与保存的基线比较，超出容差时返回非 0 退出码，用于发现热点路径的性能回退。
+冷启动（新进程检查一个很小的交付物）同时计时，超过目标时间同样返回非 0 退出码。
+
+    python bench_replace_vars.py --preset medium --save_baseline bench_baseline.json
+    python bench_replace_vars.py --preset medium --baseline bench_baseline.json --tolerance 0.2
+
+仓库中的 bench_baseline.json 为 medium 预设的基线，CI 在 ubuntu 上以 --tolerance 1.0 与其比较（运行机器与记录基线的机器不同，
+只用于发现成倍的回退）；热点路径有意变化后使用第一条命令重新生成并随改动一起提交。
+    python bench_replace_vars.py --cold_start_only --binary dist/replace_vars-onedir/replace_vars-onedir
+"""
+
+import os
+import io
+import csv
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import platform
+import statistics
+import subprocess
+
+import replace_vars
+
+# 预设规模：模版文件数、单个文件字节数、每 KB 占位符个数、字符串占位符（\\x02）比例、二进制制品数、多文档 yaml 个数
+PRESETS = {
+    'small': dict(files=20, file_size=4 * 1024, density=4, string_ratio=0.5, binaries=2, deployments=5),
+    'medium': dict(files=200, file_size=64 * 1024, density=8, string_ratio=0.5, binaries=10, deployments=30),
+    'large': dict(files=1000, file_size=256 * 1024, density=16, string_ratio=0.5, binaries=20, deployments=100),
+}
+VAR_COUNT = 200
+# 冷启动目标时间（秒），取多次中的最小值比较
+DEFAULT_COLD_START_TARGET = 0.5
+REPLACE_VARS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replace_vars.py')
+FILLER_WORDS = ('server', 'listen', 'upstream', 'timeout', 'location', 'proxy_pass', 'retry', 'cache', 'worker',
+                'export', 'echo', 'config', 'enabled', 'replicas', 'namespace', 'image', 'port', 'path')
+
+
+def to_csv(rows, bom=False):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return ('\ufeff' if bom else '') + buf.getvalue()
+
+
+def write_file(root, rel_path, data):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data.encode() if isinstance(data, str) else data)
+    return path
+
+
+class PackageGenerator(object):
+    """按规模参数生成合成交付物目录，包含合法的 global-vars、deploy、script 三个中控类 csv"""
+
+    def __init__(self, files=20, file_size=4 * 1024, density=4, string_ratio=0.5, binaries=2, deployments=5,
+                 var_count=VAR_COUNT, seed=0):
+        self.files, self.file_size, self.density, self.string_ratio = files, file_size, density, string_ratio
+        self.binaries, self.deployments, self.var_count = binaries, deployments, var_count
+        self.random = random.Random(seed)
+        self.variables = self.make_variables()
+
+    def make_variables(self):
+        variables = []
+        for i in range(self.var_count):
+            var_type = ('字符串', '数值', '布尔')[i % 3]
+            value = {'字符串': f'value-{i}.svc.cluster.local', '数值': str(i * 7), '布尔': 'true'}[var_type]
+            variables.append((f'VAR_{i:04d}', var_type, value))
+        return variables
+
+    def placeholder(self, key=None):
+        key = key or self.random.choice(self.variables)[0]
+        if self.random.random() < self.string_ratio:
+            return f'\\x02{key}\\x03'
+        return f'\x02{key}\x03'
+
+    def text(self, size):
+        """生成约 size 字节的文本，按 density（每 KB 个数）插入占位符"""
+        lines, total, per_line = [], 0, max(1, round(self.density * 80 / 1024)) if self.density else 0
+        probability = min(1.0, self.density * 80 / 1024) if self.density else 0
+        while total < size:
+            words = [self.random.choice(FILLER_WORDS) for _ in range(10)]
+            if probability and self.random.random() < probability:
+                for _ in range(per_line):
+                    words.insert(self.random.randrange(len(words) + 1), self.placeholder())
+            line = ' '.join(words) + '\n'
+            lines.append(line)
+            total += len(line.encode())
+        return ''.join(lines)
+
+    def deployment_yaml(self, i):
+        """多文档 yaml：Deployment + Service，镜像为 DEFAULT_IMAGE_PREFIX 下的引用"""
+        return (f'# deployment {i}\n'
+                f'apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: app-{i}\n'
+                f'  namespace: {self.placeholder("VAR_0000")}\n'
+                f'spec:\n  replicas: {self.placeholder("VAR_0001")}\n  template:\n    spec:\n'
+                f'      initContainers:\n      - name: init\n        image: "busybox:1.36"\n'
+                f'      containers:\n      - name: app-{i}\n'
+                f'        image: {replace_vars.DEFAULT_IMAGE_PREFIX}/app-{i}:1.0.{i}\n'
+                f'        env:\n        - name: HOST\n          value: "{self.placeholder("VAR_0003")}"\n'
+                f'---\napiVersion: v1\nkind: Service\nmetadata:\n  name: app-{i}\n'
+                f'  namespace: {self.placeholder("VAR_0000")}\nspec:\n  ports:\n  - port: 80\n')
+
+    def generate(self, root):
+        """
+        生成交付物目录
+        :param root: 目标目录，不存在时创建
+        :return: root
+        """
+        var_rows = [['序号', '变量键（KEY）', '变量描述', '变量类型', '填写示例', '文件路径', '填写说明']]
+        var_rows.extend([str(i + 1), key, 'bench', var_type, value, '', '']
+                        for i, (key, var_type, value) in enumerate(self.variables))
+        write_file(root, 'controls/global-vars.csv', to_csv(var_rows, True))
+        deploy_rows = [['步骤', '资源类型', '资源名称', '命名空间', '部署类型', 'YAML路径', '镜像包名称', '备注'],
+                       ['1', 'Namespace', 'bench', 'bench', '更新', 'k8s-resources/bench-namespace.yaml', '', ''],
+                       ['2', 'ConfigMap', 'bench', 'bench', '更新', 'k8s-resources/bench-configmap.yaml', '', '']]
+        write_file(root, 'k8s-resources/bench-namespace.yaml',
+                   f'apiVersion: v1\nkind: Namespace\nmetadata:\n  name: {self.placeholder("VAR_0000")}\n')
+        write_file(root, 'k8s-resources/bench-configmap.yaml',
+                   'apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: bench\ndata:\n' +
+                   ''.join(f'  k{i}: "{self.placeholder(key)}"\n' for i, (key, _, _) in enumerate(self.variables)))
+        for i in range(self.deployments):
+            rel_path = f'k8s-resources/app-{i}-deployment.yaml'
+            write_file(root, rel_path, self.deployment_yaml(i))
+            deploy_rows.append([str(i + 3), 'Deployment', f'app-{i}', 'bench', '更新', rel_path,
+                                f'{replace_vars.DEFAULT_IMAGE_PREFIX}/app-{i}:1.0.{i}', ''])
+        write_file(root, 'controls/deploy-execution-plan.csv', to_csv(deploy_rows))
+        script_rows = [['步骤', '脚本路径', '是否幂等', '是否依赖', '执行机类型', '执行用户', 'K8S命名空间', '负载资源名称', '备注']]
+        for i in range(self.files):
+            ext = ('.sh', '.conf', '.properties', '.sql')[i % 4]
+            rel_path = f'scripts/part-{i // 50}/file-{i}{ext}'
+            write_file(root, rel_path, self.text(self.file_size))
+            if ext == '.sh':
+                script_rows.append([str(len(script_rows)), rel_path, '是', '否', '宿主机', 'root', '', '', ''])
+        write_file(root, 'controls/script-execution-plan.csv', to_csv(script_rows))
+        for i in range(self.binaries):
+            # 扩展名及文件头两种识别方式各占一半
+            name = f'scripts/artifacts/image-{i}.tar.gz' if i % 2 else f'scripts/artifacts/blob-{i}.dat'
+            write_file(root, name, b'\x1f\x8b\x08\x00' + self.random.getrandbits(8 * self.file_size).to_bytes(
+                self.file_size, 'little'))
+        return root
+
+
+def measure(func, repeat, setup=None):
+    """
+    重复执行 func，每次执行前调用 setup（不计时）
+    :return: 每次的耗时（秒）
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def fresh_copy(template_dir, work_dir):
+    """复制一份未渲染的交付物目录"""
+    target = os.path.join(work_dir, 'pkg')
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(template_dir, target)
+    return target
+
+
+def run_exec_replace(install_dir, check, jobs, engine):
+    status, logs = replace_vars.exec_replace(install_dir, check=check, jobs=jobs, engine=engine,
+                                             old_image_prefix=replace_vars.DEFAULT_IMAGE_PREFIX,
+                                             new_image_prefix='swr.example.com/bench')
+    assert status, '\n'.join(str(log[0]) for log in logs if log[1] >= replace_vars.logging.ERROR)
+
+
+def largest_template(package_dir):
+    paths = [os.path.join(subdir, name) for subdir, _, files in os.walk(os.path.join(package_dir, 'scripts'))
+             for name in files if 'artifacts' not in subdir]
+    return max(paths, key=os.path.getsize)
+
+
+def run_benchmarks(package_dir, work_dir, variables, repeat=3, jobs=1, engine='regex'):
+    """
+    执行各项基准
+    :param package_dir: 生成的交付物目录，各项基准在其副本上执行
+    :param work_dir: 临时目录
+    :param variables: 生成交付物使用的变量 [(变量名, 类型, 值)]
+    :param repeat: 重复次数
+    :param jobs: exec_replace 的并行进程数
+    :param engine: exec_replace 使用的替换引擎
+    :return: {名称: {'times': [...], 'bytes': 处理字节数}}
+    """
+    results = dict()
+    package_bytes = sum(os.path.getsize(os.path.join(subdir, name))
+                        for subdir, _, files in os.walk(package_dir) for name in files)
+    check_dir = fresh_copy(package_dir, work_dir)
+    results['exec_replace_check'] = dict(
+        times=measure(lambda: run_exec_replace(check_dir, True, jobs, engine), repeat), bytes=package_bytes)
+    results['exec_replace_render'] = dict(
+        times=measure(lambda d: run_exec_replace(d, False, jobs, engine), repeat,
+                      lambda: (fresh_copy(package_dir, work_dir),)), bytes=package_bytes)
+    template_path = largest_template(package_dir)
+    variables = replace_vars.compile_var_table({key: value for key, _, value in variables})
+    for name in replace_vars.ENGINES:
+        results[f'stream_replace_{name}'] = dict(
+            times=measure(lambda: replace_vars.stream_replace(template_path, variables, check=True, positions=[],
+                                                              engine=name), repeat),
+            bytes=os.path.getsize(template_path))
+    # 镜像替换在渲染后执行，先渲染一份（不替换镜像）作为每次复制的源
+    rendered_dir = os.path.join(work_dir, 'rendered')
+    shutil.copytree(package_dir, rendered_dir)
+    status, logs = replace_vars.exec_replace(rendered_dir, jobs=jobs, engine=engine)
+    assert status, logs[-2][0]
+    results['replace_k8s_images'] = dict(
+        times=measure(lambda d: replace_vars.replace_k8s_images(d, replace_vars.DEFAULT_IMAGE_PREFIX,
+                                                                'swr.example.com/bench'), repeat,
+                      lambda: (fresh_copy(rendered_dir, work_dir),)),
+        bytes=sum(os.path.getsize(p) for p in replace_vars.query_k8s_yaml_paths(rendered_dir)))
+    return results
+
+
+def measure_cold_start(work_dir, repeat=3, binary=None):
+    """
+    冷启动计时：每次启动新进程检查一个很小的交付物，包含解释器/可执行文件启动、模块导入及检查
+    :param work_dir: 临时目录，同时作为子进程工作目录（日志文件写入该目录）
+    :param repeat: 重复次数
+    :param binary: 打包后的可执行文件，为空时使用当前解释器执行 replace_vars.py
+    :return: {'times': [...], 'bytes': 0}
+    """
+    package_dir = PackageGenerator(files=2, file_size=1024, density=2, binaries=0, deployments=1).generate(
+        os.path.join(work_dir, 'cold_start'))
+    command = [binary] if binary else [sys.executable, REPLACE_VARS_SCRIPT]
+
+    def _run():
+        subprocess.run(command + [package_dir, '--check'], cwd=work_dir, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+
+    return dict(times=measure(_run, repeat), bytes=0)
+
+
+def summarize(results):
+    """每项取最小值作为比较依据（受干扰最小），同时给出中位数及吞吐"""
+    summary = dict()
+    for name, ret in results.items():
+        best = min(ret['times'])
+        summary[name] = dict(best=round(best, 6), median=round(statistics.median(ret['times']), 6),
+                             throughput=round(ret['bytes'] / best) if best else 0)
+    return summary
+
+
+def compare_baseline(summary, baseline, tolerance):
+    """
+    与基线比较
+    :return: [(名称, 当前, 基线, 比值, 是否回退)]
+    """
+    rows = []
+    for name, ret in summary.items():
+        base = baseline.get('results', dict()).get(name)
+        if not base: continue
+        ratio = ret['best'] / base['best'] if base['best'] else 1.0
+        rows.append((name, ret['best'], base['best'], ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def print_summary(summary, comparison=()):
+    compared = {row[0]: row for row in comparison}
+    print(f'{"benchmark":<28}{"best(s)":>12}{"median(s)":>12}{"MB/s":>10}{"baseline":>12}{"ratio":>8}')
+    for name, ret in summary.items():
+        row = compared.get(name)
+        base = f'{row[2]:>12.4f}{row[3]:>8.2f}{" !" if row[4] else ""}' if row else ''
+        print(f'{name:<28}{ret["best"]:>12.4f}{ret["median"]:>12.4f}{ret["throughput"] / 1024 / 1024:>10.1f}{base}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replace_vars 性能基准')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small', help='合成交付物规模')
+    parser.add_argument('--files', type=int, help='模版文件数，覆盖预设')
+    parser.add_argument('--file_size', type=int, help='单个模版文件字节数，覆盖预设')
+    parser.add_argument('--density', type=float, help='每 KB 占位符个数，覆盖预设')
+    parser.add_argument('--string_ratio', type=float, help='字符串形式（\\\\x02）占位符比例，覆盖预设')
+    parser.add_argument('--binaries', type=int, help='二进制制品个数，覆盖预设')
+    parser.add_argument('--deployments', type=int, help='多文档 Deployment yaml 个数，覆盖预设')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，相同参数生成的交付物一致')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最小值比较')
+    parser.add_argument('--jobs', type=int, default=1, help='exec_replace 的并行进程数')
+    parser.add_argument('--engine', choices=replace_vars.ENGINES, default='regex', help='exec_replace 使用的替换引擎')
+    parser.add_argument('--keep', help='保留生成的交付物目录至该路径')
+    parser.add_argument('--baseline', help='基线 JSON，比较后超出容差时退出码为 1')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='相对基线允许变慢的比例，默认 0.2')
+    parser.add_argument('--save_baseline', help='将本次结果保存为基线 JSON')
+    parser.add_argument('--json', help='将本次结果保存为 JSON')
+    parser.add_argument('--binary', help='冷启动计时使用的可执行文件（如 PyInstaller 打包结果），默认使用当前解释器')
+    parser.add_argument('--cold_start_target', type=float, default=DEFAULT_COLD_START_TARGET,
+                        help=f'冷启动目标时间（秒），超过时退出码为 1，默认 {DEFAULT_COLD_START_TARGET}')
+    parser.add_argument('--cold_start_only', action='store_true', help='只执行冷启动计时')
+    args = parser.parse_args()
+    params = dict(PRESETS[args.preset])
+    params.update({k: getattr(args, k) for k in params if getattr(args, k) is not None})
+
+    with tempfile.TemporaryDirectory(prefix='bench_replace_vars.') as tmp:
+        results = dict()
+        if not args.cold_start_only:
+            generator = PackageGenerator(seed=args.seed, **params)
+            package_dir = generator.generate(os.path.join(tmp, 'template'))
+            args.keep and shutil.copytree(package_dir, args.keep)
+            results = run_benchmarks(package_dir, tmp, generator.variables, args.repeat, args.jobs, args.engine)
+        results['cold_start'] = measure_cold_start(tmp, args.repeat, args.binary)
+        summary = summarize(results)
+    report = dict(params=dict(params, preset=args.preset, seed=args.seed, jobs=args.jobs, engine=args.engine),
+                  python=platform.python_version(), platform=platform.platform(), results=summary)
+    comparison = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('params') != report['params']:
+            print(f'警告：基线参数与本次不一致 {baseline.get("params")}', file=sys.stderr)
+        comparison = compare_baseline(summary, baseline, args.tolerance)
+    print_summary(summary, comparison)
+    for path in filter(None, (args.save_baseline, args.json)):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    regressions = [row[0] for row in comparison if row[4]]
+    regressions and print(f'以下基准相对基线变慢超过 {args.tolerance:.0%}：{regressions}', file=sys.stderr)
+    slow_start = summary['cold_start']['best'] > args.cold_start_target
+    slow_start and print(f'冷启动 {summary["cold_start"]["best"]:.3f}s 超过目标 {args.cold_start_target}s', file=sys.stderr)
+    if regressions or slow_start:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,13 +4,25 @@ import os
 import re
 import csv
 import sys
+import mmap
+import stat
 import shutil
 import logging
 import tempfile
+import contextlib
 import argparse
+import fnmatch
+import json
+import time
+import copy
+import struct
+from bisect import bisect_left
+from itertools import accumulate
+from collections import Counter
 from typing import List, Tuple, Dict, Set
-from pathlib import Path
-import yaml
+
+# yaml、hashlib、tarfile、zipfile、concurrent.futures 及 multiprocessing 在用到时才导入，
+# 自动化中频繁调用的小交付物检查不承担这些模块的导入开销
 
 CONTROL_COLUMNS_MAP = {
     'var':
@@ -48,12 +60,70 @@ DEPLOY_NEED_IMAGE = {'deployment', 'statefulset', 'daemonset', 'job', 'cronjob'}
 DEPLOY_TYPE = {'更新', '下线', '重启', '镜像拉取'}
 # global-vars.csv columns
 VAR_TYPE = {'字符串', '数值', '布尔'}
+VAR_VALUE_PATTERN_MAP = {'数值': re.compile(r'[-+]?\d+(\.\d+)?([eE][-+]?\d+)?'),
+                         '布尔': re.compile(r'true|false', re.IGNORECASE)}
 CONTROL_TYPE_MAP = {'var': 'global-vars', 'deploy': 'deploy-execution-plan', 'script': 'script-execution-plan'}
 # 两种成对匹配：\x02…\x03 或 \\x02…\\x03，最长64个
 PATTERN_MAP = {'字符串和控制符': re.compile(br'\x02(.{1,64}?)\x03|\\x02(.{1,64}?)\\x03', re.DOTALL),
                '仅控制符': re.compile(br'\x02(.{1,64}?)\x03', re.DOTALL)}
+# 占位符两侧的边界标记
+BOUNDARY_TOKENS_MAP = {'字符串和控制符': ((b'\x02', b'\x03'), (b'\\x02', b'\\x03')), '仅控制符': ((b'\x02', b'\x03'),)}
 START_TOKENS_MAP: Dict[str, Tuple[bytes, ...]] = {'字符串和控制符': (b'\x02', b'\\x02'), '仅控制符': (b'\x02',), }
+# 单个占位符的最大字节数（边界标记 + 64），流式读取时块尾只需保留不足该长度的内容到下一轮
+PLACEHOLDER_MAX_LEN_MAP = {'字符串和控制符': len(b'\\x02') + 64 + len(b'\\x03'), '仅控制符': 1 + 64 + 1}
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# 替换引擎：regex 逐个匹配占位符后查表；trie 由已定义变量的完整占位符构建前缀树正则，整块批量替换
+ENGINES = ('regex', 'trie')
+# 二进制/制品文件识别：扩展名、文件头魔数、大小阈值及 .replaceignore，命中则不做占位符扫描
+BINARY_EXTENSIONS = {'.tar', '.gz', '.tgz', '.zip', '.jar', '.war', '.ear', '.7z', '.rar', '.xz', '.bz2', '.zst',
+                     '.img', '.iso', '.qcow2', '.rpm', '.deb', '.whl', '.so', '.dll', '.exe', '.bin', '.class',
+                     '.pyc', '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.pdf', '.woff', '.woff2', '.ttf',
+                     '.mp3', '.mp4'}
+BINARY_MAGIC_NUMBERS = ((0, b'\x1f\x8b'), (0, b'PK\x03\x04'), (0, b'PK\x05\x06'), (0, b'7z\xbc\xaf\x27\x1c'),
+                        (0, b'\xfd7zXZ\x00'), (0, b'\x28\xb5\x2f\xfd'), (0, b'Rar!\x1a\x07'), (0, b'\x7fELF'),
+                        (0, b'\x89PNG'), (0, b'\xff\xd8\xff'), (0, b'GIF8'), (0, b'%PDF'), (0, b'\xca\xfe\xba\xbe'),
+                        (257, b'ustar'))
+BINARY_SNIFF_SIZE = 8192
+DEFAULT_MAX_TEMPLATE_SIZE = 1024 * 1024 * 256
+REPLACE_IGNORE_FILE = '.replaceignore'
+# 增量检查缓存，保存于交付物目录
+SCAN_CACHE_FILE = '.replace_vars_cache'
+SCAN_CACHE_VERSION = 2
+# 占位符索引，保存于交付物目录
+PLACEHOLDER_INDEX_FILE = '.replace_vars_index'
+PLACEHOLDER_INDEX_VERSION = 1
+# 原地渲染时保留的原始模版目录，用于变量变化后只重新渲染受影响的文件
+TEMPLATE_STORE_DIR = '.replace_vars_templates'
+TEMPLATE_STORE_VARS_FILE = 'vars.json'
+# 工具在交付物根目录生成的文件及目录，输出交付物时不包含
+TOOL_STATE_FILES = (SCAN_CACHE_FILE, PLACEHOLDER_INDEX_FILE, TEMPLATE_STORE_DIR)
+# --output 支持的归档格式，其他路径视为输出目录
+ARCHIVE_SUFFIXES = ('.tar.gz', '.tgz', '.tar', '.zip')
+LINK_MODES = ('auto', 'reflink', 'hardlink', 'copy')
+# zip 成员直接复制压缩数据时用到的 zipfile 内部属性，缺少时改为解压后重新压缩
+ZIP_RAW_COPY_MODULE_ATTRS = ('structFileHeader', 'sizeFileHeader', 'stringFileHeader', '_FH_SIGNATURE',
+                             '_FH_FILENAME_LENGTH', '_FH_EXTRA_FIELD_LENGTH')
+ZIP_RAW_COPY_WRITER_ATTRS = ('fp', 'start_dir', 'filelist', 'NameToInfo', '_didModify')
+# Linux FICLONE ioctl，支持写时复制的文件系统（btrfs、xfs 等）上克隆文件
+FICLONE = 0x40049409
+# 需要替换镜像的容器列表字段
+CONTAINER_KEYS = ('containers', 'initContainers', 'ephemeralContainers')
+# 可以原样作为 plain 标量写入的镜像引用
+PLAIN_IMAGE_PATTERN = re.compile(r'[A-Za-z0-9_][\w./:@+-]*')
+# 标量节点起始位置的锚点（&name）及标签（!tag）
+NODE_PROPERTIES_PATTERN = re.compile(r'(?:[&!]\S*\s+)*')
 DEFAULT_IMAGE_PREFIX = 'swr.cn-north-4.myhuaweicloud.com/sl-shudi-pre_release'
+# 进程池 worker 中共享的变量表，由 init_worker 在每个进程启动时设置一次
+WORKER_VARIABLES: Dict[str, str] = dict()
+LOG_FORMATS = ('text', 'jsonl')
+# 进度刷新的最小间隔（秒）
+PROGRESS_INTERVAL = 0.5
+# --profile 报告中列出的最慢文件个数
+DEFAULT_PROFILE_TOP = 10
+# --watch 轮询文件变化的间隔（秒）
+DEFAULT_WATCH_INTERVAL = 0.5
+# 已解析的中控类 csv：绝对路径 -> ((inode, 修改时间, 大小), 行)
+CONTROLS_CSV_CACHE: Dict[str, tuple] = dict()
 
 
 class ErrorType(object):
@@ -69,6 +139,7 @@ class ErrorType(object):
     BOOL_ERROR = 9  # bool值类型错误
     SCRIPT_ENV_TYPE_ERROR = 10  # 脚本执行环境类型错误
     DEPLOY_IMG_REF_ERROR = 11  # 镜像引用不符合规范
+    VAR_VALUE_TYPE_ERROR = 12  # 变量值与变量类型不符
 
 
 ERROR_LOG_MAP = {
@@ -83,7 +154,8 @@ ERROR_LOG_MAP = {
     ErrorType.PATH_NOT_EXIST: '相对路径不存在，如多个文件路径则使用换行分隔，请调整！',
     ErrorType.BOOL_ERROR: '请填写是或否，如需补充说明请写至备注中。',
     ErrorType.SCRIPT_ENV_TYPE_ERROR: '请填写宿主机或容器，如需补充说明请写至备注中。',
-    ErrorType.DEPLOY_IMG_REF_ERROR: '镜像引用不符合规范，请调整！'
+    ErrorType.DEPLOY_IMG_REF_ERROR: '镜像引用不符合规范，请调整！',
+    ErrorType.VAR_VALUE_TYPE_ERROR: '与变量类型不符，数值请填写整数或小数，布尔请填写 true 或 false，请调整！'
 }
 
 
@@ -91,7 +163,571 @@ class CheckError(object):
     def __init__(self, error_type, error_values=()):
         self.error_type = error_type
         self.error_values = error_values
-        self.error_msg = ERROR_LOG_MAP[error_type].format(*error_values)
+
+    @property
+    def error_msg(self):
+        """错误信息在输出日志时才格式化，没有参数的信息原样返回（支持的资源类型列表中含有花括号）"""
+        error_msg = ERROR_LOG_MAP[self.error_type]
+        return error_msg.format(*self.error_values) if self.error_values else error_msg
+
+
+class PathLookup(object):
+    """
+    批量检查相对路径是否存在：每个父目录只列出一次，之后同目录下的检查直接查集合。
+    集合未命中、符号链接及含 .. 的路径回退 os.path.exists，结果与逐个检查一致（如大小写不敏感的文件系统）
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.listings = dict()
+
+    def listing(self, parent):
+        if parent not in self.listings:
+            try:
+                with os.scandir(parent) as it:
+                    self.listings[parent] = {entry.name for entry in it if not entry.is_symlink()}
+            except OSError:
+                self.listings[parent] = set()
+        return self.listings[parent]
+
+    def exists(self, rel_path):
+        path = os.path.join(self.root, rel_path)
+        if not rel_path or '..' in rel_path or rel_path.endswith(('/', os.sep)):
+            return os.path.exists(path)
+        parent, name = os.path.split(os.path.normpath(path))
+        return name in self.listing(parent) or os.path.exists(path)
+
+
+class VarTable(dict):
+    """
+    编译后的变量表，由 global-vars.csv 构建一次：变量名 -> 值，同时保存预先编码的字节键值，
+    匹配及渲染时直接查表，不再逐个 encode/decode。各文件及进程池 worker 只读共享。
+    """
+
+    def __init__(self, variables=()):
+        super().__init__(variables)
+        # 字节变量名 -> 变量名，字节变量名 -> 字节值，变量名 -> 字节值
+        self.raw_keys = {key.encode(): key for key in self}
+        self.raw_values = {key.encode(): value.encode() for key, value in self.items()}
+        self.encoded_values = {key: value.encode() for key, value in self.items()}
+        self.trie_matchers = dict()
+
+
+def compile_var_table(variables) -> VarTable:
+    """普通 dict 转换为 VarTable，已编译的变量表直接返回"""
+    return variables if isinstance(variables, VarTable) else VarTable(variables)
+
+
+class ScanRecord(object):
+    """
+    单次扫描的记录：变量表、k8s yaml 路径及各模版文件中占位符的位置 (start, end, key)，
+    渲染时按记录的位置直接拼接，无需再次扫描整个目录；命中增量缓存的文件没有位置记录，渲染时重新匹配。
+    image_spans 为检查时解析渲染后 k8s yaml 得到的 image 标量位置 {相对路径: [(start, end, style, kind, name)]}，
+    替换镜像时直接按位置改写，不再重复解析
+    """
+
+    def __init__(self, vars_map, deploy_yaml_paths, replace_mode='字符串和控制符'):
+        self.vars_map = vars_map
+        self.deploy_yaml_paths = deploy_yaml_paths
+        self.replace_mode = replace_mode
+        self.positions = dict()
+        self.image_spans = dict()
+        # 扫描成功的模版文件（含命中增量缓存、没有位置记录的文件）
+        self.scanned = []
+        # 是否有模版文件检查出现错误
+        self.failed = False
+
+    def fill_positions(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """命中增量缓存的文件没有位置记录，输出到目录或归档前只读地重新匹配占位符位置"""
+        for fp in self.scanned:
+            if fp not in self.positions:
+                self.positions[fp] = []
+                stream_replace(fp, dict(), self.replace_mode, chunk_size=chunk_size, positions=self.positions[fp])
+        return self
+
+
+class ScanCache(object):
+    """
+    增量检查缓存，按相对路径记录文件 mtime、大小、内容哈希及扫描结果（各占位符 key 的出现次数，
+    或文件头判定的跳过原因），文件未变化时不再读取。缓存与变量表无关，变量表变化时由 key 计数重新计算。
+    mtime 变化但大小一致时比较内容哈希，内容未变则继续使用缓存。内容哈希在扫描的同一次读取中计算，
+    文件头判定跳过的文件不记录哈希（mtime 变化时重新读取文件头判定）。
+    另外保存序列化的变量表，global-vars.csv 未变化时不再解析及校验。
+    常驻检查（--watch）时在内存中另外记录 k8s yaml 的校验结果，不写入缓存文件。
+    """
+
+    def __init__(self, install_dir, replace_mode='字符串和控制符', persist=True):
+        self.install_dir = install_dir
+        self.path = os.path.join(install_dir, SCAN_CACHE_FILE)
+        self.replace_mode, self.persist = replace_mode, persist
+        self.entries, self.hits, self.stats, self.hashes, self.dirty = dict(), dict(), dict(), dict(), False
+        self.var_table = None
+        self.yaml_results = dict()
+        persist and self.load()
+
+    def reset(self):
+        """常驻检查每轮开始前调用，清除上一轮的命中记录、文件状态及内容哈希"""
+        self.hits, self.stats, self.hashes = dict(), dict(), dict()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (ValueError, OSError):
+            return
+        if data.get('version') == SCAN_CACHE_VERSION and data.get('replace_mode') == self.replace_mode:
+            self.entries, self.var_table = data.get('files', dict()), data.get('var_table')
+
+    def save(self):
+        """写入缓存，清理本次未出现的文件"""
+        if not self.persist: return
+        live = {os.path.relpath(fp, self.install_dir) for fp in self.stats}
+        self.dirty = self.dirty or bool(self.entries.keys() - live)
+        if not self.dirty:
+            return
+        data = {'version': SCAN_CACHE_VERSION, 'replace_mode': self.replace_mode, 'var_table': self.var_table,
+                'files': {k: v for k, v in self.entries.items() if k in live}}
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.install_dir, delete=False) as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(f.name, self.path)
+
+    @staticmethod
+    def new_hasher():
+        import hashlib
+        return hashlib.blake2b(digest_size=16)
+
+    def file_hash(self, fp):
+        if fp not in self.hashes:
+            hasher = self.new_hasher()
+            with open(fp, 'rb') as f:
+                for block in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b''):
+                    hasher.update(block)
+            self.hashes[fp] = hasher.hexdigest()
+        return self.hashes[fp]
+
+    def lookup(self, fp):
+        """文件未变化时返回缓存记录，否则返回 None"""
+        st = os.stat(fp)
+        self.stats[fp] = (st.st_mtime_ns, st.st_size)
+        entry = self.entries.get(os.path.relpath(fp, self.install_dir))
+        if not self.unchanged(fp, entry, st):
+            return None
+        self.hits[fp] = entry
+        return entry
+
+    def unchanged(self, fp, entry, st):
+        """比较缓存记录与文件的大小、mtime，mtime 不同时比较内容哈希"""
+        if not entry or entry['size'] != st.st_size:
+            return False
+        if entry['mtime_ns'] != st.st_mtime_ns:
+            if not entry.get('hash') or entry['hash'] != self.file_hash(fp):
+                return False
+            entry['mtime_ns'], self.dirty = st.st_mtime_ns, True
+        return True
+
+    def lookup_var_table(self, csv_path):
+        """global-vars.csv 未变化时返回序列化的变量表记录"""
+        return self.var_table if self.unchanged(csv_path, self.var_table, os.stat(csv_path)) else None
+
+    def put_var_table(self, csv_path, vars_map, file_vars_map, error_logs):
+        st = os.stat(csv_path)
+        file_vars = {os.path.relpath(fp, self.install_dir): sorted(keys) for fp, keys in file_vars_map.items()}
+        self.var_table = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'hash': self.file_hash(csv_path),
+                          'variables': dict(vars_map), 'file_vars': file_vars, 'error_logs': error_logs}
+        self.dirty = True
+
+    def lookup_yaml(self, fp):
+        """k8s yaml 及变量表均未变化时返回上一轮的 (image 标量位置, 错误)"""
+        entry = self.yaml_results.get(fp)
+        if entry and entry[0] == (self.stats.get(fp), self.var_table and self.var_table['hash']):
+            return entry[1:]
+        return None
+
+    def put_yaml(self, fp, image_spans, error=None):
+        self.yaml_results[fp] = (self.stats.get(fp), self.var_table and self.var_table['hash']), image_spans, error
+
+    def get(self, fp):
+        return self.hits.get(fp)
+
+    def put(self, fp, digest=None, **result):
+        """记录文件的缓存结果，digest 为扫描时计算的内容哈希，为空时不记录哈希"""
+        mtime_ns, size = self.stats.get(fp) or (lambda st: (st.st_mtime_ns, st.st_size))(os.stat(fp))
+        self.entries[os.path.relpath(fp, self.install_dir)] = {'mtime_ns': mtime_ns, 'size': size,
+                                                               'hash': digest, **result}
+        self.dirty = True
+
+    def put_result(self, fp, replace_ret, positions, digest=None):
+        """缓存扫描结果，编码错误的告警同样缓存，其他错误下次重新扫描"""
+        matched_keys, missing_keys, status, replace_num, logs = replace_ret
+        if status:
+            self.put(fp, digest, keys=dict(Counter(key for _, _, key in positions)))
+        elif all(l[1] == logging.WARNING for l in logs):
+            self.put(fp, error=logs)
+
+    def replace_result(self, fp, variables, defined_keys):
+        """由缓存的 key 计数还原 replace_placeholders_in_file 的返回结果"""
+        entry = self.hits[fp]
+        if 'error' in entry:
+            return set(), set(), False, 0, entry['error']
+        keys = entry['keys']
+        matched_keys = {k for k in keys if k in variables}
+        missing_keys = set(keys) - matched_keys
+        replace_num = sum(keys[k] for k in matched_keys)
+        return matched_keys, missing_keys, True, replace_num, replace_result_logs(replace_num, matched_keys,
+                                                                                 missing_keys, defined_keys)
+
+
+class PlaceholderIndex(object):
+    """
+    占位符索引（紧凑 JSON），保存于交付物目录：
+    keys 记录每个变量出现的文件、字节偏移及行号 {key: {相对路径: [[offset, line], ...]}}，
+    files 记录每个文件的 mtime、大小及包含的变量，用于反查及判断索引是否过期。
+    偏移及行号均相对于扫描时的模版文件。
+    """
+
+    def __init__(self, install_dir, replace_mode='字符串和控制符', path=None):
+        self.install_dir = install_dir
+        self.path = path or os.path.join(install_dir, PLACEHOLDER_INDEX_FILE)
+        self.replace_mode = replace_mode
+        self.files, self.keys = dict(), dict()
+
+    def load(self):
+        assert os.path.exists(self.path), f'未发现占位符索引 {self.path}，请先使用 --index 执行检查生成索引！'
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        assert data.get('version') == PLACEHOLDER_INDEX_VERSION, '占位符索引版本不匹配，请使用 --index 重新生成！'
+        self.replace_mode, self.files, self.keys = data['replace_mode'], data['files'], data['keys']
+        return self
+
+    def save(self):
+        data = {'version': PLACEHOLDER_INDEX_VERSION, 'replace_mode': self.replace_mode, 'files': self.files,
+                'keys': self.keys}
+        with AtomicWriter(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+    def build(self, scan_record, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        由扫描记录生成索引，没有位置记录的文件（命中增量缓存）未变化时沿用旧索引，否则只读重新扫描
+        :param scan_record: 扫描记录
+        :param chunk_size: 流式读取的块大小
+        :return:
+        """
+        old = PlaceholderIndex(self.install_dir, self.replace_mode, self.path)
+        if os.path.exists(old.path):
+            try:
+                old.load()
+            except (AssertionError, ValueError, KeyError):
+                pass
+        self.files, self.keys = dict(), dict()
+        for fp in scan_record.scanned:
+            rel_path, st = os.path.relpath(fp, self.install_dir), os.stat(fp)
+            entry = old.files.get(rel_path)
+            positions = scan_record.positions.get(fp)
+            if positions is None and entry and old.replace_mode == self.replace_mode \
+                    and (entry['mtime_ns'], entry['size']) == (st.st_mtime_ns, st.st_size):
+                occurrences = {key: old.keys[key][rel_path] for key in entry['keys']}
+            else:
+                if positions is None:
+                    positions = []
+                    stream_replace(fp, dict(), self.replace_mode, chunk_size=chunk_size, positions=positions)
+                occurrences = dict()
+                for (start, _, key), line in zip(positions, query_position_lines(fp, positions, chunk_size)):
+                    occurrences.setdefault(key, []).append([start, line])
+            self.files[rel_path] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'keys': sorted(occurrences)}
+            for key, items in occurrences.items():
+                self.keys.setdefault(key, dict())[rel_path] = items
+        return self
+
+    def where(self, key):
+        """变量出现的位置 {相对路径: [[offset, line], ...]}"""
+        return self.keys.get(key, dict())
+
+    def impact(self, key):
+        """变量变化时需要重新渲染的文件"""
+        return sorted(self.keys.get(key, dict()))
+
+    def stale_files(self):
+        """索引生成后已变化或删除的文件"""
+        stale = []
+        for rel_path, entry in self.files.items():
+            fp = os.path.join(self.install_dir, rel_path)
+            st = os.path.exists(fp) and os.stat(fp)
+            if not st or (entry['mtime_ns'], entry['size']) != (st.st_mtime_ns, st.st_size):
+                stale.append(rel_path)
+        return stale
+
+
+class AtomicWriter(object):
+    """
+    在目标文件同目录下写临时文件，正常退出时 os.replace 原子替换目标文件并保留原文件权限；
+    出现异常或调用 discard() 时删除临时文件，目标文件保持不变
+    """
+
+    def __init__(self, path, mode='wb', **kwargs):
+        self.path, self.mode, self.kwargs = path, mode, kwargs
+        self.file, self.discarded = None, False
+
+    def __enter__(self):
+        dirname, basename = os.path.split(os.path.abspath(self.path))
+        self.file = tempfile.NamedTemporaryFile(self.mode, dir=dirname, prefix=f'.{basename}.', suffix='.tmp',
+                                                delete=False, **self.kwargs)
+        return self.file
+
+    def discard(self):
+        self.discarded = True
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.file.close()
+        if exc_type or self.discarded:
+            os.unlink(self.file.name)
+            return
+        os.path.exists(self.path) and shutil.copymode(self.path, self.file.name)
+        os.replace(self.file.name, self.path)
+
+
+class EventSink(object):
+    """
+    日志事件输出：模版文件处理完成即输出该文件的结果，不再累积全部日志后统一输出。
+    未指定 logger 时只在内存中收集日志（作为函数调用时随结果返回）；指定 logger 时逐条写入日志，
+    jsonl 格式另向 stream 每个事件输出一行 JSON 供流水线采集。文件数、字节数、替换位置数为累计计数，汇总由计数生成
+    """
+
+    def __init__(self, logger=None, log_format='text', progress=False, stream=None):
+        self.logger, self.log_format, self.progress = logger, log_format, progress
+        self.stream = stream or sys.stdout
+        self.records = []
+        self.total_files, self.done_files, self.ok_files, self.done_bytes, self.replace_num = 0, 0, 0, 0, 0
+        self.start_time, self.progress_time, self.progress_width = time.perf_counter(), 0.0, 0
+
+    def __iter__(self):
+        # 已输出的日志不再保留，只返回内存中收集的日志
+        return iter(self.records)
+
+    def write_event(self, event, **fields):
+        if self.log_format != 'jsonl': return
+        self.clear_progress()
+        self.stream.write(json.dumps(dict(event=event, time=round(time.time(), 3), **fields), ensure_ascii=False))
+        self.stream.write('\n')
+        self.stream.flush()
+
+    def log(self, message, level=logging.INFO):
+        self.clear_progress()
+        self.logger.log(level, message)
+
+    def append(self, record):
+        """兼容日志列表的 [日志, 级别]"""
+        if self.logger is None:
+            self.records.append(record)
+            return
+        self.log(*record)
+        self.write_event('log', level=logging.getLevelName(record[1]), message=record[0])
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def start(self, total_files):
+        """开始处理一批模版文件，用于显示进度"""
+        self.total_files += total_files
+        self.show_progress(True)
+
+    def file_done(self, rel_path, file_logs, size=0, status=True, replace_num=0):
+        """
+        单个模版文件处理完成，立即输出该文件的日志并累计计数
+        :param rel_path: 相对路径
+        :param file_logs: [[日志, 级别]]
+        :param size: 文件字节数
+        :param status: 是否成功
+        :param replace_num: 替换位置个数
+        :return:
+        """
+        self.done_files, self.ok_files = self.done_files + 1, self.ok_files + bool(status)
+        self.done_bytes, self.replace_num = self.done_bytes + size, self.replace_num + replace_num
+        header = [f'-----------------  检查文件:{rel_path}  -----------------', logging.INFO]
+        if self.logger is None:
+            self.records.append(header)
+            self.records.extend(file_logs)
+            return
+        for message, level in [header, *file_logs]:
+            self.log(message, level)
+        event_logs = [dict(level=logging.getLevelName(level), message=message) for message, level in file_logs]
+        self.write_event('file', path=rel_path, status=bool(status), bytes=size, replace_num=replace_num,
+                         logs=event_logs)
+        self.show_progress()
+
+    def summary(self):
+        """由累计计数生成汇总"""
+        seconds = time.perf_counter() - self.start_time
+        return dict(files=self.done_files, ok=self.ok_files, failed=self.done_files - self.ok_files,
+                    bytes=self.done_bytes, replace_num=self.replace_num, seconds=round(seconds, 3),
+                    throughput=round(self.done_bytes / seconds) if seconds > 0 else 0)
+
+    def progress_line(self):
+        summary = self.summary()
+        return f'已处理 {summary["files"]}/{self.total_files} 个文件，扫描 {format_size(summary["bytes"])}，' \
+               f'{format_size(summary["throughput"])}/s，耗时 {summary["seconds"]:.1f}s'
+
+    def show_progress(self, force=False):
+        """在 stderr 同一行刷新进度，按 PROGRESS_INTERVAL 限制刷新频率"""
+        now = time.perf_counter()
+        if not self.progress or not force and now - self.progress_time < PROGRESS_INTERVAL: return
+        line = self.progress_line()
+        sys.stderr.write('\r' + line)
+        sys.stderr.flush()
+        self.progress_time, self.progress_width = now, len(line)
+
+    def clear_progress(self):
+        if not self.progress_width: return
+        # 中文字符占两列宽度
+        sys.stderr.write('\r' + ' ' * self.progress_width * 2 + '\r')
+        sys.stderr.flush()
+        self.progress_time, self.progress_width = 0.0, 0
+
+    def close(self, status=True):
+        """输出最终进度及汇总事件"""
+        if self.progress:
+            self.clear_progress()
+            sys.stderr.write(self.progress_line() + '\n')
+            sys.stderr.flush()
+        self.write_event('summary', status=status, **self.summary())
+
+
+class Profiler(object):
+    """
+    分阶段计时：记录各阶段的墙钟时间、CPU 时间、读写字节数及文件数，以及单个文件的耗时（用于列出最慢的文件）。
+    同名阶段多次进入时累计；未启用时不做任何记录。进程池 worker 的 CPU 时间由任务返回后计入对应阶段
+    """
+
+    def __init__(self, enabled=False, top=DEFAULT_PROFILE_TOP):
+        self.enabled, self.top = enabled, top
+        self.stages, self.file_times = dict(), dict()
+        self.start_wall, self.start_cpu = time.perf_counter(), time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name, files=0, read=0, written=0):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu, files, read, written)
+
+    def add(self, name, wall=0.0, cpu=0.0, files=0, read=0, written=0):
+        if not self.enabled: return
+        stage_stat = self.stages.setdefault(name, dict(wall=0.0, cpu=0.0, files=0, read=0, written=0))
+        stage_stat['wall'] += wall
+        stage_stat['cpu'] += cpu
+        stage_stat['files'] += files
+        stage_stat['read'] += read
+        stage_stat['written'] += written
+
+    def add_file(self, rel_path, seconds):
+        if self.enabled: self.file_times[rel_path] = self.file_times.get(rel_path, 0.0) + seconds
+
+    def slowest_files(self):
+        return sorted(self.file_times.items(), key=lambda item: item[1], reverse=True)[:self.top]
+
+    def to_dict(self):
+        return dict(wall=round(time.perf_counter() - self.start_wall, 6),
+                    cpu=round(time.process_time() - self.start_cpu, 6),
+                    stages={name: {k: round(v, 6) if isinstance(v, float) else v for k, v in stage_stat.items()}
+                            for name, stage_stat in self.stages.items()},
+                    slowest_files=[dict(path=path, seconds=round(seconds, 6))
+                                   for path, seconds in self.slowest_files()])
+
+    def report(self):
+        """
+        生成性能报告日志
+        :return: [[日志, 级别]]
+        """
+        profile = self.to_dict()
+        logs = [['-----------------  性能报告  -----------------', logging.INFO],
+                [f'总耗时 {profile["wall"]:.3f}s，主进程 CPU {profile["cpu"]:.3f}s', logging.INFO]]
+        for name, st in self.stages.items():
+            logs.append([f'阶段 {name}：耗时 {st["wall"]:.3f}s，CPU {st["cpu"]:.3f}s，文件 {st["files"]} 个，'
+                         f'读取 {format_size(st["read"])}，写入 {format_size(st["written"])}', logging.INFO])
+        self.file_times and logs.append([f'耗时最长的 {min(self.top, len(self.file_times))} 个文件：', logging.INFO])
+        logs.extend([[f'{seconds:.3f}s  {path}', logging.INFO] for path, seconds in self.slowest_files()])
+        return logs
+
+    def dump(self, path):
+        with AtomicWriter(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+class BlockReader(object):
+    """将逐块返回的 bytes 包装为只读文件对象，用于写入 tar 归档"""
+
+    def __init__(self, blocks):
+        self.blocks, self.block, self.pos = iter(blocks), b'', 0
+
+    def read(self, size=-1):
+        parts = []
+        while size:
+            if self.pos >= len(self.block):
+                self.block, self.pos = next(self.blocks, None), 0
+                if self.block is None:
+                    self.block = b''
+                    break
+                continue
+            take = len(self.block) - self.pos if size < 0 else min(size, len(self.block) - self.pos)
+            parts.append(self.block[self.pos:self.pos + take])
+            self.pos += take
+            size = size - take if size > 0 else size
+        return b''.join(parts)
+
+
+class TrieMatcher(object):
+    """
+    由变量表中全部占位符（\x02KEY\x03 及 \\x02KEY\\x03 的完整字节序列）构建的前缀树正则，
+    整个占位符作为唯一分组，split 后按奇数位批量查表替换，替换值预先编码，匹配过程没有逐个回调。
+    missing_keys 为文件中出现的未定义变量，同样加入前缀树以记录位置，替换值为占位符本身
+    """
+
+    def __init__(self, variables: VarTable, replace_mode='字符串和控制符', missing_keys=()):
+        self.token_keys, self.token_values, self.defined_tokens = dict(), dict(), set()
+        items = [(raw_key, key, variables.raw_values[raw_key]) for raw_key, key in variables.raw_keys.items()]
+        items.extend((raw_key, decode_key(raw_key), None) for raw_key in missing_keys)
+        for raw_key, key, value in items:
+            # 与 PATTERN_MAP 一致，只匹配 1~64 字节的变量名
+            if not 0 < len(raw_key) <= 64: continue
+            for start_token, end_token in BOUNDARY_TOKENS_MAP[replace_mode]:
+                token = start_token + raw_key + end_token
+                self.token_keys[token], self.token_values[token] = key, token if value is None else value
+                value is None or self.defined_tokens.add(token)
+        self.pattern = re.compile(b'(' + (self.trie_regex(self.token_keys) or b'(?!)') + b')', re.DOTALL)
+
+    @staticmethod
+    def trie_regex(tokens):
+        """生成前缀树结构的正则，公共前缀只匹配一次"""
+        trie = dict()
+        for token in tokens:
+            node = trie
+            for c in token:
+                node = node.setdefault(c, dict())
+            node[None] = None
+
+        def _build(node):
+            alts = [re.escape(bytes([c])) + _build(child) for c, child in sorted(
+                (c, child) for c, child in node.items() if c is not None)]
+            if not alts: return b''
+            regex = alts[0] if len(alts) == 1 and None not in node else b'(?:' + b'|'.join(alts) + b')'
+            return regex + b'?' if None in node else regex
+
+        return _build(trie)
+
+
+def query_trie_matcher(variables: VarTable, replace_mode='字符串和控制符', missing_keys=frozenset()) -> TrieMatcher:
+    """同一变量表及未定义变量只构建一次前缀树正则，缓存于变量表"""
+    matchers, cache_key = variables.trie_matchers, (replace_mode, frozenset(missing_keys))
+    if cache_key not in matchers:
+        len(matchers) >= 16 and matchers.clear()
+        matchers[cache_key] = TrieMatcher(variables, replace_mode, missing_keys)
+    return matchers[cache_key]
 
 
 def check_k8s_kind_same(n1, n2):
@@ -135,24 +771,130 @@ def query_template_paths(root_dir):
     return paths
 
 
+def load_replace_ignore(root_dir):
+    """
+    读取 .replaceignore，每行一个相对交付物目录的通配符，# 开头为注释，以 / 结尾表示目录
+    :param root_dir:
+    :return: 通配符列表
+    """
+    ignore_path = os.path.join(root_dir, REPLACE_IGNORE_FILE)
+    if not os.path.exists(ignore_path):
+        return []
+    with open(ignore_path, 'r', encoding='utf-8-sig') as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def match_replace_ignore(rel_path, ignore_patterns):
+    """相对路径是否命中 .replaceignore 中的通配符，不含 / 的通配符同时匹配文件名"""
+    rel_path = rel_path.replace(os.sep, '/')
+    for pattern in ignore_patterns:
+        pattern = pattern.lstrip('/')
+        if pattern.endswith('/'):
+            if rel_path.startswith(pattern) or fnmatch.fnmatch(rel_path, pattern + '*'):
+                return True
+        elif fnmatch.fnmatch(rel_path, pattern) or ('/' not in pattern and fnmatch.fnmatch(
+                os.path.basename(rel_path), pattern)):
+            return True
+    return False
+
+
+def classify_template(template_path, binary_exts=BINARY_EXTENSIONS, max_size=DEFAULT_MAX_TEMPLATE_SIZE,
+                      sniff=True):
+    """
+    判断文件是否为二进制/制品文件，只读取文件头，不做整文件读取
+    :param template_path:
+    :param binary_exts: 二进制文件扩展名
+    :param max_size: 文件大小阈值，超过则跳过，0 表示不限制
+    :param sniff: 是否读取文件头判断
+    :return: 跳过原因，需要扫描时返回空字符串
+    """
+    if os.path.splitext(template_path)[1].lower() in binary_exts:
+        return '扩展名'
+    if max_size and os.path.getsize(template_path) > max_size:
+        return '大小阈值'
+    if not sniff:
+        return ''
+    with open(template_path, 'rb') as f:
+        return classify_head(f.read(BINARY_SNIFF_SIZE))
+
+
+def classify_head(head):
+    """按文件头（NUL 字节、魔数）判断是否为二进制文件，是则返回 文件头，否则返回空字符串"""
+    if b'\x00' in head or any(head.startswith(magic, offset) for offset, magic in BINARY_MAGIC_NUMBERS):
+        return '文件头'
+    return ''
+
+
+def classify_member(name, size, head, binary_exts=BINARY_EXTENSIONS, max_size=DEFAULT_MAX_TEMPLATE_SIZE):
+    """归档成员的二进制/制品文件判断，规则与 classify_template 一致，head 为成员的前 BINARY_SNIFF_SIZE 字节"""
+    if os.path.splitext(name)[1].lower() in binary_exts:
+        return '扩展名'
+    if max_size and size > max_size:
+        return '大小阈值'
+    return classify_head(head)
+
+
+def filter_template_paths(root_dir, template_paths, binary_exts=BINARY_EXTENSIONS,
+                          max_size=DEFAULT_MAX_TEMPLATE_SIZE, cache: ScanCache = None):
+    """
+    在扫描前排除二进制/制品文件
+    :param root_dir:
+    :param template_paths:
+    :param binary_exts:
+    :param max_size:
+    :param cache: 增量缓存，文件未变化时沿用缓存的文件头判定结果
+    :return: (需要扫描的模版文件, {跳过原因: 跳过的文件})
+    """
+    ignore_patterns, paths, skipped = load_replace_ignore(root_dir), [], dict()
+    for fp in template_paths:
+        if match_replace_ignore(os.path.relpath(fp, root_dir), ignore_patterns):
+            reason = '.replaceignore'
+        else:
+            entry = cache and cache.lookup(fp)
+            reason = classify_template(fp, binary_exts, max_size, not entry) or entry and entry.get('skip', '')
+            if cache and not entry and reason == '文件头': cache.put(fp, skip=reason)
+        if reason:
+            skipped.setdefault(reason, []).append(fp)
+        else:
+            paths.append(fp)
+    return paths, skipped
+
+
 def deploy_compare_lte(a, b):
     if type(a) != int and type(b) != int:
         return a <= b
     return int(a) <= int(b)
 
 
-def generate_csv_logs(error_mask, line_data):
+def generate_csv_logs(errors, line_data):
+    """
+    按行、列顺序生成错误日志
+    :param errors: 稀疏存储的错误 {(行下标, 列下标): [CheckError]}，只包含存在错误的单元格
+    :param line_data:
+    :return:
+    """
     error_logs = []
     cols, data = line_data[0], line_data[1:]
     error_pos_log = lambda x, y: '第 {} 行 {} 列，【{}】 {}'.format(x + 1, y + 1, cols[y], data[x][y])
-    for ri in range(len(error_mask)):
-        for ci in range(len(error_mask[ri])):
-            error_list = error_mask[ri][ci]
-            error_logs.extend([f'{error_pos_log(ri, ci)} {v.error_msg}' for v in error_list])
-            error_mask[ri][ci] = error_list and error_list[0] or CheckError(ErrorType.SUCCESS)
+    for ri, ci in sorted(errors):
+        error_logs.extend([f'{error_pos_log(ri, ci)} {v.error_msg}' for v in errors[(ri, ci)]])
     return error_logs
 
 
+def sum_file_sizes(paths):
+    """文件大小之和，不存在的文件忽略"""
+    return sum(os.path.getsize(fp) for fp in paths if os.path.isfile(fp))
+
+
+def format_size(num):
+    """字节数转为可读的大小"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num < 1024 or unit == 'GB':
+            return f'{num:.0f}{unit}' if unit == 'B' else f'{num:.1f}{unit}'
+        num /= 1024
+
+
 def check_ref_digest(ref_digest):
     parts = ref_digest.split('@')
     digest = parts[-1]
@@ -164,44 +906,89 @@ def check_ref_digest(ref_digest):
     return True
 
 
-def update_images(obj, image_ref):
+def query_image_nodes(node):
     """
-    递归遍历 YAML 对象，只替换 containers / initContainers / ephemeralContainers 中的 image。
+    递归遍历 YAML 节点，只返回 containers / initContainers / ephemeralContainers 中 image 的标量节点。
     """
-    if not isinstance(obj, (dict, list)):
-        return
-    if isinstance(obj, dict):
-        for key, value in obj.items():
+    import yaml
+    if isinstance(node, yaml.MappingNode):
+        for key, value in node.value:
             # 找到容器列表字段
-            if key in ("containers", "initContainers", "ephemeralContainers") and isinstance(value, list):
-                for c in value:
-                    if isinstance(c, dict) and "image" in c:
-                        c["image"] = image_ref
+            if key.value in CONTAINER_KEYS and isinstance(value, yaml.SequenceNode):
+                for c in value.value:
+                    if not isinstance(c, yaml.MappingNode): continue
+                    yield from (v for k, v in c.value if k.value == 'image' and isinstance(v, yaml.ScalarNode))
             else:
-                update_images(value, image_ref)
-    else:
-        for item in obj:
-            update_images(item, image_ref)
+                yield from query_image_nodes(value)
+    elif isinstance(node, yaml.SequenceNode):
+        for item in node.value:
+            yield from query_image_nodes(item)
+
+
+def query_node_value(node, *keys):
+    """按键逐级查找映射节点中的标量值，不存在时返回空字符串"""
+    import yaml
+    for key in keys:
+        if not isinstance(node, yaml.MappingNode): return ''
+        node = next((v for k, v in node.value if k.value == key), None)
+    return node.value if isinstance(node, yaml.ScalarNode) else ''
+
+
+def format_image_scalar(image_ref, style=None):
+    """按原标量的引号风格生成镜像引用，plain 风格无法原样表示时使用双引号"""
+    if style == "'":
+        return "'{}'".format(image_ref.replace("'", "''"))
+    if not style and PLAIN_IMAGE_PATTERN.fullmatch(image_ref):
+        import yaml
+        if yaml.safe_load(image_ref) == image_ref: return image_ref
+    return json.dumps(image_ref, ensure_ascii=False)
+
 
+def select_image_ref(image_rows, kind, name):
+    """
+    选择文档使用的镜像引用：同一 yaml 对应多行时按资源类型及名称匹配，未匹配时使用最后一行
+    :param image_rows: [(资源类型, 资源名称, 镜像引用)]
+    :param kind: 文档的 kind
+    :param name: 文档的 metadata.name
+    :return:
+    """
+    matched = [ref for resource_type, resource_name, ref in image_rows
+               if resource_name == name and check_k8s_kind_same(resource_type, kind)]
+    return (matched or [image_rows[-1][2]])[-1]
 
-def update_image_in_yaml(yaml_path, image_ref):
+
+def update_image_in_yaml(yaml_path, image_rows, image_spans=None, chunk_size=DEFAULT_CHUNK_SIZE):
     """
-    读取 YAML 文件，更新镜像前缀，并写回原文件。
-    支持多文档 YAML（--- 分隔）。
+    更新 YAML 文件中的镜像，支持多文档 YAML（--- 分隔）。
+    只改写 image 标量所在的字节范围，其余内容（注释、引号、缩进）原样流式写回，该文件的所有行一次处理完成。
+    :param yaml_path:
+    :param image_rows: deploy-execution-plan.csv 中对应该文件的 [(资源类型, 资源名称, 镜像引用)]
+    :param image_spans: 已解析的 image 标量位置，传入时不再读取解析文件
+    :param chunk_size:
+    :return: 替换的镜像个数
     """
-    path = Path(yaml_path)
-    with path.open("r", encoding="utf-8") as f:
-        docs = list(yaml.safe_load_all(f))
-    for doc in docs:
-        update_images(doc, image_ref)
-    with path.open("w", encoding="utf-8") as f:
-        yaml.safe_dump_all(docs, f, sort_keys=False, allow_unicode=True)
+    image_spans = check_k8s_yaml_valid(yaml_path)[1] if image_spans is None else image_spans
+    patches = [(start, end, format_image_scalar(select_image_ref(image_rows, kind, name), style).encode())
+               for start, end, style, kind, name in image_spans]
+    if not patches: return 0
+    with AtomicWriter(yaml_path) as fout, open(yaml_path, 'rb') as fin:
+        for block in iter_patched_blocks(fin, patches, chunk_size):
+            fout.write(block)
+    return len(patches)
 
 
-def replace_k8s_images(install_dir, old_prefix, new_prefix):
-    if not new_prefix or not old_prefix or old_prefix == new_prefix: return
-    line_data = read_controls_csv(os.path.join(install_dir, 'controls/deploy-execution-plan.csv'))
-    data_lines = line_data[1:]
+def query_image_updates(install_dir, old_prefix, new_prefix, deploy_csv_path=None):
+    """
+    查询需要替换镜像的 k8s yaml
+    :param install_dir:
+    :param old_prefix:
+    :param new_prefix:
+    :param deploy_csv_path: deploy-execution-plan.csv 路径，默认为交付物目录下的文件
+    :return: {yaml 相对路径: [(资源类型, 资源名称, 镜像引用)]}，按文件汇总
+    """
+    if not new_prefix or not old_prefix or old_prefix == new_prefix: return dict()
+    line_data = read_controls_csv(deploy_csv_path or os.path.join(install_dir, 'controls/deploy-execution-plan.csv'))
+    data_lines, updates, path_lookup = line_data[1:], dict(), PathLookup(install_dir)
     empty_idx_set = {
         i for i, row in enumerate(data_lines)
         if all(str(cell).strip() == '' or cell is None for cell in row)
@@ -209,32 +996,48 @@ def replace_k8s_images(install_dir, old_prefix, new_prefix):
     for idx, row in enumerate(data_lines):
         if idx in empty_idx_set: continue
         if not row[5] or not row[6] or (row[4] == '镜像拉取' and not row[5]): continue
-        k8s_yaml_path = os.path.join(install_dir, row[5])
-        if not os.path.exists(k8s_yaml_path): continue
-        image_ref = row[6].replace(old_prefix, new_prefix, 1)
-        update_image_in_yaml(k8s_yaml_path, image_ref)
+        if not path_lookup.exists(row[5]): continue
+        updates.setdefault(os.path.normpath(row[5]), []).append(
+            (row[1], row[2], row[6].replace(old_prefix, new_prefix, 1)))
+    return updates
+
+
+def replace_k8s_images(install_dir, old_prefix, new_prefix, image_spans=None):
+    """
+    替换 k8s yaml 中的镜像，每个文件只改写一次
+    :param install_dir:
+    :param old_prefix:
+    :param new_prefix:
+    :param image_spans: 已解析的 image 标量位置 {相对路径: [(start, end, style, kind, name)]}，未包含的文件读取解析
+    :return: 改写的 yaml 路径
+    """
+    image_spans, updated = image_spans or dict(), []
+    for yaml_rel_path, image_rows in query_image_updates(install_dir, old_prefix, new_prefix).items():
+        yaml_path = os.path.join(install_dir, yaml_rel_path)
+        update_image_in_yaml(yaml_path, image_rows, image_spans.get(yaml_rel_path)) and updated.append(yaml_path)
+    return updated
 
 
 def load_data_from_csv(filepath: str, control_type='var'):
     """
-    读取全局变量字典
+    读取全局变量字典，错误按单元格稀疏存储，路径存在性按父目录批量检查
     :param control_type: var, deploy, script
     :param filepath:
-    :return:
+    :return: (数据行, 空行下标, ({(行下标, 列下标): [CheckError]}, 错误日志), 版本)
     """
-    install_path = os.path.dirname(os.path.dirname(filepath))
+    path_lookup = PathLookup(os.path.dirname(os.path.dirname(filepath)))
     line_data = read_controls_csv(filepath)
     assert len(line_data), '{} 文件格式有误，未发现列名！'.format(CONTROL_TYPE_MAP[control_type])
-    columns_is_valid, control_csv_columns, version = False, '', 1.0
+    columns_is_valid, version = False, 1.0
     for col_str, v in CONTROL_COLUMNS_MAP[control_type]:
         if ' '.join(line_data[0]) == col_str:
-            columns_is_valid, control_csv_columns, version = True, col_str, v
+            columns_is_valid, version = True, v
             break
     assert columns_is_valid, \
         '{} 文件列名不匹配！列名应为 {}'.format(CONTROL_TYPE_MAP[control_type], CONTROL_COLUMNS_MAP[control_type][-1])
     data_lines = line_data[1:]
-    row_num, col_num = len(data_lines), len(control_csv_columns.split(' '))
-    error_mask = [[[] for _ in range(col_num)] for _ in range(row_num)]
+    errors = dict()
+    add_error = lambda ri, ci, error_type: errors.setdefault((ri, ci), []).append(CheckError(error_type))
     # 查询空行
     empty_idx_set = {
         i for i, row in enumerate(data_lines)
@@ -246,65 +1049,75 @@ def load_data_from_csv(filepath: str, control_type='var'):
         # VAR_COLUMNS = '序号 变量键（KEY） 变量描述 变量类型 填写示例 文件路径 填写说明'
         if control_type == 'var':
             for i in range(len(row[:4])):
-                if not row[i]: error_mask[idx][i].append(CheckError(ErrorType.VALUE_NOT_EXIST))
-            if row[3] not in VAR_TYPE: error_mask[idx][3].append(CheckError(ErrorType.VAR_TYPE_ERROR))
+                if not row[i]: add_error(idx, i, ErrorType.VALUE_NOT_EXIST)
+            if row[3] not in VAR_TYPE: add_error(idx, 3, ErrorType.VAR_TYPE_ERROR)
+            elif row[4] and row[3] in VAR_VALUE_PATTERN_MAP and not VAR_VALUE_PATTERN_MAP[row[3]].fullmatch(row[4]):
+                add_error(idx, 4, ErrorType.VAR_VALUE_TYPE_ERROR)
         # DEPLOY_COLUMNS = '步骤 资源类型 资源名称 命名空间 部署类型 YAML路径 镜像包名称 备注'
         elif control_type == 'deploy':
             if row[4] and row[4] in DEPLOY_TYPE and row[4] == '镜像拉取':
                 for i in [0, 6]:
-                    if not row[i]: error_mask[idx][i].append(CheckError(ErrorType.VALUE_NOT_EXIST))
-                if row[5] and not os.path.exists(os.path.join(install_path, row[5])):
-                    error_mask[idx][5].append(CheckError(ErrorType.DEPLOY_YAML_NOT_EXIST))
+                    if not row[i]: add_error(idx, i, ErrorType.VALUE_NOT_EXIST)
+                if row[5] and not path_lookup.exists(row[5]):
+                    add_error(idx, 5, ErrorType.DEPLOY_YAML_NOT_EXIST)
             else:
                 for i in range(5):
-                    if not row[i]: error_mask[idx][i].append(CheckError(ErrorType.VALUE_NOT_EXIST))
+                    if not row[i]: add_error(idx, i, ErrorType.VALUE_NOT_EXIST)
                 if row[1].lower() not in DEPLOY_RESOURCE_TYPE.keys():
-                    error_mask[idx][1].append(CheckError(ErrorType.DEPLOY_RESOURCE_TYPE_ERROR))
+                    add_error(idx, 1, ErrorType.DEPLOY_RESOURCE_TYPE_ERROR)
                 if row[4] not in DEPLOY_TYPE:
-                    error_mask[idx][4].append(CheckError(ErrorType.DEPLOY_TYPE_ERROR))
+                    add_error(idx, 4, ErrorType.DEPLOY_TYPE_ERROR)
                 if '更新' == row[4]:
                     if not deploy_compare_lte(deploy_seq_last, DEPLOY_RESOURCE_TYPE[row[1].lower()]):
-                        error_mask[idx][1].append(CheckError(ErrorType.DEPLOY_ORDER_ERROR))
+                        add_error(idx, 1, ErrorType.DEPLOY_ORDER_ERROR)
                     deploy_seq_last = max(deploy_seq_last, DEPLOY_RESOURCE_TYPE[data_lines[idx][1].lower()])
                 # yaml不存在
-                if not row[5] or not os.path.exists(os.path.join(install_path, row[5])):
-                    error_mask[idx][5].append(CheckError(ErrorType.DEPLOY_YAML_NOT_EXIST))
+                if not row[5] or not path_lookup.exists(row[5]):
+                    add_error(idx, 5, ErrorType.DEPLOY_YAML_NOT_EXIST)
                 filename, ext = os.path.splitext(row[5])
                 if not check_k8s_kind_same(os.path.basename(filename).split('-')[-1], row[1]) \
                         or ext[2:] not in {'aml', 'ml'}:
-                    error_mask[idx][5].append(CheckError(ErrorType.DEPLOY_YAML_NAME_ERROR))
+                    add_error(idx, 5, ErrorType.DEPLOY_YAML_NAME_ERROR)
                 # deployment，镜像包
                 if row[1].lower() in DEPLOY_NEED_IMAGE:
                     if not row[6]:
-                        error_mask[idx][6].append(CheckError(ErrorType.VALUE_NOT_EXIST))
+                        add_error(idx, 6, ErrorType.VALUE_NOT_EXIST)
                     elif version == 1.1 and not check_ref_digest(row[6]):
-                        error_mask[idx][6].append(CheckError(ErrorType.DEPLOY_IMG_REF_ERROR))
+                        add_error(idx, 6, ErrorType.DEPLOY_IMG_REF_ERROR)
         # SCRIPT_COLUMNS = '步骤 脚本路径 是否幂等 是否依赖 执行机类型 执行用户 K8S命名空间 负载资源名称 备注'
         elif control_type == 'script':
             for i in range(5):
-                if not row[i]: error_mask[idx][i].append(CheckError(ErrorType.VALUE_NOT_EXIST))
-            if not os.path.exists(os.path.join(install_path, row[1])):
-                error_mask[idx][1].append(CheckError(ErrorType.PATH_NOT_EXIST))
-            if row[2] not in {'是', '否'}: error_mask[idx][2].append(CheckError(ErrorType.BOOL_ERROR))
-            if row[3] not in {'是', '否'}: error_mask[idx][3].append(CheckError(ErrorType.BOOL_ERROR))
-            if row[4] not in {'宿主机', '容器'}: error_mask[idx][4].append(CheckError(ErrorType.SCRIPT_ENV_TYPE_ERROR))
+                if not row[i]: add_error(idx, i, ErrorType.VALUE_NOT_EXIST)
+            # 多个脚本路径使用换行分隔
+            if not all(path_lookup.exists(p.strip()) for p in row[1].splitlines() if p.strip()):
+                add_error(idx, 1, ErrorType.PATH_NOT_EXIST)
+            if row[2] not in {'是', '否'}: add_error(idx, 2, ErrorType.BOOL_ERROR)
+            if row[3] not in {'是', '否'}: add_error(idx, 3, ErrorType.BOOL_ERROR)
+            if row[4] not in {'宿主机', '容器'}: add_error(idx, 4, ErrorType.SCRIPT_ENV_TYPE_ERROR)
         else:
             break
-    error_logs = generate_csv_logs(error_mask, line_data)
-    return data_lines, empty_idx_set, (error_mask, error_logs), version
+    error_logs = generate_csv_logs(errors, line_data)
+    return data_lines, empty_idx_set, (errors, error_logs), version
 
 
 def read_controls_csv(filepath: str):
     """
-    读取中控类csv文件
+    读取中控类csv文件，每个文件只解析一次：按 (inode, 修改时间, 大小) 缓存解析后的行，
+    检查、镜像替换、yaml 查询等处共用，文件变化后重新解析。返回的行只读共享，调用方不应修改
     """
+    st = os.stat(filepath)
+    path, signature = os.path.abspath(filepath), (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = CONTROLS_CSV_CACHE.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
     try:
         with open(filepath, 'r', newline='', encoding='utf-8-sig') as csvfile:
             content = csv.reader(csvfile)
             content = [row for row in content]
-            return content
     except UnicodeDecodeError:
         raise Exception('中控类文件编码不在支持范围内，请转换为 utf-8 编码！')
+    CONTROLS_CSV_CACHE[path] = (signature, content)
+    return content
 
 
 def decode_key(v):
@@ -314,57 +1127,292 @@ def decode_key(v):
         raise e
 
 
+def mmap_file(fin):
+    """常规非空文件返回只读 mmap，其他情况（空文件、管道、映射失败等）返回 None"""
+    st = os.fstat(fin.fileno())
+    if not stat.S_ISREG(st.st_mode) or not st.st_size:
+        return None
+    try:
+        return mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, OverflowError):
+        return None
+
+
 def stream_replace(template_path, variables, replace_mode='字符串和控制符', check: bool = True, is_yaml: bool = False,
-                   chunk_size: int = 1024 * 1024 * 100, ) -> Tuple[int, Set[bytes], Set[bytes]]:
+                   chunk_size: int = DEFAULT_CHUNK_SIZE, positions: list = None,
+                   use_mmap: bool = True, engine='regex', hasher=None) -> Tuple[int, Set[bytes], Set[bytes]]:
     """
     流式读取 -> 占位符替换 -> 流式写入新文件。
     replacer: 接收占位符“中间内容”（bytes，不含边界标记），返回 bytes。
+    常规文件直接 mmap 后整体匹配，输出为映射中匹配之间的切片，不经过读缓冲区拷贝；
+    其他文件读取缓冲区固定为 chunk_size + 占位符最大长度，块尾未能确定是否匹配的内容（不足一个占位符长度）
+    移到缓冲区头部与下一块一起处理，内存占用与文件大小无关，匹配结果与整文件匹配一致。
+    没有替换位置的文件不会被改写。
+    positions: 传入列表时，按出现顺序记录全部占位符在文件中的位置 (start, end, key)
+    engine: regex 或 trie，trie 引擎先单独 findall 一遍收集文件中出现的变量名，未定义的变量一并加入前缀树，
+    再按块 split 批量替换
+    hasher: 传入 hashlib 对象时在同一次读取中更新文件内容哈希，供增量缓存使用
     返回: (替换次数, matched_keys, missing_keys)
     """
-    pattern, start_tokens = PATTERN_MAP[replace_mode], START_TOKENS_MAP[replace_mode]
+    assert chunk_size > 0, f'流式读取的块大小需为正整数：{chunk_size}'
+    pattern, max_len = PATTERN_MAP[replace_mode], PLACEHOLDER_MAX_LEN_MAP[replace_mode]
     missing_keys, matched_keys, replace_num = set(), set(), 0
+    variables = compile_var_table(variables)
 
-    def _replacer(match):
-        key = decode_key(match.group(1) or match.group(2))
+    def _replacer(start, end, raw_key, placeholder):
+        key = variables.raw_keys.get(raw_key)
         nonlocal replace_num
-        if key in variables:
+        if key is not None:
+            positions is not None and positions.append((start, end, key))
             replace_num += 1
             matched_keys.add(key)
-            return variables[key].encode()
+            return None if check else variables.raw_values[raw_key]
         else:
+            key = decode_key(raw_key)
+            positions is not None and positions.append((start, end, key))
             missing_keys.add(key)
-            return match.group(0)
-
-    def _write(f, contents):
-        check or f.write(contents)
+            return placeholder
 
-    buf = b""
-    with open(template_path, 'rb') as fin, tempfile.NamedTemporaryFile('wb', delete=False) as fout:
-        while True:
-            chunk = fin.read(chunk_size)
-            buf += chunk
-            # 处理当前缓冲中的完整匹配
+    def _mmap_replace(mm, fout):
+        # 先完成整个映射的匹配再处理，避免处理异常时匹配迭代器仍持有映射导致无法关闭
+        matches = [(m.start(), m.end(), m.group(1) or m.group(2), m.group(0)) for m in pattern.finditer(mm)]
+        hasher and hasher.update(mm)
+        replaces = [(m[0], m[1], _replacer(*m)) for m in matches]
+        if check or not replace_num: return
+        with memoryview(mm) as view:
             write_pos = 0
-            for m in pattern.finditer(buf):
-                replace_text = _replacer(m)
-                _write(fout, buf[write_pos:m.start()])
-                _write(fout, replace_text)
-                write_pos = m.end()
-            if not chunk:
-                _write(fout, buf[write_pos:])
-                break
-            # 尾巴处理, 找尾巴里“最后一个起始 token”的位置（同型），把它之后的内容留到下轮
-            tail = buf[write_pos:]
-            last_start = max((tail.rfind(st) for st in start_tokens), default=-3)
-            buf = tail[last_start:]
-            _write(fout, tail[:last_start])
-    is_yaml and check_k8s_yaml_valid(fout.name)
-    check or shutil.copyfile(fout.name, template_path)
+            for start, end, replace_text in replaces:
+                fout.write(view[write_pos:start])
+                fout.write(replace_text)
+                write_pos = end
+            fout.write(view[write_pos:])
+
+    def _chunk_replace(fin, fout=None):
+        _write = fout.write if fout else lambda contents: None
+        buf = bytearray(chunk_size + max_len)
+        with memoryview(buf) as view:
+            # carry: 上一轮保留在缓冲区头部的字节数，offset: 缓冲区头部在文件中的偏移
+            carry, offset = 0, 0
+            while True:
+                read_num = fin.readinto(view[carry:carry + chunk_size])
+                end, eof = carry + read_num, not read_num
+                hasher and hasher.update(view[carry:end])
+                # 起始位置在 limit 之前的匹配不受后续数据影响，之后的留到下一轮
+                limit = end if eof else end - max_len + 1
+                write_pos = 0
+                for m in pattern.finditer(buf, 0, end):
+                    if m.start() >= limit: break
+                    replace_text = _replacer(offset + m.start(), offset + m.end(), m.group(1) or m.group(2), m.group(0))
+                    _write(view[write_pos:m.start()])
+                    _write(replace_text)
+                    write_pos = m.end()
+                if eof:
+                    _write(view[write_pos:end])
+                    break
+                keep = max(limit, write_pos)
+                _write(view[write_pos:keep])
+                buf[:end - keep] = buf[keep:end]
+                carry, offset = end - keep, offset + keep
+
+    def _find_raw_keys(fin):
+        # 单独的一遍 findall 只收集出现过的变量名（去重），不逐个回调
+        mm = use_mmap and mmap_file(fin)
+        if mm:
+            with mm: found = set(pattern.findall(mm))
+        else:
+            # 与 _chunk_replace 相同的切分：起始位置在 limit 之前的匹配已确定，只保留最后一个匹配之后未确定的部分，
+            # 不重复匹配已匹配过的内容，结果与整文件匹配一致
+            found, data = set(), b''
+            while True:
+                read_data = fin.read(chunk_size)
+                data, eof = data + read_data, not read_data
+                limit, keep = len(data) if eof else len(data) - max_len + 1, 0
+                for m in pattern.finditer(data):
+                    if m.start() >= limit: break
+                    found.add(m.group(1) or m.group(2))
+                    keep = m.end()
+                if eof: break
+                data = data[max(limit, keep):]
+        fin.seek(0)
+        return {k if isinstance(k, bytes) else k[0] or k[1] for k in found}
+
+    def _trie_replace(fin, fout=None):
+        nonlocal replace_num
+        raw_keys = _find_raw_keys(fin)
+        missing_keys.update(k for k in map(decode_key, raw_keys) if k not in variables)
+        missing_raw_keys = {k for k in raw_keys if decode_key(k) in missing_keys}
+        matcher, matched_tokens = query_trie_matcher(variables, replace_mode, missing_raw_keys), set()
+        buf = bytearray(chunk_size + max_len)
+        with memoryview(buf) as view:
+            carry, offset = 0, 0
+            while True:
+                read_num = fin.readinto(view[carry:carry + chunk_size])
+                end, eof = carry + read_num, not read_num
+                hasher and hasher.update(view[carry:end])
+                limit = end if eof else end - max_len + 1
+                data = bytes(view[:end])
+                # parts: [文本, 占位符, 文本, 占位符, ..., 文本]，ends 为各段结束位置，第 i 个占位符起始于 ends[2i]
+                parts = matcher.pattern.split(data)
+                ends = list(accumulate(map(len, parts)))
+                tokens, starts = parts[1::2], ends[0::2]
+                # 起始位置在 limit 之前的占位符已完整读入，其余留到下一轮
+                num = bisect_left(starts, limit, 0, len(tokens))
+                keep = end if eof else max(limit, ends[2 * num - 1] if num else 0)
+                found = tokens[:num]
+                replace_num += sum(map(matcher.defined_tokens.__contains__, found))
+                matched_tokens.update(found)
+                positions is not None and positions.extend(zip(
+                    map(offset.__add__, starts), map(offset.__add__, ends[1:2 * num:2]),
+                    map(matcher.token_keys.__getitem__, found)))
+                if fout:
+                    parts[1:2 * num:2] = map(matcher.token_values.__getitem__, found)
+                    fout.write(b''.join(parts[:2 * num]))
+                    fout.write(view[ends[2 * num - 1] if num else 0:keep])
+                if eof: break
+                buf[:end - keep] = buf[keep:end]
+                carry, offset = end - keep, offset + keep
+        matched_keys.update(matcher.token_keys[t] for t in matched_tokens & matcher.defined_tokens)
+
+    def _process(fin, fout=None):
+        if engine == 'trie':
+            _trie_replace(fin, fout)
+            return
+        mm = use_mmap and mmap_file(fin)
+        if mm:
+            with mm: _mmap_replace(mm, fout)
+        else:
+            _chunk_replace(fin, fout)
+
+    if check:
+        # 检查模式只读扫描，仅收集匹配结果，不创建任何输出文件
+        with open(template_path, 'rb') as fin:
+            _process(fin)
+        return replace_num, matched_keys, missing_keys
+    writer = AtomicWriter(template_path)
+    with writer as fout, open(template_path, 'rb') as fin:
+        _process(fin, fout)
+        fout.flush()
+        is_yaml and check_k8s_yaml_valid(fout.name, template_path)
+        replace_num or writer.discard()
     return replace_num, matched_keys, missing_keys
 
 
+def render_from_positions(template_path, positions, variables, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                          output_path=None) -> int:
+    """
+    按扫描记录的占位符位置直接拼接渲染，不再做正则匹配，写入同目录临时文件后原子替换
+    k8s yaml 已在检查时按相同的位置渲染并解析校验，此处不再重复解析
+    :param template_path: 模版文件路径
+    :param positions: stream_replace 记录的占位符位置 [(start, end, key)]，按位置升序
+    :param variables: 变量表
+    :param chunk_size:
+    :param output_path: 输出文件路径，默认覆盖模版文件
+    :return: 替换次数
+    """
+    with AtomicWriter(output_path or template_path) as fout, open(template_path, 'rb') as fin:
+        for block in iter_rendered_blocks(fin, positions, variables, chunk_size):
+            fout.write(block)
+    return sum(1 for _, _, key in positions if key in variables)
+
+
+def iter_rendered_blocks(fin, positions, variables, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """按占位符位置边读边替换，逐块返回渲染后的内容"""
+    values = compile_var_table(variables).encoded_values
+    patches = ((start, end, values[key]) for start, end, key in positions if key in values)
+    yield from iter_patched_blocks(fin, patches, chunk_size)
+
+
+def iter_patched_blocks(fin, patches, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """按字节范围 [(start, end, 替换内容)]（升序）边读边替换，其余内容原样逐块返回"""
+    read_pos = 0
+    for start, end, text in patches:
+        yield from iter_file_range(fin, start - read_pos, chunk_size)
+        yield text
+        fin.seek(end)
+        read_pos = end
+    yield from iter(lambda: fin.read(chunk_size), b'')
+
+
+def render_content(template_path, positions, variables, replace_mode='字符串和控制符') -> bytes:
+    """在内存中渲染整个文件，positions 为 None 时（如命中增量缓存）重新匹配占位符"""
+    with open(template_path, 'rb') as fin:
+        if positions is not None:
+            return b''.join(iter_rendered_blocks(fin, positions, variables))
+        content = fin.read()
+    raw_values = compile_var_table(variables).raw_values
+
+    def _sub(m):
+        value = raw_values.get(m.group(1) or m.group(2))
+        return m.group(0) if value is None else value
+
+    return PATTERN_MAP[replace_mode].sub(_sub, content)
+
+
+def rendered_size(size, positions, variables):
+    """渲染后的文件大小，没有占位符位置时（如原样写入的成员）不需要变量表"""
+    if not positions: return size
+    values = compile_var_table(variables).encoded_values
+    return size + sum(len(values[key]) - (end - start) for start, end, key in positions if key in values)
+
+
+def iter_file_range(fin, size, chunk_size):
+    """从 fin 当前位置逐块读取 size 个字节"""
+    while size > 0:
+        data = fin.read(min(size, chunk_size))
+        if not data: break
+        yield data
+        size -= len(data)
+
+
+def query_position_lines(template_path, positions, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """按位置升序逐块读取文件，计算每个占位符起始位置所在的行号（从 1 开始）"""
+    lines, line, data, data_start, count_pos = [], 1, b'', 0, 0
+    with open(template_path, 'rb') as fin:
+        for start, _, _ in positions:
+            while start >= data_start + len(data):
+                line += data.count(b'\n', count_pos - data_start)
+                data_start += len(data)
+                data, count_pos = fin.read(chunk_size), data_start
+                if not data: break
+            line += data.count(b'\n', count_pos - data_start, start - data_start)
+            count_pos = start
+            lines.append(line)
+    return lines
+
+
+def reflink_file(src, dst):
+    """写时复制克隆文件，仅 Linux 上支持 FICLONE 的文件系统可用，失败返回 False"""
+    try:
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (ImportError, OSError):
+        os.path.lexists(dst) and os.unlink(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def link_or_copy(src, dst, link_mode='auto'):
+    """
+    输出未改动的文件，auto 依次尝试 reflink、硬链接，均不支持时普通复制
+    注意：硬链接与原文件共用同一份数据，不要直接修改输出目录中的文件（本工具的改写均为原子替换，不受影响）
+    """
+    os.path.lexists(dst) and os.unlink(dst)
+    if link_mode in ('auto', 'reflink') and reflink_file(src, dst):
+        return
+    if link_mode in ('auto', 'hardlink'):
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
 def replace_placeholders_in_file(template_path, variables: dict, defined_keys: set, replace_mode='字符串和控制符',
-                                 check=True, is_yaml=False):
+                                 check=True, is_yaml=False, positions: list = None, chunk_size=DEFAULT_CHUNK_SIZE,
+                                 engine='regex', hasher=None):
     """
     替换文件中的占位符
     :param replace_mode:
@@ -373,18 +1421,19 @@ def replace_placeholders_in_file(template_path, variables: dict, defined_keys: s
     :param defined_keys:
     :param check:
     :param is_yaml: is k8s yaml
+    :param positions: 传入列表时记录占位符位置
+    :param chunk_size: 流式读取的块大小
+    :param engine: 替换引擎，regex 或 trie
+    :param hasher: 传入时在扫描的同一次读取中计算文件内容哈希
     :return:
     """
     matched_keys, missing_keys, status, replace_num, exist_vars_fp, logs = set(), set(), False, 0, [], []
     try:
         replace_num, matched_keys, missing_keys = stream_replace(template_path, variables, replace_mode, check,
-                                                                 is_yaml)
+                                                                 is_yaml, chunk_size, positions, engine=engine,
+                                                                 hasher=hasher)
         status = True
-        logs.append([f'成功，替换位置 {replace_num} 个', logging.INFO])
-        undefined_path_keys = matched_keys.difference(defined_keys)
-        defined_keys.difference_update(matched_keys)
-        defined_keys.update(undefined_path_keys)
-        missing_keys and logs.append([f'发现未定义变量！！！请确认: {missing_keys}', logging.WARNING])
+        logs = replace_result_logs(replace_num, matched_keys, missing_keys, defined_keys)
     except UnicodeDecodeError as e:
         logs.append([f'警告：warning: {str(e)}', logging.WARNING])
     except Exception as e:
@@ -392,9 +1441,66 @@ def replace_placeholders_in_file(template_path, variables: dict, defined_keys: s
     return matched_keys, missing_keys, status, replace_num, logs
 
 
-def fix_global_csv(csv_path, var_fps_map):
-    with open(csv_path, newline='', encoding='utf-8-sig') as fin, \
-            tempfile.NamedTemporaryFile('w', newline='', encoding='utf-8-sig', delete=False) as fout:
+def replace_result_logs(replace_num, matched_keys, missing_keys, defined_keys: set):
+    """生成单个文件的处理日志，并更新 defined_keys"""
+    logs = [[f'成功，替换位置 {replace_num} 个', logging.INFO]]
+    undefined_path_keys = matched_keys.difference(defined_keys)
+    defined_keys.difference_update(matched_keys)
+    defined_keys.update(undefined_path_keys)
+    missing_keys and logs.append([f'发现未定义变量！！！请确认: {missing_keys}', logging.WARNING])
+    return logs
+
+
+def init_worker(variables):
+    """进程池初始化，变量表每个 worker 只传递一次"""
+    global WORKER_VARIABLES
+    WORKER_VARIABLES = variables
+
+
+def scan_template_task(args):
+    """
+    进程池任务：检查/替换单个模版文件，返回替换结果、更新后的 defined_keys、占位符位置、
+    内容哈希（需要时在扫描的同一次读取中计算，扫描失败时为 None）及 (耗时, CPU 时间)
+    """
+    fp, defined_keys, replace_mode, check, is_yaml, chunk_size, engine, with_hash = args
+    positions, wall, cpu = [], time.perf_counter(), time.process_time()
+    hasher = ScanCache.new_hasher() if with_hash else None
+    replace_ret = replace_placeholders_in_file(fp, WORKER_VARIABLES, defined_keys, replace_mode, check, is_yaml,
+                                               positions, chunk_size, engine, hasher)
+    digest = hasher.hexdigest() if hasher and replace_ret[2] else None
+    return replace_ret, defined_keys, positions, digest, (time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def render_template_task(args):
+    """进程池任务：按占位符位置渲染单个模版文件，没有位置记录时重新匹配替换"""
+    fp, positions, replace_mode, chunk_size, *output_path = args
+    if positions is None:
+        return stream_replace(fp, WORKER_VARIABLES, replace_mode, False, False, chunk_size)[0]
+    return render_from_positions(fp, positions, WORKER_VARIABLES, chunk_size, *output_path)
+
+
+def map_tasks(func, tasks: list, variables, jobs=1):
+    """
+    按任务顺序返回执行结果，jobs > 1 时使用进程池并行执行
+    :param func: 任务函数，需为模块级函数
+    :param tasks: 任务参数列表
+    :param variables: 变量表
+    :param jobs: 并行进程数
+    :return:
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        init_worker(variables)
+        yield from map(func, tasks)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(variables,)) as executor:
+        yield from executor.map(func, tasks, chunksize=chunksize)
+
+
+def fix_global_csv(csv_path, var_fps_map, output_path=None):
+    with AtomicWriter(output_path or csv_path, 'w', newline='', encoding='utf-8-sig') as fout, \
+            open(csv_path, newline='', encoding='utf-8-sig') as fin:
         reader = csv.DictReader(fin)
         writer = csv.DictWriter(fout, fieldnames=reader.fieldnames)
         writer.writeheader()
@@ -402,40 +1508,79 @@ def fix_global_csv(csv_path, var_fps_map):
             key = row['变量键（KEY）']
             row['文件路径'] = '\n'.join(var_fps_map[key]) if key in var_fps_map else row['文件路径']
             writer.writerow(row)
-    shutil.copyfile(fout.name, csv_path)
 
 
 def query_k8s_yaml_paths(install_dir):
     yaml_paths_set = set()
-    line_data = read_controls_csv(os.path.join(install_dir, 'controls/deploy-execution-plan.csv'))
+    line_data, path_lookup = read_controls_csv(os.path.join(install_dir, 'controls/deploy-execution-plan.csv')), \
+        PathLookup(install_dir)
     for idx, row in enumerate(line_data[1:]):
         if not row or not row[5]: continue
-        k8s_yaml_path = os.path.join(install_dir, row[5])
-        os.path.exists(k8s_yaml_path) and yaml_paths_set.add(k8s_yaml_path)
+        path_lookup.exists(row[5]) and yaml_paths_set.add(os.path.join(install_dir, row[5]))
     return yaml_paths_set
 
 
-def check_k8s_yaml_valid(yaml_path):
-    path = Path(yaml_path)
-    with path.open("r", encoding="utf-8") as f:
-        yaml.safe_load_all(f)
+def load_k8s_yaml(content: str, yaml_name):
+    """
+    解析 k8s yaml 内容（支持多文档），同一次解析中记录 image 标量的位置，
+    解析失败时抛出异常，注明文件、第几个文档及行号
+    :param content: yaml 内容
+    :param yaml_name: 日志中显示的文件名
+    :return: (文档列表, image 标量位置 [(start, end, style, kind, name)]，start/end 为字节偏移)
+    """
+    import yaml
+    # libyaml 可用时使用 C 实现的 SafeLoader
+    docs, image_nodes, loader = [], [], getattr(yaml, 'CSafeLoader', yaml.SafeLoader)(content)
+    try:
+        while loader.check_node():
+            node = loader.get_node()
+            kind, name = query_node_value(node, 'kind'), query_node_value(node, 'metadata', 'name')
+            image_nodes.extend((n, kind, name) for n in query_image_nodes(node))
+            docs.append(loader.construct_document(node))
+    except yaml.YAMLError as e:
+        mark = getattr(e, 'problem_mark', None) or getattr(e, 'context_mark', None)
+        if mark:
+            doc_idx, line = len(docs) + 1, mark.line + 1
+        else:
+            # ReaderError（非法字符）在解析前整体检查，只有字符位置，按文档分隔符推算第几个文档
+            prefix = content[:getattr(e, 'position', 0)]
+            line = prefix.count('\n') + 1
+            doc_idx = len(re.findall(r'^---', prefix, re.M)) + (not content.lstrip().startswith('---')) or 1
+        raise ValueError(f'{yaml_name} 第 {doc_idx} 个文档第 {line} 行 YAML 格式有误：'
+                         f'{getattr(e, "problem", None) or str(e).splitlines()[0]}')
+    finally:
+        loader.dispose()
+    image_spans, seen = [], set()
+    for node, kind, name in sorted(image_nodes, key=lambda n: n[0].start_mark.index):
+        start, end = node.start_mark.index, node.end_mark.index
+        # 锚点引用的同一节点只改写一次；保留锚点及标签，块标量不保留结尾换行
+        if start in seen: continue
+        seen.add(start)
+        start = NODE_PROPERTIES_PATTERN.match(content, start).end()
+        while node.style in ('|', '>') and end > start and content[end - 1] in '\r\n':
+            end -= 1
+        # 标记位置为字符下标，转换为 utf-8 字节偏移
+        image_spans.append((len(content[:start].encode()), len(content[:end].encode()), node.style, kind, name))
+    return docs, image_spans
+
+
+def check_k8s_yaml_valid(yaml_path, yaml_name=None):
+    """读取并解析 k8s yaml 文件，返回 (文档列表, image 标量位置)；按字节读取后解码，保留 CRLF 使位置与文件字节偏移一致"""
+    with open(yaml_path, 'rb') as f:
+        return load_k8s_yaml(f.read().decode('utf-8'), yaml_name or yaml_path)
 
 
-def dispose_controls(install_dir, replace_mode='字符串和控制符', check=True, dispose_fps=()):
+def load_rendered_yaml(yaml_path, positions, variables, replace_mode='字符串和控制符', yaml_name=None):
+    """在内存中渲染 k8s yaml 后解析，校验渲染结果并返回 (文档列表, image 标量位置)，每个文件只解析一次"""
+    content = render_content(yaml_path, positions, variables, replace_mode)
+    return load_k8s_yaml(content.decode('utf-8'), yaml_name or yaml_path)
+
+
+def build_vars_map(install_dir, all_vars, empty_idx_set):
     """
-    处理中控类文件
-    :param install_dir: 交付物目录路径
-    :param replace_mode: 替换模式，字符串和控制符、仅控制符
-    :param check: 是否检查
-    :param dispose_fps: 需要处理的模版文件
-    :return:
+    由 global-vars.csv 数据生成变量表
+    :return: (变量:值 map, 文件路径:已登记变量 map)
     """
-    deploy_error_ret, script_error_ret = check_standard(install_dir)
-    total_logs, file_logs = [], []
-    template_paths = query_template_paths(install_dir) if check else dispose_fps
-    deploy_yaml_paths = query_k8s_yaml_paths(install_dir)
-    all_vars, empty_idx_set, var_error_ret, version = load_data_from_csv(
-        os.path.join(install_dir, 'controls/global-vars.csv'))
     vars_map, file_vars_map = dict(), dict()
     for i, value in enumerate(all_vars):
         if i in empty_idx_set: continue
@@ -443,34 +1588,139 @@ def dispose_controls(install_dir, replace_mode='字符串和控制符', check=Tr
         vars_map[value[1]] = value[4]
         var_files = value[5] and value[5].splitlines() or []
         var_files = len(var_files) == 1 and var_files[0].split(',') or var_files
-        [file_vars_map.setdefault(os.path.join(install_dir, vf), set()).add(value[1]) for vf in var_files]
+        for vf in var_files:
+            file_vars_map.setdefault(os.path.join(install_dir, vf), set()).add(value[1])
+    return VarTable(vars_map), file_vars_map
+
+
+def load_var_table(install_dir, cache=None):
+    """
+    由 global-vars.csv 构建变量表，使用增量检查缓存且 csv 未变化时直接读取缓存中序列化的变量表，跳过解析及校验
+    :param install_dir: 交付物目录
+    :param cache: 增量检查缓存
+    :return: (变量表, 文件路径:已登记变量 map, global-vars.csv 检查结果)
+    """
+    csv_path = os.path.join(install_dir, 'controls/global-vars.csv')
+    entry = cache and cache.lookup_var_table(csv_path)
+    if entry:
+        file_vars_map = {os.path.join(install_dir, vf): set(keys) for vf, keys in entry['file_vars'].items()}
+        return VarTable(entry['variables']), file_vars_map, (None, entry['error_logs'])
+    all_vars, empty_idx_set, var_error_ret, version = load_data_from_csv(csv_path)
+    vars_map, file_vars_map = build_vars_map(install_dir, all_vars, empty_idx_set)
+    cache and cache.put_var_table(csv_path, vars_map, file_vars_map, var_error_ret[1])
+    return vars_map, file_vars_map, var_error_ret
+
+
+def dispose_controls(install_dir, replace_mode='字符串和控制符', check=True, dispose_fps=(), jobs=1,
+                     chunk_size=DEFAULT_CHUNK_SIZE, binary_exts=BINARY_EXTENSIONS, max_size=DEFAULT_MAX_TEMPLATE_SIZE,
+                     use_cache=False, engine='regex', sink: EventSink = None, profiler: Profiler = None,
+                     cache: ScanCache = None):
+    """
+    处理中控类文件，中控类文件检查失败时抛出 AssertionError；模版文件每处理完成一个即通过 sink 输出该文件的日志
+    :param install_dir: 交付物目录路径
+    :param replace_mode: 替换模式，字符串和控制符、仅控制符
+    :param check: 是否检查
+    :param dispose_fps: 需要处理的模版文件
+    :param jobs: 并行处理模版文件的进程数
+    :param chunk_size: 流式读取的块大小
+    :param binary_exts: 不做扫描的二进制文件扩展名
+    :param max_size: 模版文件大小阈值
+    :param use_cache: 是否使用增量检查缓存（仅检查时生效）
+    :param engine: 替换引擎，regex 或 trie
+    :param sink: 日志事件输出，为空时在内存中收集
+    :param profiler: 分阶段计时
+    :param cache: 常驻检查（--watch）跨轮次保留的增量缓存，命中缓存的文件不再重复输出日志
+    :return: (汇总日志, 变量:文件路径 map, 扫描记录)
+    """
+    sink, profiler = EventSink() if sink is None else sink, profiler or Profiler()
+    resident = cache is not None
+    resident and cache.reset()
+    control_csv_paths = [os.path.join(install_dir, 'controls', name) for name in
+                         ('deploy-execution-plan.csv', 'script-execution-plan.csv')]
+    with profiler.stage('check_standard', 2, profiler.enabled and sum_file_sizes(control_csv_paths)):
+        deploy_error_ret, script_error_ret = check_standard(install_dir)
+    total_logs = []
+    template_paths, skipped = list(dispose_fps), dict()
+    cache = cache or (ScanCache(install_dir, replace_mode) if check and use_cache else None)
+    if check:
+        with profiler.stage('walk'):
+            template_paths, skipped = filter_template_paths(install_dir, query_template_paths(install_dir),
+                                                            binary_exts, max_size, cache)
+        profiler.add('walk', files=len(template_paths) + sum(map(len, skipped.values())))
+    deploy_yaml_paths = query_k8s_yaml_paths(install_dir)
+    global_csv_path = os.path.join(install_dir, 'controls/global-vars.csv')
+    with profiler.stage('var_table', 1, profiler.enabled and sum_file_sizes([global_csv_path])):
+        vars_map, file_vars_map, var_error_ret = load_var_table(install_dir, cache)
+    collect_check_logs([deploy_error_ret, script_error_ret, var_error_ret], sink)
+    scan_record = ScanRecord(vars_map, deploy_yaml_paths, replace_mode)
     all_missing_keys, all_matched_keys, all_defined_keys = set(), set(), set()
     # 替换成功的文件数量，替换成功的变量数量
     ok_file_num, all_replace_num, warn_fp, error_fp = 0, 0, [], []
     # 变量:文件路径 map
     var_fps_map = dict()
+    tasks = [(fp, file_vars_map.get(fp, set()), replace_mode, check, fp in deploy_yaml_paths, chunk_size, engine,
+              bool(cache)) for fp in template_paths if not (cache and cache.get(fp))]
+    task_rets = map_tasks(scan_template_task, tasks, vars_map, jobs)
+    # 进程池中执行时 worker 的 CPU 时间不计入主进程，由任务返回后累计
+    pooled = jobs > 1 and len(tasks) > 1
+    sink.start(len(template_paths))
     for fp in template_paths:
-        defined_keys = file_vars_map.get(fp, set())
-        replace_ret = replace_placeholders_in_file(fp, vars_map, defined_keys, replace_mode, check,
-                                                   fp in deploy_yaml_paths)
+        rel_path, size = os.path.relpath(fp, install_dir), os.path.getsize(fp)
+        with profiler.stage('scan', 1, size):
+            if cache and cache.get(fp):
+                defined_keys, positions = file_vars_map.get(fp, set()), None
+                replace_ret = cache.replace_result(fp, vars_map, defined_keys)
+            else:
+                replace_ret, defined_keys, positions, digest, (task_wall, task_cpu) = next(task_rets)
+                cache and cache.put_result(fp, replace_ret, positions, digest)
+                profiler.add_file(rel_path, task_wall)
+                pooled and profiler.add('scan', cpu=task_cpu)
         matched_keys, missing_keys, status, replace_num, replace_logs = replace_ret
+        if status and positions is not None: scan_record.positions[fp] = positions
+        yaml_result = check and status and fp in deploy_yaml_paths and resident and cache.lookup_yaml(fp)
+        if yaml_result:
+            scan_record.image_spans[rel_path], yaml_error = yaml_result
+            if yaml_error:
+                status = False
+                replace_logs.append([f'失败：error: {yaml_error}', logging.ERROR])
+        elif check and status and fp in deploy_yaml_paths:
+            # 按渲染结果校验 k8s yaml，image 标量位置保留给镜像替换使用
+            yaml_start = time.perf_counter()
+            try:
+                with profiler.stage('yaml', 1, size):
+                    scan_record.image_spans[rel_path] = load_rendered_yaml(fp, positions, vars_map, replace_mode,
+                                                                           rel_path)[1]
+                resident and cache.put_yaml(fp, scan_record.image_spans[rel_path])
+            except Exception as e:
+                status = False
+                replace_logs.append([f'失败：error: {str(e)}', logging.ERROR])
+                resident and cache.put_yaml(fp, None, str(e))
+            profiler.add_file(rel_path, time.perf_counter() - yaml_start)
         for l in replace_logs:
             if l[1] == logging.WARNING:
                 warn_fp.append(fp)
             elif l[1] == logging.ERROR:
                 error_fp.append(fp)
+                scan_record.failed = True
+        status and scan_record.scanned.append(fp)
         # 获取变量所在的文件相对路径
-        [var_fps_map.setdefault(mk, set()).add(os.path.relpath(fp, install_dir)) for mk in matched_keys]
+        for mk in matched_keys:
+            var_fps_map.setdefault(mk, set()).add(rel_path)
         all_matched_keys = all_matched_keys.union(matched_keys)
         all_missing_keys = all_missing_keys.union(missing_keys)
         all_defined_keys = all_defined_keys.union(defined_keys)
         ok_file_num += status
         all_replace_num += replace_num
-        file_logs.append([os.path.relpath(fp, install_dir), replace_logs])
+        # 常驻检查时只输出本轮重新检查的文件
+        if not (resident and cache.get(fp) and yaml_result is not None):
+            sink.file_done(rel_path, replace_logs, size, status, replace_num)
     unused_keys = vars_map.keys() - all_matched_keys
     total_logs.append(['', logging.INFO])
     total_logs.append([f'共计处理 {len(template_paths)} 个模版文件，成功 {ok_file_num} 个，替换位置 {all_replace_num} 个，'
                        f'失败 {len(template_paths) - ok_file_num} 个！', logging.INFO])
+    skipped and total_logs.append(
+        [f'跳过 {sum(map(len, skipped.values()))} 个二进制或制品文件，'
+         f'{"，".join(f"{k} {len(v)} 个" for k, v in skipped.items())}', logging.INFO])
     total_logs.append([f'全局变量表中共计定义 {len(vars_map.keys())} 个变量，成功替换 {len(all_matched_keys)} 个，'
                        f'有 {len(unused_keys)} 个已定义未替换！有 {len(all_missing_keys)} 个未定义未替换！(后两项正常应为 0 )',
                        logging.INFO])
@@ -482,91 +1732,995 @@ def dispose_controls(install_dir, replace_mode='字符串和控制符', check=Tr
          f'请确认！！！  \n{all_missing_keys}', logging.WARNING])
     warn_fp and total_logs.append([f'处理以下模版文件时出现警告，请关注日志！  \n{warn_fp}', logging.WARNING])
     error_fp and total_logs.append([f'处理以下模版文件时出现错误，请修复！  \n{error_fp}', logging.ERROR])
-    return [deploy_error_ret, script_error_ret, var_error_ret], file_logs, total_logs, var_fps_map
+    cache and cache.save()
+    return total_logs, var_fps_map, scan_record
+
+
+def render_templates(scan_record: ScanRecord, dispose_fps, jobs=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    根据扫描记录渲染模版文件
+    :param scan_record: dispose_controls 检查时生成的扫描记录
+    :param dispose_fps: 需要渲染的模版文件
+    :param jobs: 并行渲染的进程数
+    :param chunk_size: 流式读取的块大小
+    :return:
+    """
+    tasks = [(fp, scan_record.positions.get(fp), scan_record.replace_mode, chunk_size) for fp in dispose_fps]
+    for _ in map_tasks(render_template_task, tasks, scan_record.vars_map, jobs): pass
+
+
+def collect_check_logs(error_rets, logs):
+    """
+    汇总中控类文件的检查日志，存在错误时抛出 AssertionError
+    :param error_rets: deploy、script、global-vars 的检查结果
+    :param logs: 日志列表或 EventSink
+    :return:
+    """
+    exist_error = False
+    error_log_titles = [['deploy-execution-plan.csv 检查失败：', logging.ERROR],
+                        ['script-execution-plan.csv 检查失败：', logging.ERROR],
+                        ['global-vars.csv 检查失败：', logging.ERROR]]
+    for i, error_ret in enumerate(error_rets):
+        _, error_logs = error_ret
+        if error_logs:
+            exist_error = True
+            logs.append(error_log_titles[i])
+            logs.extend([[e, logging.ERROR] for e in error_logs])
+    assert not exist_error, '中控类文件检查失败!'
 
 
 def exec_replace(install_dir, replace_mode='字符串和控制符', check=False,
-                 old_image_prefix=None, new_image_prefix=None) -> Tuple[bool, List[Tuple[str, int]]]:
+                 old_image_prefix=None, new_image_prefix=None, jobs=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                 binary_exts=BINARY_EXTENSIONS, max_size=DEFAULT_MAX_TEMPLATE_SIZE,
+                 use_cache=False, output=None, link_mode='auto', engine='regex',
+                 index=False, retain=False, sink: EventSink = None,
+                 profiler: Profiler = None) -> Tuple[bool, List[Tuple[str, int]]]:
     """
-    :param install_dir: 物料路径
+    :param install_dir: 物料路径，或 .tar.gz/.tgz/.tar/.zip 交付物归档（不整体解压，需指定 output）
     :param replace_mode: 字符串和控制符 or 仅控制符
     :param check: 是否检查模式
     :param old_image_prefix:
     :param new_image_prefix:
+    :param jobs: 并行处理模版文件的进程数
+    :param chunk_size: 流式读取的块大小
+    :param binary_exts: 不做扫描的二进制文件扩展名
+    :param max_size: 模版文件大小阈值，0 表示不限制
+    :param use_cache: 是否使用增量检查缓存
+    :param output: 输出目录或归档路径，为空时原地替换
+    :param link_mode: 输出目录时未改动文件的输出方式，auto、reflink、hardlink、copy
+    :param engine: 替换引擎，regex 或 trie
+    :param index: 是否生成占位符索引
+    :param retain: 原地渲染时是否保留原始模版，供 --rerender 使用
+    :param sink: 日志事件输出，为空时在内存中收集，随结果返回；指定时日志在产生时即输出，返回的日志只含剩余部分
+    :param profiler: 分阶段计时
     :return: (脚本执行状态，日志及级别）
     """
-    exist_error, logs = False, []
-    error_log_titles = [['deploy-execution-plan.csv 检查失败：', logging.ERROR],
-                        ['script-execution-plan.csv 检查失败：', logging.ERROR],
-                        ['global-vars.csv 检查失败：', logging.ERROR]]
+    logs, profiler, source = EventSink() if sink is None else sink, profiler or Profiler(), None
     try:
-        error_rets, file_logs, total_logs, var_fps_map = dispose_controls(install_dir, replace_mode, True)
-        for i, error_ret in enumerate(error_rets):
-            mask, error_logs = error_ret
-            if error_logs:
-                exist_error = True
-                logs.append(error_log_titles[i])
-                logs.extend([[e, logging.ERROR] for e in error_logs])
-        assert not exist_error, '中控类文件检查失败!'
-        for file_log in file_logs:
-            logs.append([f'-----------------  检查文件:{file_log[0]}  -----------------', logging.INFO])
-            logs.extend(file_log[1])
-            for l in file_log[1]:
-                if l[1] == logging.ERROR:
-                    exist_error = True
-                    break
-        assert not exist_error, '模版文件检查失败!'
+        assert chunk_size > 0, f'流式读取的块大小需为正整数：{chunk_size}'
+        if os.path.isfile(install_dir) and archive_format(install_dir):
+            assert check or output, '交付物为归档时需指定 --output 输出目录或归档！'
+            assert not (use_cache or index or retain), '交付物为归档时不支持 --cache、--index、--retain！'
+            assert not output or os.path.abspath(output) != os.path.abspath(install_dir), '输出归档不能与交付物归档相同！'
+            source = ArchivePackage(install_dir)
+            with profiler.stage('unpack'):
+                install_dir = source.stage(binary_exts, max_size)
+            profiler.add('unpack', read=source.staged_size)
+            logs.append([f'读取交付物归档：{source.path}，文本文件暂存至 {install_dir}（共 '
+                         f'{format_size(source.staged_size)}），{len(source.stubs)} 个二进制/制品文件不解压', logging.INFO])
+        total_logs, var_fps_map, scan_record = \
+            dispose_controls(install_dir, replace_mode, True, jobs=jobs, chunk_size=chunk_size, binary_exts=binary_exts,
+                             max_size=max_size, use_cache=use_cache, engine=engine, sink=logs, profiler=profiler)
+        if index:
+            with profiler.stage('index'):
+                placeholder_index = PlaceholderIndex(install_dir, replace_mode).build(scan_record, chunk_size)
+                placeholder_index.save()
+            profiler.add('index', files=len(placeholder_index.files))
+            logs.append([f'占位符索引已生成：{placeholder_index.path}，共 {len(placeholder_index.keys)} 个变量，'
+                         f'{len(placeholder_index.files)} 个文件', logging.INFO])
+        assert not scan_record.failed, '模版文件检查失败!'
         logs.extend(total_logs)
-        if not check:
+        if not check and output:
+            with profiler.stage('export', len(scan_record.scanned)):
+                scan_record.fill_positions(chunk_size)
+                export_package(install_dir, output, scan_record, var_fps_map, old_image_prefix, new_image_prefix,
+                               jobs, chunk_size, link_mode, source)
+        elif not check:
             fix_global_csv(os.path.join(install_dir, 'controls/global-vars.csv'), var_fps_map)
             dispose_fps = set()
             for fps in var_fps_map.values():
                 dispose_fps.update([os.path.join(install_dir, rp) for rp in fps])
-            dispose_controls(install_dir, replace_mode, False, dispose_fps)
-            replace_k8s_images(install_dir, old_image_prefix, new_image_prefix)
+            if retain:
+                with profiler.stage('retain', len(dispose_fps)):
+                    retain_templates(install_dir, scan_record, dispose_fps, chunk_size)
+            read_size = profiler.enabled and sum_file_sizes(dispose_fps)
+            with profiler.stage('render', len(dispose_fps), read_size):
+                render_templates(scan_record, dispose_fps, jobs, chunk_size)
+            profiler.add('render', written=profiler.enabled and sum_file_sizes(dispose_fps))
+            with profiler.stage('images'):
+                yaml_paths = replace_k8s_images(install_dir, old_image_prefix, new_image_prefix,
+                                                scan_record.image_spans)
+            yaml_size = profiler.enabled and sum_file_sizes(yaml_paths)
+            profiler.add('images', files=len(yaml_paths), read=yaml_size, written=yaml_size)
+        return True, [*logs, ['全局变量替换工具执行成功！', logging.INFO]]
+    except Exception as e:
+        return False, [*logs, [str(e), logging.ERROR], ['全局变量替换工具执行失败！', logging.ERROR]]
+    finally:
+        source and source.close()
+
+
+def snapshot_package(install_dir):
+    """
+    记录交付物中参与检查的文件（controls、k8s-resources、scripts 及 .replaceignore）的修改时间及大小
+    :param install_dir: 交付物目录
+    :return: {文件路径: (mtime_ns, size)}
+    """
+    snapshot = dict()
+    paths = [os.path.join(install_dir, REPLACE_IGNORE_FILE)]
+    for name in ('controls', 'k8s-resources', 'scripts'):
+        for subdir, _, files in os.walk(os.path.join(install_dir, name)):
+            paths.extend(os.path.join(subdir, filename) for filename in files)
+    for fp in paths:
+        try:
+            st = os.stat(fp)
+        except OSError:
+            continue
+        snapshot[fp] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+
+def exec_watch(install_dir, replace_mode='字符串和控制符', jobs=1, chunk_size=DEFAULT_CHUNK_SIZE,
+               binary_exts=BINARY_EXTENSIONS, max_size=DEFAULT_MAX_TEMPLATE_SIZE, use_cache=False, engine='regex',
+               interval=DEFAULT_WATCH_INTERVAL, rounds=0, sink: EventSink = None) -> Tuple[bool, List[Tuple[str, int]]]:
+    """
+    常驻检查：变量表、各文件的占位符 key 计数及 k8s yaml 校验结果保留在内存中，按修改时间及大小轮询文件变化，
+    有变化时只重新扫描变化的文件（global-vars.csv 变化时重新解析变量表），并重新输出已定义未替换、未定义未替换的汇总
+    :param install_dir: 物料路径
+    :param replace_mode: 字符串和控制符 or 仅控制符
+    :param jobs: 并行处理模版文件的进程数
+    :param chunk_size: 流式读取的块大小
+    :param binary_exts: 不做扫描的二进制文件扩展名
+    :param max_size: 模版文件大小阈值，0 表示不限制
+    :param use_cache: 是否同时读写增量检查缓存文件，下次启动时首轮检查也只扫描变化的文件
+    :param engine: 替换引擎，regex 或 trie
+    :param interval: 轮询间隔（秒）
+    :param rounds: 检查轮数，0 表示持续运行至 Ctrl+C
+    :param sink: 日志事件输出，为空时在内存中收集，随结果返回
+    :return: (最后一轮检查状态，日志及级别）
+    """
+    logs, status = EventSink() if sink is None else sink, False
+    cache, snapshot, checked = ScanCache(install_dir, replace_mode, persist=use_cache), None, 0
+    try:
+        while not rounds or checked < rounds:
+            current = snapshot_package(install_dir)
+            if current == snapshot:
+                time.sleep(interval)
+                continue
+            if snapshot is not None:
+                changed = sorted(os.path.relpath(fp, install_dir) for fp in current.keys() | snapshot.keys()
+                                 if current.get(fp) != snapshot.get(fp))
+                logs.append([f'检测到 {len(changed)} 个文件变化：{changed}', logging.INFO])
+            # 先记录快照再检查，检查过程中的修改在下一轮处理
+            snapshot, checked, start = current, checked + 1, time.perf_counter()
+            try:
+                total_logs, _, scan_record = dispose_controls(install_dir, replace_mode, True, jobs=jobs,
+                                                              chunk_size=chunk_size, binary_exts=binary_exts,
+                                                              max_size=max_size, engine=engine, sink=logs, cache=cache)
+                logs.extend(total_logs)
+                status = not scan_record.failed
+            except Exception as e:
+                logs.append([str(e), logging.ERROR])
+                status = False
+            logs.append([f'第 {checked} 轮检查{"通过" if status else "未通过"}，耗时 '
+                         f'{(time.perf_counter() - start) * 1000:.0f}ms，等待文件变化（Ctrl+C 退出）...',
+                         logging.INFO if status else logging.ERROR])
+    except KeyboardInterrupt:
+        logs.append(['已退出常驻检查', logging.INFO])
+    return status, [*logs]
+
+
+def retain_template(install_dir, fp):
+    """将模版文件保留至原始模版目录（优先 reflink/硬链接，渲染为原子替换，不影响保留的文件），返回保留路径"""
+    dst = os.path.join(install_dir, TEMPLATE_STORE_DIR, os.path.relpath(fp, install_dir))
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    link_or_copy(fp, dst)
+    return dst
+
+
+def save_template_vars(store_dir, variables):
+    """保存渲染使用的变量表，下次 --rerender 时与新的变量表比较"""
+    with AtomicWriter(os.path.join(store_dir, TEMPLATE_STORE_VARS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(dict(variables), f, ensure_ascii=False, separators=(',', ':'))
+
+
+def retain_templates(install_dir, scan_record: ScanRecord, dispose_fps, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    原地渲染前保留原始模版，同时保存占位符索引及本次使用的变量表，之前保留的内容全部替换
+    :param install_dir: 交付物目录
+    :param scan_record: 扫描记录
+    :param dispose_fps: 需要渲染的模版文件
+    :param chunk_size: 流式读取的块大小
+    :return:
+    """
+    store_dir = os.path.join(install_dir, TEMPLATE_STORE_DIR)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.makedirs(store_dir)
+    for fp in dispose_fps:
+        retain_template(install_dir, fp)
+    PlaceholderIndex(install_dir, scan_record.replace_mode, os.path.join(store_dir, PLACEHOLDER_INDEX_FILE)).build(
+        scan_record, chunk_size).save()
+    save_template_vars(store_dir, scan_record.vars_map)
+
+
+def exec_rerender(install_dir, replace_mode='字符串和控制符', old_image_prefix=None, new_image_prefix=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE, engine='regex') -> Tuple[bool, List[Tuple[str, int]]]:
+    """
+    变量表变化后只重新渲染受影响的文件：与上次渲染的变量表比较，按占位符索引找到使用变化变量的文件，
+    从保留的原始模版重新渲染（需先使用 --retain 原地渲染），global-vars.csv 的文件路径列同时按索引更新
+    :param install_dir: 物料路径
+    :param replace_mode: 字符串和控制符 or 仅控制符
+    :param old_image_prefix: 与首次渲染相同，用于重新替换受影响的 k8s yaml 中的镜像
+    :param new_image_prefix:
+    :param chunk_size: 流式读取的块大小
+    :param engine: 替换引擎，regex 或 trie
+    :return: (脚本执行状态，日志及级别）
+    """
+    logs = []
+    try:
+        store_dir = os.path.join(install_dir, TEMPLATE_STORE_DIR)
+        vars_path = os.path.join(store_dir, TEMPLATE_STORE_VARS_FILE)
+        assert os.path.exists(vars_path), '未发现保留的原始模版，请先使用 --retain 原地渲染！'
+        with open(vars_path, 'r', encoding='utf-8') as f:
+            old_vars = json.load(f)
+        placeholder_index = PlaceholderIndex(store_dir, path=os.path.join(store_dir, PLACEHOLDER_INDEX_FILE)).load()
+        assert placeholder_index.replace_mode == replace_mode, \
+            f'替换模式与保留原始模版时（{placeholder_index.replace_mode}）不一致，请调整！'
+        vars_map, _, var_error_ret = load_var_table(install_dir)
+        collect_check_logs([(None, []), (None, []), var_error_ret], logs)
+        changed_keys = {k for k in old_vars.keys() | vars_map.keys() if old_vars.get(k) != vars_map.get(k)}
+        affected = sorted({rel_path for k in changed_keys for rel_path in placeholder_index.impact(k)})
+        logs.append([f'与上次渲染相比变化的变量 {len(changed_keys)} 个，需要重新渲染 {len(affected)} 个文件'
+                     f'{"：" + str(changed_keys) if changed_keys else ""}', logging.INFO])
+        deploy_yaml_paths = {os.path.normpath(p) for p in query_k8s_yaml_paths(install_dir)}
+        image_updates = query_image_updates(install_dir, old_image_prefix, new_image_prefix)
+        for rel_path in affected:
+            fp = os.path.join(install_dir, rel_path)
+            template_path = os.path.join(store_dir, rel_path)
+            # 首次渲染时没有已定义变量的文件仍为原始模版，渲染前先保留
+            os.path.exists(template_path) or retain_template(install_dir, fp)
+            positions, image_spans = [], None
+            stream_replace(template_path, vars_map, replace_mode, chunk_size=chunk_size, positions=positions,
+                           engine=engine)
+            if os.path.normpath(fp) in deploy_yaml_paths:
+                image_spans = load_rendered_yaml(template_path, positions, vars_map, replace_mode, rel_path)[1]
+            replace_num = render_from_positions(template_path, positions, vars_map, chunk_size, fp)
+            if rel_path in image_updates:
+                update_image_in_yaml(fp, image_updates[rel_path], image_spans, chunk_size)
+            logs.append([f'重新渲染 {rel_path}，替换位置 {replace_num} 个', logging.INFO])
+        # 文件路径列按原始模版的占位符索引更新（新增变量、变量改名后与完整渲染的结果一致）
+        var_fps_map = {key: placeholder_index.impact(key) for key in vars_map}
+        fix_global_csv(os.path.join(install_dir, 'controls/global-vars.csv'),
+                       {key: rel_paths for key, rel_paths in var_fps_map.items() if rel_paths})
+        save_template_vars(store_dir, vars_map)
+        return True, [*logs, ['全局变量替换工具执行成功！', logging.INFO]]
+    except Exception as e:
+        return False, [*logs, [str(e), logging.ERROR], ['全局变量替换工具执行失败！', logging.ERROR]]
+
+
+def exec_query_index(install_dir, where_keys=(), impact_keys=(), max_lines=20) -> Tuple[bool, List[Tuple[str, int]]]:
+    """
+    查询占位符索引，不重新扫描模版文件
+    :param install_dir: 物料路径
+    :param where_keys: 查询出现位置的变量
+    :param impact_keys: 查询变化时影响文件的变量
+    :param max_lines: 每个文件最多显示的行号个数
+    :return: (脚本执行状态，日志及级别）
+    """
+    logs = []
+    try:
+        placeholder_index = PlaceholderIndex(install_dir).load()
+        stale_files = placeholder_index.stale_files()
+        stale_files and logs.append([f'以下文件在生成索引后已变化，查询结果可能不准确，请使用 --index 重新生成！  '
+                                     f'\n{stale_files}', logging.WARNING])
+        for key in where_keys:
+            occurrences = placeholder_index.where(key)
+            logs.append([f'-----------------  变量 {key} 共出现 {sum(map(len, occurrences.values()))} 处，'
+                         f'{len(occurrences)} 个文件  -----------------', logging.INFO])
+            for rel_path, items in sorted(occurrences.items()):
+                lines = ', '.join(str(line) for _, line in items[:max_lines])
+                logs.append([f'{rel_path}：{len(items)} 处，行 {lines}{" ..." if len(items) > max_lines else ""}',
+                             logging.INFO])
+        for key in impact_keys:
+            rel_paths = placeholder_index.impact(key)
+            logs.append([f'-----------------  变量 {key} 变化时影响 {len(rel_paths)} 个文件  -----------------',
+                         logging.INFO])
+            logs.extend([rel_path, logging.INFO] for rel_path in rel_paths)
+        return True, logs
+    except Exception as e:
+        return False, [*logs, [str(e), logging.ERROR], ['占位符索引查询失败！', logging.ERROR]]
+
+
+def query_batch_var_csvs(batch_vars):
+    """
+    查找多环境变量表，可传入 csv 文件或包含 csv 文件的目录
+    :param batch_vars: 路径列表
+    :return: {环境名称（文件名）: csv 路径}
+    """
+    csv_paths = dict()
+    for path in batch_vars:
+        fps = [os.path.join(path, fn) for fn in sorted(os.listdir(path)) if fn.lower().endswith('.csv')] \
+            if os.path.isdir(path) else [path]
+        for fp in fps:
+            name = os.path.splitext(os.path.basename(fp))[0]
+            assert name not in csv_paths, '多环境变量表 {} 重名，请调整文件名！'.format(name)
+            csv_paths[name] = fp
+    assert csv_paths, '未发现多环境变量表，请确认！'
+    return csv_paths
+
+
+def render_tree(install_dir, output_dir, scan_record: ScanRecord, variables, jobs=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                link_mode='auto'):
+    """
+    将交付物目录渲染到 output_dir：含已定义占位符的文件按扫描记录的位置拼接写入，其余文件 reflink/硬链接/复制
+    :param install_dir: 交付物目录
+    :param output_dir: 输出目录
+    :param scan_record: 扫描记录
+    :param variables: 变量表
+    :param jobs: 并行渲染的进程数
+    :param chunk_size: 流式读取的块大小
+    :param link_mode: 未改动文件的输出方式，auto、reflink、hardlink、copy
+    :return:
+    """
+    tasks = []
+    for subdir, dirs, files in os.walk(install_dir):
+        if subdir == install_dir:
+            dirs[:] = [d for d in dirs if d not in TOOL_STATE_FILES]
+        dst_dir = os.path.join(output_dir, os.path.relpath(subdir, install_dir))
+        os.makedirs(dst_dir, exist_ok=True)
+        for filename in files:
+            fp, dst = os.path.join(subdir, filename), os.path.join(dst_dir, filename)
+            if subdir == install_dir and filename in TOOL_STATE_FILES: continue
+            positions = scan_record.positions.get(fp, ())
+            if any(key in variables for _, _, key in positions):
+                tasks.append((fp, positions, scan_record.replace_mode, chunk_size, dst))
+            else:
+                link_or_copy(fp, dst, link_mode)
+    for _ in map_tasks(render_template_task, tasks, variables, jobs): pass
+
+
+def archive_modules():
+    """延迟导入 tarfile、zipfile，只有处理归档时才需要"""
+    import tarfile
+    import zipfile
+    return tarfile, zipfile
+
+
+def archive_format(path):
+    """返回归档格式后缀，非归档路径返回空字符串"""
+    return next((suffix for suffix in ARCHIVE_SUFFIXES if path.lower().endswith(suffix)), '')
+
+
+def add_archive_member(archive, src, arcname, positions=(), variables=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """将文件边渲染边写入归档，positions 为空时原样写入"""
+    _, zipfile = archive_modules()
+    with open(src, 'rb') as fin:
+        blocks = iter_rendered_blocks(fin, positions, variables or dict(), chunk_size)
+        if isinstance(archive, zipfile.ZipFile):
+            zinfo = zipfile.ZipInfo.from_file(src, arcname)
+            zinfo.compress_type = zipfile.ZIP_STORED if os.path.splitext(src)[1].lower() in BINARY_EXTENSIONS \
+                else zipfile.ZIP_DEFLATED
+            with archive.open(zinfo, 'w', force_zip64=True) as fout:
+                for block in blocks:
+                    fout.write(block)
+        else:
+            tarinfo = archive.gettarinfo(src, arcname)
+            tarinfo.isreg() and setattr(tarinfo, 'size', rendered_size(tarinfo.size, positions, variables))
+            archive.addfile(tarinfo, BlockReader(blocks) if tarinfo.isreg() else None)
+
+
+def write_archive(install_dir, archive_path, scan_record: ScanRecord, variables, overrides=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    将交付物目录渲染后直接写入 tar.gz/tgz/tar/zip 归档，归档内以交付物目录名为根目录
+    :param install_dir: 交付物目录
+    :param archive_path: 归档路径
+    :param scan_record: 扫描记录
+    :param variables: 变量表
+    :param overrides: {相对路径: 已生成的文件}，这些成员直接使用已生成的文件
+    :param chunk_size: 流式读取的块大小
+    :return:
+    """
+    tarfile, zipfile = archive_modules()
+    overrides, fmt = overrides or dict(), archive_format(archive_path)
+    root_name = os.path.basename(os.path.normpath(install_dir))
+    archive = zipfile.ZipFile(archive_path, 'w', allowZip64=True) if fmt == '.zip' else \
+        tarfile.open(archive_path, 'w' if fmt == '.tar' else 'w:gz')
+    with archive:
+        for subdir, dirs, files in os.walk(install_dir):
+            dirs[:] = sorted(d for d in dirs if not (subdir == install_dir and d in TOOL_STATE_FILES))
+            for filename in sorted(files):
+                fp = os.path.join(subdir, filename)
+                rel_path = os.path.relpath(fp, install_dir)
+                if rel_path in TOOL_STATE_FILES: continue
+                arcname = '/'.join([root_name, *rel_path.split(os.sep)])
+                if rel_path in overrides:
+                    add_archive_member(archive, overrides[rel_path], arcname, chunk_size=chunk_size)
+                    continue
+                positions = [p for p in scan_record.positions.get(fp, ()) if p[2] in variables]
+                add_archive_member(archive, fp, arcname, positions, variables, chunk_size)
+
+
+def export_package(install_dir, output, scan_record: ScanRecord, var_fps_map, old_image_prefix=None,
+                   new_image_prefix=None, jobs=1, chunk_size=DEFAULT_CHUNK_SIZE, link_mode='auto', source=None):
+    """
+    渲染交付物到输出目录或归档，交付物目录本身保持不变
+    :param install_dir: 交付物目录
+    :param output: 输出目录，或 .tar.gz/.tgz/.tar/.zip 归档路径
+    :param scan_record: 扫描记录
+    :param var_fps_map: 变量:文件路径 map，用于更新 global-vars.csv 的文件路径列
+    :param old_image_prefix:
+    :param new_image_prefix:
+    :param jobs: 并行渲染的进程数
+    :param chunk_size: 流式读取的块大小
+    :param link_mode: 输出目录时未改动文件的输出方式
+    :param source: 交付物为归档时的 ArchivePackage，install_dir 为其暂存目录，成员从原归档按顺序输出
+    :return:
+    """
+    assert not (os.path.abspath(output) + os.sep).startswith(os.path.abspath(install_dir) + os.sep), \
+        '输出路径不能位于交付物目录内，请调整！'
+    global_csv_path = os.path.join(install_dir, 'controls/global-vars.csv')
+    variables = scan_record.vars_map
+    if source is None and not archive_format(output):
+        render_tree(install_dir, output, scan_record, variables, jobs, chunk_size, link_mode)
+        fix_global_csv(global_csv_path, var_fps_map, os.path.join(output, 'controls/global-vars.csv'))
+        replace_k8s_images(output, old_image_prefix, new_image_prefix, scan_record.image_spans)
+        return
+    # 归档：global-vars.csv 及需要替换镜像的 yaml 先在暂存目录生成，其余文件直接渲染写入归档
+    with tempfile.TemporaryDirectory() as staging:
+        def _stage(rel_path):
+            if rel_path not in overrides:
+                fp, overrides[rel_path] = os.path.join(install_dir, rel_path), os.path.join(staging, rel_path)
+                os.makedirs(os.path.dirname(overrides[rel_path]), exist_ok=True)
+                render_from_positions(fp, scan_record.positions.get(fp, ()), variables, chunk_size=chunk_size,
+                                      output_path=overrides[rel_path])
+            return overrides[rel_path]
+
+        overrides = {'controls/global-vars.csv': os.path.join(staging, 'controls/global-vars.csv')}
+        os.makedirs(os.path.join(staging, 'controls'))
+        fix_global_csv(global_csv_path, var_fps_map, overrides['controls/global-vars.csv'])
+        deploy_csv_path = _stage(os.path.join('controls', 'deploy-execution-plan.csv'))
+        image_updates = query_image_updates(install_dir, old_image_prefix, new_image_prefix, deploy_csv_path)
+        for yaml_rel_path, image_rows in image_updates.items():
+            update_image_in_yaml(_stage(yaml_rel_path), image_rows, scan_record.image_spans.get(yaml_rel_path),
+                                 chunk_size)
+        if source is None:
+            write_archive(install_dir, output, scan_record, variables, overrides, chunk_size)
+        else:
+            source.export(output, scan_record, variables, overrides, chunk_size)
+
+
+def iter_archive_members(archive):
+    """按归档内的顺序返回成员信息，tar 逐个读取成员头，不预先读取整个归档"""
+    _, zipfile = archive_modules()
+    return iter(archive.infolist()) if isinstance(archive, zipfile.ZipFile) else iter(archive)
+
+
+def archive_member_meta(info):
+    """
+    返回归档成员的 (成员名, 类型, 大小, 权限, 修改时间)
+    :param info: TarInfo 或 ZipInfo
+    :return: 成员名统一为 / 分隔的相对路径；类型为 file、dir、symlink、hardlink（tar 硬链接）、other（设备文件等）
+    """
+    _, zipfile = archive_modules()
+    if isinstance(info, zipfile.ZipInfo):
+        name, size, file_mode = info.filename, info.file_size, info.external_attr >> 16
+        kind = 'dir' if info.is_dir() else 'symlink' if stat.S_ISLNK(file_mode) else 'file'
+        mode = stat.S_IMODE(file_mode) or (0o755 if kind == 'dir' else 0o644)
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+    else:
+        name, size, mode, mtime = info.name, info.size, info.mode, info.mtime
+        kind = 'file' if info.isreg() else 'dir' if info.isdir() else 'symlink' if info.issym() else \
+            'hardlink' if info.islnk() else 'other'
+    return normalize_member_name(name), kind, size, mode, mtime
+
+
+def normalize_member_name(name):
+    """归档成员名统一为 / 分隔、不含 . 的相对路径，绝对路径或包含 .. 时抛出异常"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    assert not name.startswith('/') and '..' not in parts, f'归档成员路径非法：{name}，请确认！！！'
+    return '/'.join(parts)
+
+
+def open_archive_member(archive, info):
+    """打开归档成员的数据流"""
+    _, zipfile = archive_modules()
+    return archive.open(info) if isinstance(archive, zipfile.ZipFile) else archive.extractfile(info)
+
+
+def strip_zip64_extra(extra):
+    """去掉 zip 扩展字段中的 zip64 字段（0x0001），写入时由 zipfile 按需重新生成"""
+    fields, offset = [], 0
+    while offset + 4 <= len(extra):
+        field_id, field_size = struct.unpack('<HH', extra[offset:offset + 4])
+        field_id != 1 and fields.append(extra[offset:offset + 4 + field_size])
+        offset += 4 + field_size
+    return b''.join(fields)
+
+
+def zip_raw_copy_supported(target):
+    """
+    直接复制压缩数据依赖 zipfile 的内部实现（成员头结构及 ZipFile 的写入状态），
+    缺少任一内部属性或输出不可 seek 时返回 False，改为解压后重新压缩写入
+    """
+    _, zipfile = archive_modules()
+    return all(hasattr(zipfile, name) for name in ZIP_RAW_COPY_MODULE_ATTRS) and \
+        all(hasattr(target, name) for name in ZIP_RAW_COPY_WRITER_ATTRS) and \
+        target.fp.seekable() and not getattr(target, '_writing', False)
+
+
+def copy_zip_member(source, target, zinfo, arcname, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    zip 到 zip 直接复制成员的压缩数据，不解压、不重新压缩；
+    当前 Python 的 zipfile 不支持直接复制时，按原压缩方式解压后重新压缩写入
+    :param source: 来源 ZipFile
+    :param target: 输出 ZipFile（写模式）
+    :param zinfo: 来源成员
+    :param arcname: 输出的成员名
+    :param chunk_size: 复制的块大小
+    :return:
+    """
+    _, zipfile = archive_modules()
+    new_info = copy.copy(zinfo)
+    new_info.filename, new_info.extra = arcname, strip_zip64_extra(zinfo.extra)
+    if not zip_raw_copy_supported(target):
+        # 写入时按 file_size 判断是否需要 zip64，大小及 CRC 在写入完成后更新
+        with source.open(zinfo) as fin, target.open(new_info, 'w') as fout:
+            shutil.copyfileobj(fin, fout, chunk_size)
+        return
+    source.fp.seek(zinfo.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, source.fp.read(zipfile.sizeFileHeader))
+    assert header[zipfile._FH_SIGNATURE] == zipfile.stringFileHeader, f'zip 成员头损坏：{zinfo.filename}'
+    source.fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+    # 大小及 CRC 已知，直接写在成员头中，不再使用数据描述符
+    new_info.flag_bits &= ~0x08
+    target.fp.seek(target.start_dir)
+    new_info.header_offset = target.start_dir
+    target.fp.write(new_info.FileHeader())
+    for block in iter_file_range(source.fp, zinfo.compress_size, chunk_size):
+        target.fp.write(block)
+    target.filelist.append(new_info)
+    target.NameToInfo[new_info.filename] = new_info
+    target.start_dir = target.fp.tell()
+    target._didModify = True
+
+
+class PackageWriter(object):
+    """将成员写入输出目录或 tar.gz/tgz/tar/zip 归档，成员的权限及修改时间沿用来源"""
+
+    def __init__(self, output):
+        tarfile, zipfile = archive_modules()
+        self.output, self.format = output, archive_format(output)
+        if self.format == '.zip':
+            self.archive = zipfile.ZipFile(output, 'w', allowZip64=True)
+        elif self.format:
+            self.archive = tarfile.open(output, 'w' if self.format == '.tar' else 'w:gz')
+        else:
+            self.archive = None
+            os.makedirs(output, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.archive and self.archive.close()
+
+    def path(self, arcname):
+        return os.path.join(self.output, *arcname.split('/'))
+
+    def add_dir(self, arcname, mode, mtime):
+        tarfile, zipfile = archive_modules()
+        if self.format == '.zip':
+            zinfo = zipfile.ZipInfo(arcname + '/', time.localtime(mtime)[:6])
+            zinfo.external_attr = (stat.S_IFDIR | mode) << 16 | 0x10
+            self.archive.writestr(zinfo, b'')
+        elif self.format:
+            tarinfo = tarfile.TarInfo(arcname)
+            tarinfo.type, tarinfo.mode, tarinfo.mtime = tarfile.DIRTYPE, mode, mtime
+            self.archive.addfile(tarinfo)
+        else:
+            os.makedirs(self.path(arcname), exist_ok=True)
+
+    def add_symlink(self, arcname, target, mtime):
+        tarfile, zipfile = archive_modules()
+        if self.format == '.zip':
+            zinfo = zipfile.ZipInfo(arcname, time.localtime(mtime)[:6])
+            zinfo.external_attr = (stat.S_IFLNK | 0o777) << 16
+            self.archive.writestr(zinfo, target)
+        elif self.format:
+            tarinfo = tarfile.TarInfo(arcname)
+            tarinfo.type, tarinfo.linkname, tarinfo.mode, tarinfo.mtime = tarfile.SYMTYPE, target, 0o777, mtime
+            self.archive.addfile(tarinfo)
+        else:
+            dst = self.path(arcname)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.path.lexists(dst) and os.remove(dst)
+            os.symlink(target, dst)
+
+    def add_file(self, arcname, mode, mtime, size, blocks, compress_type=None):
+        """
+        写入文件成员
+        :param arcname: 成员名
+        :param mode: 权限
+        :param mtime: 修改时间
+        :param size: 文件大小，tar 成员头需要预先写入
+        :param blocks: 文件数据块
+        :param compress_type: zip 压缩方式，为空时按扩展名选择，二进制文件不再压缩
+        :return:
+        """
+        tarfile, zipfile = archive_modules()
+        if self.format == '.zip':
+            zinfo = zipfile.ZipInfo(arcname, time.localtime(mtime)[:6])
+            zinfo.external_attr = (stat.S_IFREG | mode) << 16
+            zinfo.compress_type = compress_type if compress_type is not None else zipfile.ZIP_STORED \
+                if os.path.splitext(arcname)[1].lower() in BINARY_EXTENSIONS else zipfile.ZIP_DEFLATED
+            with self.archive.open(zinfo, 'w', force_zip64=True) as fout:
+                for block in blocks:
+                    fout.write(block)
+        elif self.format:
+            tarinfo = tarfile.TarInfo(arcname)
+            tarinfo.size, tarinfo.mode, tarinfo.mtime = size, mode, mtime
+            self.archive.addfile(tarinfo, BlockReader(blocks))
+        else:
+            dst = self.path(arcname)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            with open(dst, 'wb') as fout:
+                for block in blocks:
+                    fout.write(block)
+            os.chmod(dst, mode)
+            os.utime(dst, (mtime, mtime))
+
+
+class ArchivePackage(object):
+    """
+    tar.gz/tgz/tar/zip 归档形式的交付物，不整体解压：文本成员暂存至临时目录供检查、扫描；
+    二进制/超过阈值的成员只写入文件头并按成员大小截断为稀疏文件，跳过判定及路径检查与解压后一致。
+    输出时按原归档的成员顺序写出，未改动的成员从原归档复制，zip 输出为 zip 时直接复制压缩数据
+    """
+
+    def __init__(self, path):
+        self.path, self.format = os.path.abspath(path), archive_format(path)
+        self.staging, self.root, self.stubs, self.staged_size = None, '', set(), 0
+
+    def open(self):
+        tarfile, zipfile = archive_modules()
+        return zipfile.ZipFile(self.path) if self.format == '.zip' else tarfile.open(self.path, 'r:*')
+
+    def close(self):
+        self.staging and shutil.rmtree(self.staging, ignore_errors=True)
+
+    def staged_path(self, name):
+        return os.path.join(self.staging, *name.split('/'))
+
+    def stage(self, binary_exts=BINARY_EXTENSIONS, max_size=DEFAULT_MAX_TEMPLATE_SIZE):
+        """
+        暂存归档成员，tar 硬链接按链接目标的暂存内容另存一份，与解压后的目录一致
+        :param binary_exts: 二进制文件扩展名
+        :param max_size: 文件大小阈值，0 表示不限制
+        :return: 暂存目录中的交付物目录，即包含 controls/global-vars.csv 的最浅一级目录
+        """
+        self.staging, csv_dirs = tempfile.mkdtemp(prefix='replace_vars_'), []
+        with self.open() as archive:
+            for info in iter_archive_members(archive):
+                name, kind, size, _, _ = archive_member_meta(info)
+                dst = self.staged_path(name)
+                if kind == 'dir':
+                    os.makedirs(dst, exist_ok=True)
+                if kind == 'hardlink':
+                    self.stage_hardlink(name, normalize_member_name(info.linkname))
+                if kind != 'file': continue
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                with open_archive_member(archive, info) as fin, open(dst, 'wb') as fout:
+                    head = fin.read(BINARY_SNIFF_SIZE)
+                    fout.write(head)
+                    if classify_member(name, size, head, binary_exts, max_size):
+                        fout.truncate(size)
+                        self.stubs.add(name)
+                    else:
+                        shutil.copyfileobj(fin, fout, DEFAULT_CHUNK_SIZE)
+                        self.staged_size += size
+                if name == 'controls/global-vars.csv' or name.endswith('/controls/global-vars.csv'):
+                    csv_dirs.append(name[:-len('controls/global-vars.csv')])
+        assert csv_dirs, f'归档 {self.path} 中未发现 controls/global-vars.csv，请确认！！！'
+        self.root = min(csv_dirs, key=len)
+        return os.path.join(self.staging, *filter(None, self.root.split('/')))
+
+    def stage_hardlink(self, name, target):
+        """暂存硬链接成员：复制链接目标已暂存的内容，目标为二进制成员时同样只保留文件头并截断为原大小"""
+        src, dst = self.staged_path(target), self.staged_path(name)
+        assert os.path.isfile(src), f'归档成员 {name} 为硬链接，链接目标 {target} 不存在，请确认！！！'
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if target not in self.stubs:
+            shutil.copyfile(src, dst)
+            self.staged_size += os.path.getsize(dst)
+            return
+        with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+            fout.write(fin.read(BINARY_SNIFF_SIZE))
+            fout.truncate(os.path.getsize(src))
+        self.stubs.add(name)
+
+    def export(self, output, scan_record: ScanRecord, variables, overrides, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        按原归档的成员顺序输出：含已定义占位符的成员按扫描位置渲染，overrides 中的成员使用已生成的文件，
+        其余成员从原归档复制；输出为目录时只输出交付物目录下的成员
+        :param output: 输出目录，或 .tar.gz/.tgz/.tar/.zip 归档路径
+        :param scan_record: 扫描记录
+        :param variables: 变量表
+        :param overrides: {相对路径: 已生成的文件}
+        :param chunk_size: 流式读取的块大小
+        :return:
+        """
+        same_format = self.format == archive_format(output) or {self.format, archive_format(output)} <= {
+            '.tar', '.tar.gz', '.tgz'}
+        with self.open() as archive, PackageWriter(output) as writer:
+            for info in iter_archive_members(archive):
+                name, kind, size, mode, mtime = archive_member_meta(info)
+                rel_path = name[len(self.root):] if name.startswith(self.root) else None
+                arcname = name if writer.format else rel_path
+                if not arcname: continue
+                assert kind != 'other' or same_format, f'归档成员 {name} 为设备文件等特殊类型，只能输出为 tar 归档！'
+                # 硬链接输出为 tar 时保留链接（目标按相同内容渲染），其他输出方式写为普通文件
+                is_file = kind == 'file' or kind == 'hardlink' and not same_format
+                src, positions = None, ()
+                if is_file and rel_path and rel_path.replace('/', os.sep) in overrides:
+                    src = overrides[rel_path.replace('/', os.sep)]
+                elif is_file and name not in self.stubs:
+                    fp = self.staged_path(name)
+                    positions = [p for p in scan_record.positions.get(fp, ()) if p[2] in variables]
+                    src = fp if positions else None
+                if src:
+                    with open(src, 'rb') as fin:
+                        blocks = iter_rendered_blocks(fin, positions, variables, chunk_size)
+                        size = rendered_size(os.path.getsize(src), positions, variables)
+                        if same_format and self.format != '.zip':
+                            tarinfo = copy.copy(info)
+                            tarinfo.size = size
+                            writer.archive.addfile(tarinfo, BlockReader(blocks))
+                        else:
+                            writer.add_file(arcname, mode, mtime, size, blocks,
+                                            info.compress_type if self.format == '.zip' else None)
+                elif same_format and self.format == '.zip':
+                    copy_zip_member(archive, writer.archive, info, info.filename, chunk_size)
+                elif same_format:
+                    writer.archive.addfile(info, archive.extractfile(info) if info.isreg() else None)
+                elif kind == 'dir':
+                    writer.add_dir(arcname, mode, mtime)
+                elif kind == 'symlink':
+                    target = archive.read(info).decode('utf-8') if self.format == '.zip' else info.linkname
+                    writer.add_symlink(arcname, target, mtime)
+                elif kind == 'file':
+                    with open_archive_member(archive, info) as fin:
+                        writer.add_file(arcname, mode, mtime, size, iter(lambda: fin.read(chunk_size), b''))
+                elif kind == 'hardlink':
+                    # 文本成员使用暂存的内容，二进制成员由 tarfile 读取链接目标的数据
+                    size, staged = os.path.getsize(self.staged_path(name)), name not in self.stubs
+                    with open(self.staged_path(name), 'rb') if staged else archive.extractfile(info) as fin:
+                        writer.add_file(arcname, mode, mtime, size, iter(lambda: fin.read(chunk_size), b''))
+
+
+def exec_batch_replace(install_dir, batch_vars, output_dir, replace_mode='字符串和控制符', old_image_prefix=None,
+                       new_image_prefix=None, jobs=1, chunk_size=DEFAULT_CHUNK_SIZE, binary_exts=BINARY_EXTENSIONS,
+                       max_size=DEFAULT_MAX_TEMPLATE_SIZE, link_mode='auto',
+                       engine='regex', sink: EventSink = None,
+                       profiler: Profiler = None) -> Tuple[bool, List[Tuple[str, int]]]:
+    """
+    多环境批量渲染：模版只扫描一次，按占位符位置为每个环境的变量表各写出一份交付物目录
+    :param install_dir: 物料路径
+    :param batch_vars: 多环境变量表路径（global-vars.csv 格式的 csv 文件或其所在目录）
+    :param output_dir: 输出目录，每个环境输出至 output_dir/环境名称
+    :param replace_mode: 字符串和控制符 or 仅控制符
+    :param old_image_prefix:
+    :param new_image_prefix:
+    :param jobs: 并行处理模版文件的进程数
+    :param chunk_size: 流式读取的块大小
+    :param binary_exts: 不做扫描的二进制文件扩展名
+    :param max_size: 模版文件大小阈值，0 表示不限制
+    :param link_mode: 未改动文件的输出方式，auto、reflink、hardlink、copy
+    :param engine: 替换引擎，regex 或 trie
+    :param sink: 日志事件输出，为空时在内存中收集，随结果返回
+    :param profiler: 分阶段计时
+    :return: (脚本执行状态，日志及级别）
+    """
+    logs, failed_envs, profiler = EventSink() if sink is None else sink, [], profiler or Profiler()
+    try:
+        install_dir, output_dir = os.path.abspath(install_dir), os.path.abspath(output_dir)
+        assert not archive_format(install_dir), '多环境批量渲染暂不支持归档交付物，请先解压！'
+        assert not (output_dir + os.sep).startswith(install_dir + os.sep), '输出目录不能位于交付物目录内，请调整！'
+        csv_paths = query_batch_var_csvs(batch_vars)
+        total_logs, _, scan_record = \
+            dispose_controls(install_dir, replace_mode, True, jobs=jobs, chunk_size=chunk_size,
+                             binary_exts=binary_exts, max_size=max_size, engine=engine, sink=logs, profiler=profiler)
+        assert not scan_record.failed, '模版文件检查失败!'
+        logs.extend(total_logs)
+        for env, csv_path in csv_paths.items():
+            logs.append([f'-----------------  渲染环境:{env}  -----------------', logging.INFO])
+            all_vars, empty_idx_set, (_, error_logs), _ = load_data_from_csv(csv_path)
+            if error_logs:
+                failed_envs.append(env)
+                logs.append([f'{csv_path} 检查失败：', logging.ERROR])
+                logs.extend([[e, logging.ERROR] for e in error_logs])
+                continue
+            env_dir = os.path.join(output_dir, env)
+            vars_map, _ = build_vars_map(env_dir, all_vars, empty_idx_set)
+            try:
+                # 按该环境的变量表校验渲染后的 k8s yaml，image 标量位置用于镜像替换
+                with profiler.stage('yaml'):
+                    image_spans = {os.path.relpath(fp, install_dir): load_rendered_yaml(
+                        fp, scan_record.positions[fp], vars_map, replace_mode, os.path.relpath(fp, install_dir))[1]
+                        for fp in scan_record.deploy_yaml_paths if fp in scan_record.positions}
+                profiler.add('yaml', files=len(image_spans))
+            except Exception as e:
+                failed_envs.append(env)
+                logs.append([f'{env} k8s yaml 检查失败：{str(e)}', logging.ERROR])
+                continue
+            var_fps_map, matched_keys, missing_keys, replace_num = dict(), set(), set(), 0
+            for fp, positions in scan_record.positions.items():
+                for _, _, key in positions:
+                    if key in vars_map:
+                        replace_num += 1
+                        matched_keys.add(key)
+                        var_fps_map.setdefault(key, set()).add(os.path.relpath(fp, install_dir))
+                    else:
+                        missing_keys.add(key)
+            with profiler.stage('render', len(scan_record.positions)):
+                render_tree(install_dir, env_dir, scan_record, vars_map, jobs, chunk_size, link_mode)
+                fix_global_csv(csv_path, var_fps_map, os.path.join(env_dir, 'controls/global-vars.csv'))
+            with profiler.stage('images'):
+                yaml_paths = replace_k8s_images(env_dir, old_image_prefix, new_image_prefix, image_spans)
+            profiler.add('images', files=len(yaml_paths))
+            unused_keys = vars_map.keys() - matched_keys
+            logs.append([f'输出至 {env_dir}，替换位置 {replace_num} 个，变量表中共计定义 {len(vars_map)} 个变量，'
+                         f'成功替换 {len(matched_keys)} 个，有 {len(unused_keys)} 个已定义未替换！'
+                         f'有 {len(missing_keys)} 个未定义未替换！', logging.INFO])
+            unused_keys and logs.append([f'以下变量已定义未替换，请确认！！！  \n{unused_keys}', logging.WARNING])
+            missing_keys and logs.append([f'以下变量未定义未替换，请确认！！！  \n{missing_keys}', logging.WARNING])
+        assert not failed_envs, f'以下环境变量表检查失败：{failed_envs}'
         return True, [*logs, ['全局变量替换工具执行成功！', logging.INFO]]
     except Exception as e:
         return False, [*logs, [str(e), logging.ERROR], ['全局变量替换工具执行失败！', logging.ERROR]]
 
 
-def set_logger():
+def set_logger(console=True, log_file='replace_vars.log'):
     # 设置日志格式
     log_format = '%(asctime)s || %(levelname)s || %(message)s'
     log_level = logging.INFO
     logger = logging.getLogger()
     logger.setLevel(log_level)
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(logging.Formatter(log_format))
-    file_handler = logging.FileHandler("replace_vars.log", encoding="utf-8")
+    file_handler = logging.FileHandler(log_file, encoding="utf-8")
     file_handler.setFormatter(logging.Formatter(log_format))
-    logger.addHandler(console_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(log_format))
+        logger.addHandler(console_handler)
     logger.addHandler(file_handler)
     return logger
 
 
+def positive_int(value):
+    """argparse 参数类型：正整数"""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f'需为正整数：{value}')
+    return number
+
+
 def get_real_app_dir():
     if getattr(sys, 'frozen', False):
         return os.path.dirname(sys.executable)
     return os.path.dirname(os.path.abspath(__file__))
 
 
-def main(install_dir, replace_mode='字符串和控制符', check=False, old_image_prefix=None, new_image_prefix=None):
-    log = set_logger()
+def main(install_dir, replace_mode='字符串和控制符', check=False, old_image_prefix=None, new_image_prefix=None,
+         jobs=1, chunk_size=DEFAULT_CHUNK_SIZE, binary_exts=BINARY_EXTENSIONS, max_size=DEFAULT_MAX_TEMPLATE_SIZE,
+         use_cache=False, batch_vars=None, batch_output=None, output=None, link_mode='auto', engine='regex',
+         index=False, where_keys=(), impact_keys=(), retain=False, rerender=False, log_format='text', progress=False,
+         profile=False, profile_top=DEFAULT_PROFILE_TOP, profile_json=None, profile_pstats=None, watch=False,
+         watch_interval=DEFAULT_WATCH_INTERVAL):
+    # jsonl 格式时标准输出只输出 JSON 事件，文本日志只写入日志文件
+    log = set_logger(console=log_format == 'text')
+    sink, status = EventSink(log, log_format, progress), False
+    profiler = Profiler(bool(profile or profile_json or profile_pstats), profile_top)
+    c_profile = None
+    if profile_pstats:
+        import cProfile
+        c_profile = cProfile.Profile()
+        c_profile.enable()
     try:
-        status, logs_with_level = exec_replace(install_dir, replace_mode, check, old_image_prefix, new_image_prefix)
-        [log.log(l[1], l[0]) for l in logs_with_level]
+        if where_keys or impact_keys:
+            status, logs_with_level = exec_query_index(install_dir, where_keys, impact_keys)
+        elif rerender:
+            status, logs_with_level = exec_rerender(install_dir, replace_mode, old_image_prefix, new_image_prefix,
+                                                    chunk_size, engine)
+        elif watch:
+            status, logs_with_level = exec_watch(install_dir, replace_mode, jobs, chunk_size, binary_exts, max_size,
+                                                 use_cache, engine, watch_interval, sink=sink)
+        elif batch_vars:
+            status, logs_with_level = exec_batch_replace(install_dir, batch_vars, batch_output, replace_mode,
+                                                         old_image_prefix, new_image_prefix, jobs, chunk_size,
+                                                         binary_exts, max_size, link_mode, engine, sink, profiler)
+        else:
+            status, logs_with_level = exec_replace(install_dir, replace_mode, check, old_image_prefix,
+                                                   new_image_prefix, jobs, chunk_size, binary_exts, max_size, use_cache,
+                                                   output, link_mode, engine, index, retain, sink, profiler)
+        sink.extend(logs_with_level)
     except Exception as e:
         log.exception(e)
+    if c_profile:
+        c_profile.disable()
+        c_profile.dump_stats(profile_pstats)
+    if profiler.enabled:
+        sink.extend(profiler.report())
+        sink.write_event('profile', **profiler.to_dict())
+        profile_json and profiler.dump(profile_json)
+    sink.close(status)
 
 
 if __name__ == '__main__':
+    if getattr(sys, 'frozen', False):
+        # 打包后的可执行文件启动进程池 worker 时需要，未打包时 freeze_support 不做任何处理
+        import multiprocessing
+        multiprocessing.freeze_support()
     parser = argparse.ArgumentParser(description='run replace script.')
-    parser.add_argument('install_dir', nargs='?', default=get_real_app_dir(), help='交付物料包路径')
+    parser.add_argument('install_dir', nargs='?', default=get_real_app_dir(),
+                        help='交付物料包路径，或 .tar.gz/.tgz/.tar/.zip 交付物归档（需同时指定 --output）')
     parser.add_argument('--check', action='store_true', help='是否检查模式')
     parser.add_argument('--replace_mode', choices=['字符串和控制符', '仅控制符'], default='字符串和控制符',
                         help='变量替换模式，(字符串和控制符 or 仅控制符)')
     parser.add_argument('--old_image_prefix', default=DEFAULT_IMAGE_PREFIX, help='待匹配的镜像前缀')
     parser.add_argument('--new_image_prefix', default=DEFAULT_IMAGE_PREFIX, help='待替换的镜像前缀')
+    parser.add_argument('--jobs', type=int, default=1, help='并行处理模版文件的进程数，默认 1 即串行处理')
+    parser.add_argument('--chunk_size', type=positive_int, default=DEFAULT_CHUNK_SIZE, help='流式读取模版文件的块大小（字节）')
+    parser.add_argument('--binary_exts', default=','.join(sorted(BINARY_EXTENSIONS)),
+                        help='不做占位符扫描的二进制/制品文件扩展名，逗号分隔')
+    parser.add_argument('--max_size', type=int, default=DEFAULT_MAX_TEMPLATE_SIZE,
+                        help='模版文件大小阈值（字节），超过则跳过扫描，0 表示不限制')
+    parser.add_argument('--cache', action='store_true',
+                        help=f'使用增量检查缓存（保存于交付物目录 {SCAN_CACHE_FILE}），未变化的文件不再重新扫描')
+    parser.add_argument('--batch_vars', nargs='+',
+                        help='多环境批量渲染，传入各环境的变量表（global-vars.csv 格式）或其所在目录，文件名即环境名称')
+    parser.add_argument('--batch_output', help='多环境批量渲染的输出目录，每个环境输出至该目录下的同名子目录')
+    parser.add_argument('--output', help='渲染输出目录或归档（.tar.gz/.tgz/.tar/.zip），不指定时原地替换')
+    parser.add_argument('--link_mode', choices=LINK_MODES, default='auto',
+                        help='输出目录时未改动文件的输出方式，auto 依次尝试 reflink、硬链接、复制')
+    parser.add_argument('--index', action='store_true',
+                        help=f'生成占位符索引（保存于交付物目录 {PLACEHOLDER_INDEX_FILE}），记录变量出现的文件、偏移及行号')
+    parser.add_argument('--where', nargs='+', default=(), metavar='KEY', help='查询占位符索引：变量出现的文件及行号')
+    parser.add_argument('--impact', nargs='+', default=(), metavar='KEY', help='查询占位符索引：变量变化时影响的文件')
+    parser.add_argument('--retain', action='store_true',
+                        help=f'原地渲染时保留原始模版、占位符索引及变量表（保存于交付物目录 {TEMPLATE_STORE_DIR}）')
+    parser.add_argument('--rerender', action='store_true',
+                        help='修改 global-vars.csv 后只重新渲染使用了变化变量的文件，需先使用 --retain 渲染，镜像前缀参数与首次渲染保持一致')
+    parser.add_argument('--watch', action='store_true',
+                        help='常驻检查模式，轮询文件变化，只重新检查变化的文件并重新输出变量汇总，Ctrl+C 退出')
+    parser.add_argument('--watch_interval', type=float, default=DEFAULT_WATCH_INTERVAL, help='--watch 轮询间隔（秒）')
+    parser.add_argument('--engine', choices=ENGINES, default='regex',
+                        help='替换引擎，trie 按已定义变量构建前缀树批量替换，适合占位符密集的大文件')
+    parser.add_argument('--log_format', choices=LOG_FORMATS, default='text',
+                        help='日志输出格式，jsonl 时每个事件（日志、单个文件结果、汇总）向标准输出写一行 JSON，文本日志只写入日志文件')
+    parser.add_argument('--progress', action='store_true', help='在标准错误实时显示已处理文件数、扫描字节数及吞吐')
+    parser.add_argument('--profile', action='store_true',
+                        help='结束时输出性能报告：各阶段耗时、CPU 时间、读写字节数、文件数及耗时最长的文件')
+    parser.add_argument('--profile_top', type=int, default=DEFAULT_PROFILE_TOP, help='性能报告中列出的最慢文件个数')
+    parser.add_argument('--profile_json', help='性能报告另存为 JSON 文件（同时启用 --profile）')
+    parser.add_argument('--profile_pstats', help='使用 cProfile 采样主进程，结果保存为 pstats 文件（同时启用 --profile）')
     args = parser.parse_args()
+    args.batch_vars and not args.batch_output and parser.error('--batch_vars 需要同时指定 --batch_output')
+    args.watch and archive_format(args.install_dir) and parser.error('--watch 只支持交付物目录')
     main(args.install_dir, replace_mode=args.replace_mode, check=args.check,
-         old_image_prefix=args.old_image_prefix, new_image_prefix=args.new_image_prefix)
+         old_image_prefix=args.old_image_prefix, new_image_prefix=args.new_image_prefix, jobs=args.jobs,
+         chunk_size=args.chunk_size, max_size=args.max_size, use_cache=args.cache, batch_vars=args.batch_vars,
+         batch_output=args.batch_output, output=args.output, link_mode=args.link_mode, engine=args.engine,
+         index=args.index, where_keys=args.where, impact_keys=args.impact, retain=args.retain, rerender=args.rerender,
+         log_format=args.log_format, progress=args.progress, profile=args.profile, profile_top=args.profile_top,
+         profile_json=args.profile_json, profile_pstats=args.profile_pstats, watch=args.watch,
+         watch_interval=args.watch_interval,
+         binary_exts={e.strip().lower() for e in args.binary_exts.split(',') if e.strip()})
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGE = 'swr.cn-north-4.myhuaweicloud.com/sl-shudi-pre_release/app:1.0'
+VARIABLES = [('NAMESPACE', '字符串', 'demo'), ('REPLICAS', '数值', '3'), ('DB_HOST', '字符串', 'db.demo.svc'),
+             ('DEBUG', '布尔', 'false')]
+TEMPLATES = {
+    'k8s-resources/app-deployment.yaml':
+        'apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: app\n  namespace: \x02NAMESPACE\x03\n'
+        'spec:\n  replicas: \\x02REPLICAS\\x03\n  template:\n    spec:\n      containers:\n      - name: app\n'
+        f'        image: {IMAGE}\n        env:\n        - name: DB_HOST\n          value: "\x02DB_HOST\x03"\n',
+    'scripts/init.sh':
+        '#!/bin/bash\nexport DB_HOST=\x02DB_HOST\x03\necho "namespace \\x02NAMESPACE\\x03"\n'
+        'kubectl -n \x02NAMESPACE\x03 get pods\n',
+    'scripts/conf/app.properties': 'db.host=\\x02DB_HOST\\x03\ndebug=\x02DEBUG\x03\nreplicas=\x02REPLICAS\x03\n',
+    'scripts/conf/readme.txt': 'no placeholders here\n',
+}
+
+
+def to_csv(rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue()
+
+
+def write_file(root, rel_path, data):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data.encode() if isinstance(data, str) else data)
+    return path
+
+
+def generate_package(root):
+    """生成最小的交付物目录：一个 Deployment、一个主机脚本及若干模版文件，变量全部已定义且均被使用"""
+    var_rows = [['序号', '变量键（KEY）', '变量描述', '变量类型', '填写示例', '文件路径', '填写说明']]
+    var_rows.extend([str(i + 1), key, 'test', var_type, value, '', '']
+                    for i, (key, var_type, value) in enumerate(VARIABLES))
+    write_file(root, 'controls/global-vars.csv', to_csv(var_rows))
+    write_file(root, 'controls/deploy-execution-plan.csv', to_csv([
+        ['步骤', '资源类型', '资源名称', '命名空间', '部署类型', 'YAML路径', '镜像包名称', '备注'],
+        ['1', 'Deployment', 'app', 'demo', '更新', 'k8s-resources/app-deployment.yaml', IMAGE, '']]))
+    write_file(root, 'controls/script-execution-plan.csv', to_csv([
+        ['步骤', '脚本路径', '是否幂等', '是否依赖', '执行机类型', '执行用户', 'K8S命名空间', '负载资源名称', '备注'],
+        ['1', 'scripts/init.sh', '是', '否', '宿主机', 'root', '', '', '']]))
+    for rel_path, content in TEMPLATES.items():
+        write_file(root, rel_path, content)
+    return root
+
+
+@pytest.fixture
+def make_package(tmp_path):
+    """按名称在临时目录下生成交付物目录"""
+    return lambda name='pkg': generate_package(str(tmp_path / name))
+
+
+@pytest.fixture
+def package(make_package):
+    return make_package()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+测试用的模拟 API Server：在内存中保存资源，支持服务端 apply、删除、重启、list 及分块传输的 watch。
+应用后的工作负载经过 progress_delay 秒变为就绪，每次请求记录到 requests 供测试检查顺序及参数
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+
+class Request(object):
+
+    def __init__(self, method, path, query, content_type, body):
+        self.method, self.path, self.query, self.content_type, self.body = method, path, query, content_type, body
+        self.collection, _, self.name = path.rpartition('/')
+        self.start, self.end = time.perf_counter(), None
+
+
+class FakeApiServer(ThreadingMixIn, HTTPServer):
+    """
+    :ivar progress_delay: 应用后变为就绪的延迟（秒）
+    :ivar stuck: 始终不就绪的资源名称
+    :ivar failing: 滚动更新失败的资源名称（Deployment 超过 progressDeadlineSeconds，Job 失败）
+    :ivar rejected: apply 时返回 422 的资源名称
+    :ivar request_delays: 资源名称 -> 写请求的处理延迟（秒）
+    :ivar list_delay: list 在取得快照后延迟返回的时间（秒），用于构造 list 与并发 apply 的竞争
+    :ivar watch_timeout: 单次 watch 的服务端超时（秒），到期后结束响应，客户端需续接
+    :ivar expire_once: 首次 watch 返回 410 的集合路径
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeApiHandler)
+        self.cond, self.resource_version = threading.Condition(), 100
+        self.objects, self.events, self.requests = dict(), [], []
+        self.progress_delay, self.stuck, self.failing, self.rejected = 0.2, set(), set(), set()
+        self.request_delays, self.list_delay, self.watch_timeout, self.expire_once = dict(), 0, 0.5, set()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        with self.cond:
+            self.cond.notify_all()
+
+    def find(self, method=None, name=None, watch=None):
+        return [r for r in self.requests if (method is None or r.method == method) and
+                (name is None or r.name == name) and (watch is None or ('watch' in r.query) == watch)]
+
+    def emit(self, collection, event_type, obj):
+        """调用方持有 cond"""
+        self.resource_version += 1
+        obj['metadata']['resourceVersion'] = str(self.resource_version)
+        self.events.append((self.resource_version, collection, event_type, json.loads(json.dumps(obj))))
+        self.cond.notify_all()
+
+    def later(self, delay, fn):
+        def run():
+            with self.cond:
+                fn()
+
+        timer = threading.Timer(delay, run)
+        timer.daemon = True
+        timer.start()
+
+    def progress(self, collection, name, generation):
+        obj = self.objects.get(collection, {}).get(name)
+        if not obj or obj['metadata']['generation'] != generation: return
+        kind, replicas, failed = obj['kind'], obj['spec'].get('replicas', 1), name in self.failing
+        if kind == 'Job':
+            condition = 'Failed' if failed else 'Complete'
+            obj['status'] = {'succeeded': int(not failed), 'conditions': [{'type': condition, 'status': 'True'}]}
+        elif failed:
+            obj['status'] = {'observedGeneration': generation, 'conditions': [
+                {'type': 'Progressing', 'reason': 'ProgressDeadlineExceeded', 'message': 'deadline exceeded'}]}
+        else:
+            obj['status'] = {'observedGeneration': generation, 'replicas': replicas, 'updatedReplicas': replicas,
+                             'availableReplicas': replicas, 'readyReplicas': replicas}
+        self.emit(collection, 'MODIFIED', obj)
+
+    def patch(self, request):
+        body = json.loads(request.body)
+        collection, name = request.collection, request.name
+        obj = self.objects.setdefault(collection, {}).get(name)
+        if obj is None:
+            obj = self.objects[collection][name] = {'apiVersion': body['apiVersion'], 'kind': body['kind'],
+                                                    'metadata': {'name': name, 'generation': 0}, 'spec': {}}
+            event_type = 'ADDED'
+        else:
+            event_type = 'MODIFIED'
+        if 'kind' in body:
+            obj['spec'] = body.get('spec') or {}
+        else:
+            # strategic-merge-patch：重启只修改 Pod 模版注解
+            template = obj['spec'].setdefault('template', {})
+            template.setdefault('metadata', {}).update(body['spec']['template']['metadata'])
+        obj['metadata']['generation'] += 1
+        generation = obj['metadata']['generation']
+        obj['status'] = {} if obj['kind'] == 'Job' else {'observedGeneration': generation - 1}
+        self.emit(collection, event_type, obj)
+        name in self.stuck or self.later(self.progress_delay, lambda: self.progress(collection, name, generation))
+        return obj
+
+    def delete(self, request):
+        obj = self.objects.get(request.collection, {}).get(request.name)
+        if obj is None: return None
+
+        def gone():
+            self.objects[request.collection].pop(request.name, None)
+            self.emit(request.collection, 'DELETED', obj)
+
+        self.later(self.progress_delay, gone)
+        return {'kind': 'Status', 'status': 'Success'}
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def begin(self):
+        url, length = urlparse(self.path), int(self.headers.get('Content-Length') or 0)
+        request = Request(self.command, url.path, parse_qs(url.query), self.headers.get('Content-Type'),
+                          self.rfile.read(length) if length else b'')
+        self.server.requests.append(request)
+        return request
+
+    def do_PATCH(self):
+        server, request = self.server, self.begin()
+        time.sleep(server.request_delays.get(request.name, 0))
+        with server.cond:
+            if request.name in server.rejected:
+                self.send_json(422, {'kind': 'Status', 'code': 422, 'message': 'invalid'})
+            else:
+                self.send_json(200, server.patch(request))
+        request.end = time.perf_counter()
+
+    def do_DELETE(self):
+        server, request = self.server, self.begin()
+        time.sleep(server.request_delays.get(request.name, 0))
+        with server.cond:
+            obj = server.delete(request)
+        self.send_json(404, {'kind': 'Status', 'code': 404}) if obj is None else self.send_json(200, obj)
+        request.end = time.perf_counter()
+
+    def do_GET(self):
+        server, request = self.server, self.begin()
+        if 'watch' not in request.query:
+            with server.cond:
+                data = {'metadata': {'resourceVersion': str(server.resource_version)},
+                        'items': json.loads(json.dumps(list(server.objects.get(request.path, {}).values())))}
+            time.sleep(server.list_delay)
+            return self.send_json(200, data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            self.watch(request)
+            self.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            # 客户端关闭 watch
+            pass
+
+    def watch(self, request):
+        server = self.server
+
+        def send_event(event):
+            line = json.dumps(event).encode() + b'\n'
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+            self.wfile.flush()
+
+        if request.path in server.expire_once:
+            server.expire_once.discard(request.path)
+            return send_event({'type': 'ERROR', 'object': {'kind': 'Status', 'code': 410, 'message': 'too old'}})
+        since = int(request.query.get('resourceVersion', ['0'])[0])
+        deadline = time.perf_counter() + server.watch_timeout
+        with server.cond:
+            while time.perf_counter() < deadline:
+                for version, collection, event_type, obj in server.events:
+                    if version > since and collection == request.path:
+                        send_event({'type': event_type, 'object': obj})
+                        since = version
+                server.cond.wait(max(0.0, min(0.05, deadline - time.perf_counter())))
+
+    def log_message(self, *args):
+        pass
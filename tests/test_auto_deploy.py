@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+import getpass
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import auto_deploy
+from bench_replace_vars import to_csv, write_file
+from fake_apiserver import FakeApiServer
+
+DEPLOY_COLUMNS = ['步骤', '资源类型', '资源名称', '命名空间', '部署类型', 'YAML路径', '镜像包名称', '备注']
+API_VERSIONS = {'Namespace': 'v1', 'ConfigMap': 'v1', 'Deployment': 'apps/v1', 'Job': 'batch/v1'}
+DEPLOYMENTS_PATH = '/apis/apps/v1/namespaces/demo/deployments'
+SCRIPT_COLUMNS = ['步骤', '脚本路径', '是否幂等', '是否依赖', '执行机类型', '执行用户', 'K8S命名空间', '负载资源名称', '备注']
+
+
+def deploy_package(root, rows):
+    """
+    生成只有 k8s 编排计划的交付物目录
+    :param rows: [(资源类型, 资源名称, 部署类型)]，更新 行生成对应的 yaml
+    """
+    plan = [DEPLOY_COLUMNS]
+    for i, (kind, name, deploy_type) in enumerate(rows):
+        rel_path = f'k8s-resources/{name}-{kind.lower()}.yaml'
+        doc = {'apiVersion': API_VERSIONS[kind], 'kind': kind, 'metadata': {'name': name}}
+        if kind != 'Namespace':
+            doc['metadata']['namespace'] = 'demo'
+        if kind in ('Deployment', 'Job'):
+            doc['spec'] = {'template': {'spec': {'containers': [{'name': name, 'image': 'registry/app:1.0'}]}}}
+        # JSON 是合法的 YAML
+        write_file(root, rel_path, json.dumps(doc))
+        image = 'registry/app:1.0' if kind in ('Deployment', 'Job') else ''
+        plan.append([str(i + 1), kind, name, 'demo', deploy_type, rel_path, image, ''])
+    write_file(root, 'controls/deploy-execution-plan.csv', to_csv(plan))
+    return root
+
+
+@pytest.fixture
+def apiserver():
+    pytest.importorskip('kubernetes')
+    server = FakeApiServer().start()
+    yield server
+    server.stop()
+
+
+def deploy(install_dir, server, **kwargs):
+    api_client = auto_deploy.create_api_client(host=server.url)
+    try:
+        return auto_deploy.exec_deploy(install_dir, api_client, **kwargs)
+    finally:
+        api_client.close()
+
+
+def messages(logs):
+    return [message for message, _ in logs]
+
+
+def test_batches_wait_for_the_previous_batch(apiserver, tmp_path):
+    package = deploy_package(str(tmp_path), [('Namespace', 'demo', '更新'), ('ConfigMap', 'conf', '更新'),
+                                             ('Deployment', 'a', '更新'), ('Deployment', 'b', '更新')])
+    apiserver.request_delays = {'conf': 0.2, 'a': 0.2, 'b': 0.2}
+    status, logs = deploy(package, apiserver)
+    assert status, logs
+    (namespace,), (conf,), (a,), (b,) = [apiserver.find('PATCH', name) for name in ('demo', 'conf', 'a', 'b')]
+    assert namespace.end < conf.start and conf.end < min(a.start, b.start)
+    # 同一批次并发执行
+    assert max(a.start, b.start) < min(a.end, b.end)
+
+
+def test_failed_batch_stops_later_batches(apiserver, tmp_path):
+    package = deploy_package(str(tmp_path), [('ConfigMap', 'bad', '更新'), ('ConfigMap', 'good', '更新'),
+                                             ('Deployment', 'a', '更新')])
+    apiserver.rejected = {'bad'}
+    status, logs = deploy(package, apiserver)
+    assert not status
+    assert apiserver.find('PATCH', 'good') and not apiserver.find('PATCH', 'a')
+    assert '步骤 3 Deployment/a 更新：前序批次失败，未执行' in messages(logs)
+
+
+def test_apply_delete_and_restart_requests(apiserver, tmp_path):
+    package = deploy_package(str(tmp_path), [('ConfigMap', 'missing', '下线'), ('Deployment', 'a', '更新'),
+                                             ('Deployment', 'a', '重启')])
+    status, logs = deploy(package, apiserver)
+    assert status, logs
+    (delete,) = apiserver.find('DELETE', 'missing')
+    assert delete.query == {'propagationPolicy': ['Background']}
+    assert '步骤 1 ConfigMap/missing 下线：资源不存在，已跳过' in messages(logs)
+    apply, restart = apiserver.find('PATCH', 'a')
+    assert apply.content_type == 'application/apply-patch+yaml'
+    assert apply.query == {'fieldManager': [auto_deploy.DEFAULT_FIELD_MANAGER], 'force': ['true']}
+    assert json.loads(apply.body)['spec']['template']['spec']['containers'][0]['image'] == 'registry/app:1.0'
+    # 同一资源先更新后重启，拆到后续批次
+    assert restart.content_type == 'application/strategic-merge-patch+json' and apply.end < restart.start
+    annotations = json.loads(restart.body)['spec']['template']['metadata']['annotations']
+    assert auto_deploy.RESTARTED_AT_ANNOTATION in annotations
+
+
+def test_wait_resumes_watch_after_server_closes_stream(apiserver, tmp_path):
+    package = deploy_package(str(tmp_path), [('Deployment', 'a', '更新')])
+    apiserver.watch_timeout, apiserver.progress_delay = 0.3, 1.0
+    status, logs = deploy(package, apiserver, wait=True, ready_timeout=10)
+    assert status, logs
+    assert len(apiserver.find('GET', watch=False)) == 1
+    watches = apiserver.find('GET', watch=True)
+    assert len(watches) >= 2 and all('resourceVersion' in w.query for w in watches)
+
+
+def test_wait_relists_after_resource_version_expired(apiserver, tmp_path):
+    package = deploy_package(str(tmp_path), [('Deployment', 'a', '更新')])
+    apiserver.expire_once, apiserver.progress_delay = {DEPLOYMENTS_PATH}, 0.5
+    status, logs = deploy(package, apiserver, wait=True, ready_timeout=10)
+    assert status, logs
+    assert len(apiserver.find('GET', watch=False)) == 2
+
+
+def test_wait_reports_ready_failed_and_timed_out_workloads(apiserver, tmp_path):
+    package = deploy_package(str(tmp_path), [('Deployment', 'ok', '更新'), ('Deployment', 'broken', '更新'),
+                                             ('Deployment', 'stuck', '更新'), ('Job', 'migrate', '更新')])
+    apiserver.failing, apiserver.stuck = {'broken', 'migrate'}, {'stuck'}
+    status, logs = deploy(package, apiserver, wait=True, ready_timeout=1)
+    assert not status
+    lines = '\n'.join(messages(logs))
+    assert '步骤 1 Deployment/ok 就绪' in lines and '步骤 2 Deployment/broken 失败' in lines
+    assert '步骤 3 Deployment/stuck 超时' in lines and '步骤 4 Job/migrate 失败' in lines
+
+
+def test_wait_keeps_update_waiters_missing_from_list_snapshot(apiserver, tmp_path):
+    # b 在 deployments 的 list 取得快照之后才应用，快照中没有 b 不代表已被删除
+    package = deploy_package(str(tmp_path), [('Deployment', 'a', '更新'), ('Deployment', 'b', '更新')])
+    apiserver.request_delays, apiserver.list_delay = {'b': 0.2}, 0.5
+    status, logs = deploy(package, apiserver, wait=True, ready_timeout=10)
+    assert status, logs
+    (listing,) = apiserver.find('GET', watch=False)
+    (apply,) = apiserver.find('PATCH', 'b')
+    assert listing.start < apply.end < listing.start + apiserver.list_delay
+
+
+@pytest.mark.parametrize('kind, obj, state', [
+    ('deployment', {'metadata': {'generation': 2}, 'spec': {'replicas': 2},
+                    'status': {'observedGeneration': 1, 'updatedReplicas': 2, 'availableReplicas': 2}}, None),
+    ('deployment', {'metadata': {'generation': 2}, 'spec': {'replicas': 2},
+                    'status': {'observedGeneration': 2, 'replicas': 3, 'updatedReplicas': 2, 'availableReplicas': 2}},
+     None),
+    ('deployment', {'metadata': {'generation': 2}, 'spec': {'replicas': 2},
+                    'status': {'observedGeneration': 2, 'replicas': 2, 'updatedReplicas': 2, 'availableReplicas': 2}},
+     'ready'),
+    ('deployment', {'metadata': {'generation': 1}, 'status': {'observedGeneration': 1, 'conditions': [
+        {'type': 'Progressing', 'reason': 'ProgressDeadlineExceeded'}]}}, 'failed'),
+    ('statefulset', {'spec': {'replicas': 3, 'updateStrategy': {'rollingUpdate': {'partition': 2}}},
+                     'status': {'readyReplicas': 3, 'updatedReplicas': 1}}, 'ready'),
+    ('statefulset', {'spec': {'replicas': 2}, 'status': {'readyReplicas': 2, 'updatedReplicas': 1,
+                                                         'currentRevision': 'a', 'updateRevision': 'b'}}, None),
+    ('daemonset', {'status': {'desiredNumberScheduled': 2, 'updatedNumberScheduled': 2, 'numberAvailable': 1}},
+     None),
+    ('daemonset', {'spec': {'updateStrategy': {'type': 'OnDelete'}}, 'status': {'desiredNumberScheduled': 2}},
+     'ready'),
+    ('job', {'status': {'succeeded': 0}}, None),
+    ('job', {'status': {'conditions': [{'type': 'Complete', 'status': 'True'}]}}, 'ready'),
+    ('job', {'status': {'conditions': [{'type': 'Failed', 'status': 'True', 'message': 'BackoffLimitExceeded'}]}},
+     'failed'),
+])
+def test_check_rollout(kind, obj, state):
+    assert auto_deploy.check_rollout(kind, obj)[0] == state
+
+
+class RecordingExecutor(auto_deploy.HostExecutor):
+    """在本机执行脚本并记录每次执行的 (步骤, 开始时间, 结束时间, 退出码)"""
+
+    def __init__(self):
+        self.runs, self.lock = [], threading.Lock()
+
+    def run(self, step, script_rel_path, on_line, timeout=None):
+        start = time.perf_counter()
+        return_code = super().run(step, script_rel_path, on_line, timeout)
+        with self.lock:
+            self.runs.append((step.step, start, time.perf_counter(), return_code))
+        return return_code
+
+    def spans(self, step):
+        return [(start, end) for s, start, end, _ in self.runs if s == step]
+
+
+class LocalContainerExecutor(RecordingExecutor):
+    """容器执行器的替身，由 --container_executor 模块:类名 加载，按 kubectl exec 的方式由标准输入传入脚本"""
+
+    def run(self, step, script_rel_path, on_line, timeout=None):
+        assert step.namespace and step.workload
+        start, script_path = time.perf_counter(), os.path.join(step.install_dir, script_rel_path)
+        return_code = auto_deploy.run_process(['bash', '-s'], on_line, step.install_dir, script_path, timeout)
+        with self.lock:
+            self.runs.append((step.step, start, time.perf_counter(), return_code))
+        return return_code
+
+
+def script_package(root, rows):
+    """
+    生成只有脚本编排计划的交付物目录
+    :param rows: [(脚本内容, 是否幂等, 是否依赖, 执行机类型)]
+    """
+    plan = [SCRIPT_COLUMNS]
+    for i, (content, idempotent, depends, env_type) in enumerate(rows):
+        rel_path = f'scripts/step-{i + 1}.sh'
+        write_file(root, rel_path, content + '\n')
+        workload = ('demo', 'statefulset/app') if env_type == '容器' else ('', '')
+        plan.append([str(i + 1), rel_path, idempotent, depends, env_type, getpass.getuser(), *workload, ''])
+    write_file(root, 'controls/script-execution-plan.csv', to_csv(plan))
+    return root
+
+
+def run_scripts(install_dir, **kwargs):
+    host = RecordingExecutor()
+    container = auto_deploy.load_container_executor(f'{__name__}:LocalContainerExecutor')
+    status, logs = auto_deploy.exec_scripts(install_dir, host_executor=host, container_executor=container, **kwargs)
+    return status, logs, host, container
+
+
+def overlaps(a, b):
+    return a[0] < b[1] and b[0] < a[1]
+
+
+def test_scripts_follow_dependencies_with_separate_pools(tmp_path):
+    package = script_package(str(tmp_path), [('sleep 0.3', '否', '否', '宿主机'), ('sleep 0.3', '否', '否', '宿主机'),
+                                             ('sleep 0.3', '否', '否', '容器'), ('sleep 0.3', '否', '否', '容器'),
+                                             ('true', '否', '是', '宿主机')])
+    status, logs, host, container = run_scripts(package, host_concurrency=1, container_concurrency=1)
+    assert status, logs
+    assert isinstance(container, LocalContainerExecutor)
+    (h1,), (h2,), (c3,), (c4,), (last,) = [(host if i in '125' else container).spans(i) for i in '12345']
+    # 每个线程池的并发数为 1，宿主机与容器的步骤互不占用对方的线程池
+    assert not overlaps(h1, h2) and not overlaps(c3, c4)
+    assert overlaps(h1, c3) or overlaps(h1, c4)
+    assert last[0] >= max(h1[1], h2[1], c3[1], c4[1])
+
+
+def test_scripts_retry_only_idempotent_steps(tmp_path, monkeypatch):
+    monkeypatch.setattr(auto_deploy, 'SCRIPT_RETRY_INTERVAL', 0)
+    package = script_package(str(tmp_path), [('exit 1', '是', '否', '宿主机'), ('exit 1', '否', '否', '容器'),
+                                             ('true', '是', '是', '宿主机')])
+    status, logs, host, container = run_scripts(package, retries=2)
+    assert not status
+    assert len(host.spans('1')) == 3 and len(container.spans('2')) == 1
+    assert not host.spans('3') and '步骤 3（宿主机）：前序步骤未成功，未执行' in messages(logs)
+
+
+def test_script_timeout_kills_the_process_group(tmp_path):
+    pid_path = tmp_path / 'child.pid'
+    package = script_package(str(tmp_path / 'pkg'), [(f'sleep 30 & echo $! > {pid_path}; wait', '否', '否', '宿主机')])
+    start = time.perf_counter()
+    status, logs, host, _ = run_scripts(package, timeout=0.5)
+    assert not status and time.perf_counter() - start < 10
+    assert host.runs[0][3] is None and any('执行超时' in message for message in messages(logs))
+    # 脚本启动的子进程一并终止
+    pid, deadline = int(pid_path.read_text()), time.perf_counter() + 5
+    while os.path.exists(f'/proc/{pid}') and time.perf_counter() < deadline:
+        with open(f'/proc/{pid}/stat') as f:
+            if f.read().rsplit(')', 1)[1].split()[0] == 'Z': break
+        time.sleep(0.05)
+    else:
+        assert not os.path.exists(f'/proc/{pid}')
+
+
+def test_script_plan_rejects_server_dry_run(tmp_path):
+    package = script_package(str(tmp_path), [('true', '否', '否', '宿主机')])
+    status, logs, host, _ = run_scripts(package, dry_run='server')
+    assert not status and not host.runs
+    assert '不支持服务端试运行' in messages(logs)[-2]
+
+
+def test_kubectl_executor_command(tmp_path):
+    package = script_package(str(tmp_path), [('true', '否', '否', '容器')])
+    step = auto_deploy.load_script_plan(package)[0]
+    step.user = 'app'
+    command = auto_deploy.KubectlExecutor(kubeconfig='/etc/kubeconfig').command(step, 'scripts/step-1.sh')
+    assert command == ['kubectl', '--kubeconfig', '/etc/kubeconfig', 'exec', '-i', '-n', 'demo', 'statefulset/app',
+                       '--', 'su', 'app', '-s', '/bin/sh', '-c', 'bash -s']
@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import json
+import logging
+import os
+import re
+import tarfile
+import tempfile
+import zipfile
+
+import pytest
+
+import replace_vars
+
+PLACEHOLDER = re.compile(rb'\x02(\w+)\x03|\\x02(\w+)\\x03')
+
+
+def write_file(root, rel_path, data):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data.encode() if isinstance(data, str) else data)
+
+
+def read(fp):
+    with open(fp, 'rb') as f:
+        return f.read()
+
+
+def iter_files(root):
+    for subdir, _, filenames in os.walk(root):
+        for filename in filenames:
+            yield os.path.join(subdir, filename)
+
+
+def snapshot(root):
+    """交付物目录下全部模版文件的 {相对路径: 内容}"""
+    return {os.path.relpath(fp, root): read(fp) for top in ('k8s-resources', 'scripts')
+            for fp in iter_files(os.path.join(root, top))}
+
+
+def load_variables(root):
+    rows = replace_vars.read_controls_csv(os.path.join(root, 'controls/global-vars.csv'))
+    return {row[1]: row[4] for row in rows[1:]}
+
+
+def write_csv(csv_path, rows):
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(rows)
+
+
+def write_variables(root, csv_path, values):
+    """以交付物的 global-vars.csv 为模版写出变量表，values 中的变量使用新值"""
+    rows = replace_vars.read_controls_csv(os.path.join(root, 'controls/global-vars.csv'))
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows([rows[0], *[[*row[:4], values.get(row[1], row[4]), *row[5:]] for row in rows[1:]]])
+
+
+def render_expected(content, variables):
+    return PLACEHOLDER.sub(lambda m: variables[(m.group(1) or m.group(2)).decode()].encode(), content)
+
+
+def test_render_splices_values_at_scanned_positions(package):
+    templates, variables = snapshot(package), load_variables(package)
+    status, logs = replace_vars.exec_replace(package)
+    assert status, logs
+    assert snapshot(package) == {rel_path: render_expected(content, variables)
+                                 for rel_path, content in templates.items()}
+
+
+def test_scan_records_placeholder_positions(package):
+    fp, positions = os.path.join(package, 'scripts/init.sh'), []
+    replace_vars.stream_replace(fp, dict(), positions=positions)
+    expected = [(m.start(), m.end(), (m.group(1) or m.group(2)).decode()) for m in PLACEHOLDER.finditer(read(fp))]
+    assert positions == expected
+
+
+def test_jobs_render_the_same_as_serial(make_package):
+    serial, parallel = make_package('serial'), make_package('parallel')
+    serial_status, serial_logs = replace_vars.exec_replace(serial, jobs=1)
+    parallel_status, parallel_logs = replace_vars.exec_replace(parallel, jobs=3)
+    assert serial_status and parallel_status, parallel_logs
+    assert snapshot(serial) == snapshot(parallel)
+    assert sorted(message for message, _ in serial_logs) == sorted(message for message, _ in parallel_logs)
+
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_mmap_and_buffered_scans_render_the_same(package, monkeypatch, use_mmap):
+    mapped, mmap_file = [], replace_vars.mmap_file
+    monkeypatch.setattr(replace_vars, 'mmap_file', lambda fin: mapped.append(fin.name) or mmap_file(fin))
+    variables = load_variables(package)
+    for rel_path, content in snapshot(package).items():
+        fp, positions = os.path.join(package, rel_path), []
+        replace_num, _, _ = replace_vars.stream_replace(fp, variables, check=False, chunk_size=16,
+                                                        positions=positions, use_mmap=use_mmap)
+        assert read(fp) == render_expected(content, variables) and replace_num == len(positions)
+    assert len(mapped) == (len(snapshot(package)) if use_mmap else 0)
+
+
+def test_files_without_replacements_are_not_rewritten(package):
+    fp = os.path.join(package, 'scripts/conf/readme.txt')
+    os.utime(fp, ns=(10 ** 18, 10 ** 18))
+    assert replace_vars.stream_replace(fp, load_variables(package), check=False)[0] == 0
+    assert os.stat(fp).st_mtime_ns == 10 ** 18
+
+
+def test_ignored_and_binary_files_are_not_scanned(package):
+    skipped = {'scripts/vendor/lib.sh': b'echo \x02UNDEFINED\x03\n', 'scripts/notes.tpl': b'\x02UNDEFINED\x03\n',
+               'scripts/artifacts/blob.dat': b'\x1f\x8b\x08\x00\x02UNDEFINED\x03',
+               'scripts/artifacts/app.jar': b'\x02UNDEFINED\x03'}
+    for rel_path, content in skipped.items():
+        write_file(package, rel_path, content)
+    write_file(package, '.replaceignore', '# vendored scripts\nscripts/vendor/\n*.tpl\n')
+    status, logs = replace_vars.exec_replace(package)
+    assert status, logs
+    assert {rel_path: read(os.path.join(package, rel_path)) for rel_path in skipped} == skipped
+    assert not any('UNDEFINED' in message for message, _ in logs)
+    assert '跳过 4 个二进制或制品文件' in '\n'.join(message for message, _ in logs)
+
+
+def test_batch_renders_each_environment_from_one_scan(package, tmp_path):
+    templates = snapshot(package)
+    envs = {'prod': {'NAMESPACE': 'prod', 'DB_HOST': 'db.prod.svc'}, 'test': {'NAMESPACE': 'test', 'REPLICAS': '1'}}
+    (tmp_path / 'envs').mkdir()
+    for env, values in envs.items():
+        write_variables(package, str(tmp_path / 'envs' / f'{env}.csv'), values)
+    status, logs = replace_vars.exec_batch_replace(package, [str(tmp_path / 'envs')], str(tmp_path / 'out'))
+    assert status, logs
+    assert snapshot(package) == templates
+    for env, values in envs.items():
+        variables = {**load_variables(package), **values}
+        assert snapshot(str(tmp_path / 'out' / env)) == {
+            rel_path: render_expected(content, variables) for rel_path, content in templates.items()}
+        env_rows = replace_vars.read_controls_csv(str(tmp_path / 'out' / env / 'controls/global-vars.csv'))
+        assert {row[1]: row[5] for row in env_rows[1:]}['DEBUG'] == 'scripts/conf/app.properties'
+
+
+def test_check_mode_writes_nothing(package, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path / 'tmp'))
+    (tmp_path / 'tmp').mkdir()
+    before = {fp: (os.stat(fp).st_mtime_ns, read(fp)) for fp in iter_files(package)}
+    status, logs = replace_vars.exec_replace(package, check=True)
+    assert status, logs
+    assert {fp: (os.stat(fp).st_mtime_ns, read(fp)) for fp in iter_files(package)} == before
+    assert not os.listdir(str(tmp_path / 'tmp'))
+
+
+def test_rendered_yaml_is_parsed_once_and_reused_for_images(package, monkeypatch):
+    parsed, load_k8s_yaml = [], replace_vars.load_k8s_yaml
+    monkeypatch.setattr(replace_vars, 'load_k8s_yaml',
+                        lambda content, yaml_name: parsed.append(yaml_name) or load_k8s_yaml(content, yaml_name))
+    status, logs = replace_vars.exec_replace(package, old_image_prefix=replace_vars.DEFAULT_IMAGE_PREFIX,
+                                             new_image_prefix='registry.local/demo')
+    assert status, logs
+    assert parsed == ['k8s-resources/app-deployment.yaml']
+    content = read(os.path.join(package, 'k8s-resources/app-deployment.yaml'))
+    assert b'image: registry.local/demo/app:1.0' in content and b'namespace: demo' in content
+
+
+def test_check_reports_invalid_rendered_yaml(package):
+    fp = os.path.join(package, 'k8s-resources/app-deployment.yaml')
+    write_file(package, fp, read(fp) + b'---\nkind: ConfigMap\nmetadata: {name: \x02NAMESPACE\x03\n')
+    status, logs = replace_vars.exec_replace(package, check=True)
+    assert not status
+    assert 'k8s-resources/app-deployment.yaml 第 2 个文档第 19 行 YAML 格式有误' in '\n'.join(m for m, _ in logs)
+
+
+@pytest.mark.parametrize('key, value, row', [('REPLICAS', '-1.5e3', None), ('DEBUG', 'TRUE', None),
+                                             ('REPLICAS', 'three', 2), ('DEBUG', 'yes', 4)])
+def test_typed_values_are_validated(package, key, value, row):
+    write_variables(package, os.path.join(package, 'controls/global-vars.csv'), {key: value})
+    status, logs = replace_vars.exec_replace(package, check=True)
+    message = f'第 {row} 行 5 列，【填写示例】 {value} 与变量类型不符'
+    if row is None:
+        assert status, logs
+        assert '与变量类型不符' not in '\n'.join(m for m, _ in logs)
+    else:
+        assert not status
+        assert message in '\n'.join(m for m, _ in logs)
+
+
+def test_index_answers_where_and_impact_without_rescanning(package, monkeypatch):
+    status, logs = replace_vars.exec_replace(package, check=True, index=True)
+    assert status, logs
+    expected = dict()
+    for fp in iter_files(package):
+        content = read(fp)
+        for m in PLACEHOLDER.finditer(content):
+            rel_path = os.path.relpath(fp, package)
+            expected.setdefault((m.group(1) or m.group(2)).decode(), dict()).setdefault(rel_path, []).append(
+                [m.start(), content.count(b'\n', 0, m.start()) + 1])
+
+    def rescan(*args, **kwargs):
+        raise AssertionError('查询索引时不应重新扫描模版')
+
+    monkeypatch.setattr(replace_vars, 'stream_replace', rescan)
+    monkeypatch.setattr(replace_vars, 'query_position_lines', rescan)
+    placeholder_index = replace_vars.PlaceholderIndex(package).load()
+    for key in expected:
+        assert placeholder_index.where(key) == expected[key]
+        assert placeholder_index.impact(key) == sorted(expected[key])
+    assert placeholder_index.where('NAMESPACE')['scripts/init.sh'] == [[53, 3], [83, 4]]
+    assert placeholder_index.impact('DEBUG') == ['scripts/conf/app.properties']
+    status, logs = replace_vars.exec_query_index(package, where_keys=['DB_HOST'], impact_keys=['REPLICAS'])
+    assert status, logs
+    assert [m for m, _ in logs] == [
+        '-----------------  变量 DB_HOST 共出现 3 处，3 个文件  -----------------',
+        'k8s-resources/app-deployment.yaml：1 处，行 15', 'scripts/conf/app.properties：1 处，行 1',
+        'scripts/init.sh：1 处，行 2',
+        '-----------------  变量 REPLICAS 变化时影响 2 个文件  -----------------',
+        'k8s-resources/app-deployment.yaml', 'scripts/conf/app.properties']
+
+
+def test_rerender_only_touches_files_using_changed_variables(package):
+    templates = snapshot(package)
+    status, logs = replace_vars.exec_replace(package, retain=True)
+    assert status, logs
+    mtimes = {rel_path: os.stat(os.path.join(package, rel_path)).st_mtime_ns for rel_path in templates}
+    write_variables(package, os.path.join(package, 'controls/global-vars.csv'), {'DEBUG': 'true'})
+    status, logs = replace_vars.exec_rerender(package)
+    assert status, logs
+    assert '重新渲染 scripts/conf/app.properties，替换位置 3 个' in [m for m, _ in logs]
+    assert [rel_path for rel_path, mtime in mtimes.items()
+            if os.stat(os.path.join(package, rel_path)).st_mtime_ns != mtime] == ['scripts/conf/app.properties']
+    variables = load_variables(package)
+    assert snapshot(package) == {rel_path: render_expected(content, variables)
+                                 for rel_path, content in templates.items()}
+
+
+def test_control_csv_errors_are_reported_by_row_and_column(package):
+    deploy_csv_path = os.path.join(package, 'controls/deploy-execution-plan.csv')
+    write_csv(deploy_csv_path, [*replace_vars.read_controls_csv(deploy_csv_path),
+                                ['2', 'Widget', 'app', 'demo', '重启', 'k8s-resources/missing.yaml', '', '']])
+    script_csv_path = os.path.join(package, 'controls/script-execution-plan.csv')
+    header, row = replace_vars.read_controls_csv(script_csv_path)
+    write_csv(script_csv_path, [header, [*row[:2], '也许', *row[3:]]])
+    status, logs = replace_vars.exec_replace(package, check=True)
+    assert not status
+    messages = [m for m, _ in logs]
+    # 支持的资源类型列表含有花括号，原样输出
+    assert messages[1].startswith('第 2 行 2 列，【资源类型】 Widget 不在支持资源类型范围内，请调整！支持的资源类型为 {')
+    assert messages[:1] + messages[2:] == [
+        'deploy-execution-plan.csv 检查失败：',
+        '第 2 行 6 列，【YAML路径】 k8s-resources/missing.yaml 相对路径不存在，请调整！',
+        '第 2 行 6 列，【YAML路径】 k8s-resources/missing.yaml 不符合 YAML 命名规范，请调整后缀！',
+        'script-execution-plan.csv 检查失败：',
+        '第 1 行 3 列，【是否幂等】 也许 请填写是或否，如需补充说明请写至备注中。',
+        '中控类文件检查失败!', '全局变量替换工具执行失败！']
+
+
+def test_jsonl_sink_emits_one_event_per_file_and_a_summary(package):
+    stream = io.StringIO()
+    sink = replace_vars.EventSink(logging.getLogger('test_replace_vars'), 'jsonl', stream=stream)
+    status, logs = replace_vars.exec_replace(package, check=True, sink=sink)
+    assert status
+    sink.extend(logs)
+    sink.close(status)
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    files = {e['path']: e for e in events if e['event'] == 'file'}
+    replace_nums = {'k8s-resources/app-deployment.yaml': 3, 'scripts/init.sh': 3, 'scripts/conf/app.properties': 3,
+                    'scripts/conf/readme.txt': 0, 'controls/deploy-execution-plan.csv': 0,
+                    'controls/script-execution-plan.csv': 0}
+    assert {path: e['replace_num'] for path, e in files.items()} == replace_nums
+    assert files['scripts/init.sh']['logs'] == [{'level': 'INFO', 'message': '成功，替换位置 3 个'}]
+    assert all(e['status'] and e['bytes'] == os.path.getsize(os.path.join(package, path)) for path, e in files.items())
+    summary = events[-1]
+    assert summary['event'] == 'summary' and summary['status']
+    assert (summary['files'], summary['ok'], summary['failed'], summary['replace_num']) == (6, 6, 0, 9)
+    assert summary['bytes'] == sum(e['bytes'] for e in files.values())
+    assert {e['message'] for e in events if e['event'] == 'log'} >= {'全局变量替换工具执行成功！'}
+
+
+def test_profiler_reports_stages_and_slowest_files(package, tmp_path):
+    scanned_size = sum(os.path.getsize(fp) for fp in iter_files(package)
+                       if os.path.relpath(fp, package) != 'controls/global-vars.csv')
+    profiler = replace_vars.Profiler(True, top=2)
+    status, logs = replace_vars.exec_replace(package, profiler=profiler)
+    assert status, logs
+    profile = profiler.to_dict()
+    stages = profile['stages']
+    assert {'check_standard', 'walk', 'var_table', 'scan', 'yaml', 'render'} <= set(stages)
+    assert stages['check_standard']['files'] == 2 and stages['var_table']['files'] == 1
+    assert stages['scan']['files'] == 6
+    assert stages['scan']['read'] == scanned_size
+    assert stages['yaml']['files'] == 1 and stages['render']['files'] == 3
+    assert len(profile['slowest_files']) == 2
+    messages = [m for m, _ in profiler.report()]
+    assert messages[0] == '-----------------  性能报告  -----------------'
+    assert any(m.startswith('阶段 scan：') and '文件 6 个' in m for m in messages)
+    assert messages[-3] == '耗时最长的 2 个文件：'
+    profiler.dump(str(tmp_path / 'profile.json'))
+    with open(str(tmp_path / 'profile.json'), encoding='utf-8') as f:
+        assert json.load(f)['stages'].keys() == stages.keys()
+
+
+def test_watch_rescans_only_the_changed_template(package, monkeypatch):
+    scanned, stream_replace = [], replace_vars.stream_replace
+    monkeypatch.setattr(replace_vars, 'stream_replace', lambda fp, *args, **kwargs: scanned.append(
+        os.path.relpath(fp, package)) or stream_replace(fp, *args, **kwargs))
+    fp, rounds = os.path.join(package, 'scripts/init.sh'), []
+
+    def change_template(interval):
+        # 第一轮检查后修改一个模版，第二轮只重新扫描该文件
+        rounds.append(list(scanned))
+        scanned.clear()
+        write_file(package, fp, read(fp) + b'echo \x02DEBUG\x03\n')
+
+    monkeypatch.setattr(replace_vars.time, 'sleep', change_template)
+    status, logs = replace_vars.exec_watch(package, interval=0, rounds=2)
+    assert status, logs
+    (first,) = rounds
+    assert sorted(first) == sorted(os.path.relpath(fp, package) for fp in iter_files(package)
+                                   if not fp.endswith('global-vars.csv'))
+    assert scanned == ['scripts/init.sh']
+    messages = [m for m, _ in logs]
+    second = messages[messages.index("检测到 1 个文件变化：['scripts/init.sh']"):]
+    assert [m for m in second if m.startswith('-----------------  检查文件')] == \
+        ['-----------------  检查文件:scripts/init.sh  -----------------']
+    assert '成功，替换位置 4 个' in second and second[-1].startswith('第 2 轮检查通过')
+
+
+@pytest.mark.parametrize('output_name', ['out', 'out.tar.gz'])
+def test_output_renders_files_served_from_cache(package, tmp_path, output_name):
+    templates, variables = snapshot(package), load_variables(package)
+    status, logs = replace_vars.exec_replace(package, check=True, use_cache=True)
+    assert status, logs
+    output = str(tmp_path / output_name)
+    status, logs = replace_vars.exec_replace(package, output=output, use_cache=True)
+    assert status, logs
+    if output_name.endswith('.tar.gz'):
+        with tarfile.open(output) as archive:
+            archive.extractall(str(tmp_path / 'extracted'))
+        output = str(tmp_path / 'extracted' / 'pkg')
+    assert snapshot(output) == {rel_path: render_expected(content, variables)
+                                for rel_path, content in templates.items()}
+
+
+def test_update_image_in_crlf_yaml(tmp_path):
+    yaml_path = str(tmp_path / 'app.yaml')
+    content = ('apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: app-0\nspec:\n  template:\n    spec:\n'
+               '      initContainers:\n      - name: init\n        image: "busybox:1.36"\n'
+               '      containers:\n      - name: app-0\n        image: old.example.com/app-0:1.0.0\n')
+    with open(yaml_path, 'wb') as f:
+        f.write(content.replace('\n', '\r\n').encode())
+    image_rows = [('Deployment', 'app-0', 'new.example.com/app-0:1.0.0')]
+    assert replace_vars.update_image_in_yaml(yaml_path, image_rows) == 2
+    with open(yaml_path, 'rb') as f:
+        updated = f.read().decode()
+    assert updated == content.replace('"busybox:1.36"', '"new.example.com/app-0:1.0.0"').replace(
+        'old.example.com/app-0:1.0.0', 'new.example.com/app-0:1.0.0').replace('\n', '\r\n')
+
+
+def test_cache_hashes_templates_in_the_scan_pass(package, monkeypatch):
+    def fail_file_hash(self, fp):
+        raise AssertionError(f'{fp} 被再次读取计算哈希')
+
+    monkeypatch.setattr(replace_vars.ScanCache, 'file_hash', fail_file_hash)
+    monkeypatch.setattr(replace_vars.ScanCache, 'put_var_table', lambda self, *args: None)
+    status, logs = replace_vars.exec_replace(package, check=True, use_cache=True)
+    assert status, logs
+    monkeypatch.undo()
+    cache = replace_vars.ScanCache(package)
+    scanned = {rel_path: entry for rel_path, entry in cache.entries.items() if 'keys' in entry}
+    assert scanned
+    for rel_path, entry in scanned.items():
+        assert entry['hash'] == replace_vars.ScanCache(package).file_hash(os.path.join(package, rel_path))
+
+
+def test_cache_detects_same_size_edits(package):
+    status, logs = replace_vars.exec_replace(package, check=True, use_cache=True)
+    assert status, logs
+    touched = os.path.join(package, 'scripts/init.sh')
+    changed = os.path.join(package, 'scripts/conf/app.properties')
+    os.utime(touched, (0, 0))
+    with open(changed, 'r+b') as f:
+        first = f.read(1)
+        f.seek(0)
+        f.write(b'X' if first != b'X' else b'Y')
+    cache = replace_vars.ScanCache(package)
+    assert cache.lookup(touched) is not None
+    assert cache.lookup(changed) is None
+
+
+def test_cache_of_previous_version_is_ignored(package):
+    status, logs = replace_vars.exec_replace(package, check=True, use_cache=True)
+    assert status, logs
+    path = os.path.join(package, replace_vars.SCAN_CACHE_FILE)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    data['version'] = replace_vars.SCAN_CACHE_VERSION - 1
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    cache = replace_vars.ScanCache(package)
+    assert cache.entries == dict() and cache.var_table is None
+
+
+def extract_output(output, dest):
+    if os.path.isdir(output):
+        return output
+    if output.endswith('.zip'):
+        with zipfile.ZipFile(output) as archive:
+            archive.extractall(dest)
+    else:
+        with tarfile.open(output) as archive:
+            archive.extractall(dest)
+    return os.path.join(dest, 'pkg')
+
+
+@pytest.mark.parametrize('output_name', ['hl-out', 'hl-out.zip', 'hl-out.tar.gz'])
+def test_archive_export_keeps_tar_hardlinks(package, tmp_path, output_name):
+    conf = os.path.join(package, 'scripts/conf')
+    write_file(package, 'scripts/artifacts/blob.dat', b'\x1f\x8b\x08\x00' + bytes(range(256)))
+    os.link(os.path.join(conf, 'app.properties'), os.path.join(conf, 'hard.properties'))
+    os.link(os.path.join(package, 'scripts/artifacts/blob.dat'), os.path.join(conf, 'hard.dat'))
+    source = str(tmp_path / 'pkg.tar.gz')
+    with tarfile.open(source, 'w:gz') as archive:
+        archive.add(package, 'pkg')
+    with tarfile.open(source) as archive:
+        assert archive.getmember('pkg/scripts/conf/hard.properties').islnk()
+    status, logs = replace_vars.exec_replace(source, output=str(tmp_path / output_name))
+    assert status, logs
+    status, logs = replace_vars.exec_replace(package, output=str(tmp_path / 'expected'), link_mode='copy')
+    assert status, logs
+    rendered = extract_output(str(tmp_path / output_name), str(tmp_path / 'extracted'))
+    for rel_path in ('conf/hard.properties', 'conf/app.properties', 'conf/hard.dat'):
+        with open(os.path.join(rendered, 'scripts', rel_path), 'rb') as f, \
+                open(os.path.join(str(tmp_path / 'expected'), 'scripts', rel_path), 'rb') as g:
+            assert f.read() == g.read(), rel_path
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7])
+def test_small_chunks_render_the_same_as_the_default_chunk(make_package, chunk_size):
+    expected, package = make_package('default'), make_package('chunked')
+    status, logs = replace_vars.exec_replace(expected)
+    assert status, logs
+    variables = load_variables(package)
+    for rel_path in snapshot(package):
+        replace_vars.stream_replace(os.path.join(package, rel_path), variables, check=False, chunk_size=chunk_size,
+                                    use_mmap=False)
+    assert snapshot(package) == snapshot(expected)
+
+
+def test_chunk_size_must_be_positive(package):
+    templates = snapshot(package)
+    status, logs = replace_vars.exec_replace(package, chunk_size=0)
+    assert not status and '流式读取的块大小需为正整数：0' in [m for m, _ in logs]
+    with pytest.raises(AssertionError):
+        replace_vars.stream_replace(os.path.join(package, 'scripts/init.sh'), load_variables(package), chunk_size=0)
+    assert snapshot(package) == templates
+
+
+@pytest.mark.parametrize('use_mmap, chunk_size', [(True, replace_vars.DEFAULT_CHUNK_SIZE), (False, 1), (False, 5),
+                                                  (False, 80), (False, replace_vars.DEFAULT_CHUNK_SIZE)])
+def test_trie_and_regex_engines_agree(make_package, use_mmap, chunk_size):
+    # 控制符内含有起始标记的占位符，及相邻、未定义的占位符
+    edge = (b'\x02' + b'X' * 10 + b'\x02NOPE\x03' + b'z' * 65 + b'\x02UNDEFINED\x03\x02NAMESPACE\x03\\x02DB_HOST\\x03'
+            + b'\\x02\x02REPLICAS\x03\\x03\x02' + b'Y' * 70 + b'\x03\n')
+    results = dict()
+    for engine in ('regex', 'trie'):
+        package = make_package(engine)
+        write_file(package, 'scripts/edge.sh', edge)
+        variables, results[engine] = load_variables(package), dict()
+        for rel_path in snapshot(package):
+            fp, positions = os.path.join(package, rel_path), []
+            replace_num, matched_keys, missing_keys = replace_vars.stream_replace(
+                fp, variables, check=False, chunk_size=chunk_size, positions=positions, use_mmap=use_mmap,
+                engine=engine)
+            results[engine][rel_path] = (read(fp), replace_num, matched_keys, missing_keys, positions)
+    assert results['trie'] == results['regex']
+    assert results['regex']['scripts/edge.sh'][3] == {'X' * 10 + '\x02NOPE', 'UNDEFINED', '\x02REPLICAS\x03'}
+
+
+@pytest.mark.parametrize('raw_copy', [True, False])
+def test_zip_export_copies_stored_deflated_and_zip64_members(package, tmp_path, monkeypatch, raw_copy):
+    raw_copy or monkeypatch.setattr(replace_vars, 'zip_raw_copy_supported', lambda target: False)
+    write_file(package, 'scripts/artifacts/blob.dat', b'\x1f\x8b\x08\x00' + bytes(range(256)) * 4)
+    source, output = str(tmp_path / 'pkg.zip'), str(tmp_path / 'out.zip')
+    with zipfile.ZipFile(source, 'w') as archive:
+        archive.write(os.path.join(package, 'scripts'), 'pkg/scripts')
+        for fp in iter_files(package):
+            arcname = 'pkg/' + os.path.relpath(fp, package).replace(os.sep, '/')
+            stored = fp.endswith('.dat')
+            archive.write(fp, arcname, zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+        with archive.open('pkg/scripts/artifacts/big.bin', 'w', force_zip64=True) as f:
+            f.write(b'\x00' * 4096)
+    status, logs = replace_vars.exec_replace(source, output=output)
+    assert status, logs
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(output) as out:
+        assert out.testzip() is None
+        assert [i.filename for i in out.infolist()] == [i.filename for i in src.infolist()]
+        for name in ('pkg/scripts/', 'pkg/scripts/conf/readme.txt', 'pkg/scripts/artifacts/blob.dat',
+                     'pkg/scripts/artifacts/big.bin'):
+            assert out.read(name) == src.read(name), name
+            assert out.getinfo(name).compress_type == src.getinfo(name).compress_type, name
+        assert out.read('pkg/scripts/init.sh') == render_expected(src.read('pkg/scripts/init.sh'),
+                                                                   load_variables(package))
+
+
+def test_rerender_updates_file_paths_of_new_variables(package):
+    csv_path = os.path.join(package, 'controls/global-vars.csv')
+    rows = replace_vars.read_controls_csv(csv_path)
+    write_csv(csv_path, [row for row in rows if row[1] != 'DEBUG'])
+    status, logs = replace_vars.exec_replace(package, retain=True)
+    assert status, logs
+    write_csv(csv_path, [*replace_vars.read_controls_csv(csv_path), ['5', 'DEBUG', 'test', '布尔', 'true', '', '']])
+    status, logs = replace_vars.exec_rerender(package)
+    assert status, logs
+    assert b'debug=true' in read(os.path.join(package, 'scripts/conf/app.properties'))
+    file_paths = {row[1]: row[5] for row in replace_vars.read_controls_csv(csv_path)[1:]}
+    assert file_paths['DEBUG'] == 'scripts/conf/app.properties'
+    assert file_paths['NAMESPACE'].split('\n') == ['k8s-resources/app-deployment.yaml', 'scripts/init.sh']